@@ -0,0 +1,258 @@
+import time
+import queue
+import contextlib
+import logging
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Union, Optional, List, Tuple, Dict
+from ..MarketData.aggregates import PolygonAggregatesHandler
+from ..MarketData.memory import MemoryBudget
+from ..Storage.formats import WriteOptions
+from ..Storage.symbols import SymbolDictionary
+from ..Storage.minuteBars import MinuteBarStore
+from .planner import BackfillPlanner, FetchRequest
+from .chunker import AggregatesChunker
+from .ratelimit import RateLimiter
+from ...utils.overhead import PolygonClient
+
+# state of a worker process, set up once by `_init_worker`
+_worker = {}
+
+
+def _init_worker(api_key: str, store_dir: str, symbols_file: str, write_options: Optional[WriteOptions],
+                 tokens: Optional[multiprocessing.Queue], io_threads: int, handler_params: dict,
+                 memory_budget: Optional[int] = None, spill_dir: Optional[str] = None):
+    handler = PolygonAggregatesHandler(polygonCarrier=PolygonClient(api_key))
+    handler.memory_budget = MemoryBudget(memory_budget, spill_dir=spill_dir)
+    _worker.update(
+        handler=handler,
+        # the symbols are only read here: ids are assigned and coverage is marked by the parent
+        store=MinuteBarStore(store_dir, SymbolDictionary(symbols_file), write_options=write_options),
+        tokens=tokens,
+        pool=ThreadPoolExecutor(io_threads),
+        params=handler_params,
+    )
+
+
+def _fetch_unit(ticker: str, request: FetchRequest) -> dict:
+    result = {"ticker": ticker, "start": request.start, "end": request.end, "sessions": request.sessions,
+              "bars": 0, "fetched_at": None, "error": None, "seconds": None, "write_seconds": None}
+    budget = _worker["handler"].memory_budget
+    try:
+        budget.wait()
+        if _worker["tokens"] is not None:
+            _worker["tokens"].get()
+        result["fetched_at"] = pd.Timestamp.now(tz="UTC")
+        started = time.monotonic()
+        data = _worker["handler"].get_aggregates(**{
+            **_worker["params"], "ticker": ticker, "timespan": "minute",
+            "from_": request.start.strftime("%Y-%m-%d"), "to": request.end.strftime("%Y-%m-%d"),
+        }, parse_to_df=True)
+        result["seconds"] = time.monotonic() - started
+        if not isinstance(data, pd.DataFrame):
+            raise ValueError(f"no bars returned, got {type(data)}")
+        nbytes = budget.charge(data)
+        try:
+            if len(data):
+                started = time.monotonic()
+                _worker["store"].upsert_bars(ticker, data)
+                result["write_seconds"] = time.monotonic() - started
+        finally:
+            budget.release(nbytes)
+        result["bars"] = len(data)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _run_shard(units: List[Tuple[str, FetchRequest]]) -> List[dict]:
+    # the requests of a shard are I/O bound: they share the process' thread pool; units of
+    # one ticker and month write the same partition, which `MinuteBarStore` serialises
+    return list(_worker["pool"].map(lambda unit: _fetch_unit(*unit), units))
+
+
+class TokenFeed:
+    """
+    Tokens of the parent's rate limiter handed to worker processes.
+
+    A thread takes tokens from `rate_limiter` and puts them on a bounded queue, from
+    which workers take one per request, so the parent's limiter stays the only bucket:
+    under `JobScheduler` that is the job's `ClassRateLimiter`, and a backfill yields to
+    the higher classes like any other job. At most `ahead` tokens wait in the queue.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, ahead: int):
+        self.rate_limiter = rate_limiter
+        self.tokens = multiprocessing.Queue(ahead)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._feed, name="TokenFeed", daemon=True)
+
+    def _feed(self):
+        while not self._stopped.is_set():
+            self.rate_limiter.acquire()
+            while not self._stopped.is_set():
+                try:
+                    self.tokens.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def __enter__(self) -> "TokenFeed":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # not joined: the thread may be waiting on a busy class, it stops after that token
+        self._stopped.set()
+        self.tokens.cancel_join_thread()
+
+
+class MinuteBackfill:
+    """
+    Minute bars for a whole universe over a date range.
+
+    The work is split into (ticker, window) units: for every ticker, the sessions not yet
+    in the store's coverage bitmap are cut into windows by `chunker`, each of at most a
+    request's worth of bars (or, without one, of at most `window_sessions` consecutive
+    sessions). Units are grouped into shards of whole tickers and run on a pool
+    of `processes` worker processes, each fetching its units on `io_threads` threads and
+    writing the bars straight into the store; a ticker's partitions are only ever
+    written by one process.
+
+    Coverage is marked by this process as shards complete, for the sessions that were
+    final when fetched, so an interrupted backfill resumes with the units that were not
+    done; bars written by an unfinished shard are simply fetched and upserted again.
+    The workers take their tokens from `rate_limiter` through a `TokenFeed`, so they
+    share it with the rest of the process; `memory_budget` bytes apply to each of them
+    (see `MemoryBudget`).
+    """
+
+    def __init__(self,
+                 store: MinuteBarStore,
+                 planner: BackfillPlanner,
+                 api_key: str,
+                 processes: int = 4,
+                 io_threads: int = 8,
+                 window_sessions: int = 20,
+                 chunker: Optional[AggregatesChunker] = None,
+                 tickers_per_shard: Optional[int] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 handler_params: Optional[dict] = None,
+                 memory_budget: Optional[int] = None,
+                 spill_dir: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.store = store
+        self.planner = planner
+        self.api_key = api_key
+        self.processes = processes
+        self.io_threads = io_threads
+        self.window_sessions = window_sessions
+        self.chunker = chunker
+        self.tickers_per_shard = tickers_per_shard
+        self.rate_limiter = rate_limiter
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.handler_params = {k: v for k, v in (handler_params or {}).items()
+                               if k not in ["ticker", "timespan", "from_", "to"]}
+
+    def plan(self,
+             tickers: List[str],
+             start_date: Union[str, dt.datetime, pd.Timestamp],
+             end_date: Union[str, dt.datetime, pd.Timestamp],
+             overwrite_existing: bool = False) -> List[Tuple[str, FetchRequest]]:
+        """(ticker, window) units still to fetch; sessions already covered are left out"""
+        sessions = self.planner.market_time_resolver.get_market_days(start_date, end_date)
+        sessions = pd.DatetimeIndex(self.planner.complete_sessions(sessions, pd.Timestamp.now(tz="UTC")))
+        positions = np.arange(len(sessions))
+        units = []
+        for ticker in tickers:
+            todo = (np.ones(len(sessions), dtype=bool) if overwrite_existing
+                    else ~self.store.coverage.covered(ticker, sessions))
+            if not todo.any():
+                continue
+            requests = (self.chunker.chunk(start_date, end_date, sessions=sessions[todo]) if self.chunker
+                        else self.planner.coalesce(sessions[todo], positions[todo],
+                                                   max_sessions_per_request=self.window_sessions))
+            units.extend((ticker, request) for request in requests)
+        self.logger.info(f"Planned {len(units)} units for {len(tickers)} tickers, "
+                         f"{len(sessions)} sessions between {start_date} and {end_date}")
+        return units
+
+    def _shards(self, units: List[Tuple[str, FetchRequest]]) -> List[List[Tuple[str, FetchRequest]]]:
+        by_ticker: Dict[str, list] = {}
+        for ticker, request in units:
+            by_ticker.setdefault(ticker, []).append((ticker, request))
+        # a few shards per process so that a slow shard does not hold up the tail
+        tickers_per_shard = self.tickers_per_shard or max(1, len(by_ticker) // (8 * self.processes))
+        groups = list(by_ticker.values())
+        return [[unit for group in groups[i:i + tickers_per_shard] for unit in group]
+                for i in range(0, len(groups), tickers_per_shard)]
+
+    def run(self,
+            tickers: List[str],
+            start_date: Union[str, dt.datetime, pd.Timestamp],
+            end_date: Union[str, dt.datetime, pd.Timestamp],
+            overwrite_existing: bool = False,
+            metrics=None) -> pd.DataFrame:
+        """
+        Backfill `tickers` over [start_date, end_date], recording the units in `metrics`
+        (a `JobMetrics`) as their shards complete.
+
+        Returns:
+            DataFrame: One row per unit with its ticker, window, bars written and error, if any
+        """
+        # ids are handed out (and saved) here, before the workers load the dictionary
+        self.store.symbols.ids(tickers)
+        units = self.plan(tickers, start_date, end_date, overwrite_existing)
+        shards = self._shards(units)
+        if metrics is not None:
+            metrics.plan(len(units))
+        limited = self.rate_limiter is not None and not self.rate_limiter.unlimited
+        feed = TokenFeed(self.rate_limiter, ahead=self.processes) if limited else None
+        initargs = (self.api_key, str(self.store.root_dir), str(self.store.symbols.path), self.store.write_options,
+                    feed.tokens if feed else None, self.io_threads, self.handler_params, self.memory_budget,
+                    self.spill_dir)
+
+        results, bars, started = [], 0, time.monotonic()
+        with feed or contextlib.nullcontext(), \
+                ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=initargs) as pool:
+            for done, future in enumerate(as_completed([pool.submit(_run_shard, shard) for shard in shards]), 1):
+                shard_results = future.result()
+                self._mark_covered(shard_results)
+                if metrics is not None:
+                    self._record(metrics, shard_results)
+                results.extend(shard_results)
+                bars += sum(result["bars"] for result in shard_results)
+                elapsed = time.monotonic() - started
+                self.logger.info(f"Shard {done}/{len(shards)}: {len(results)}/{len(units)} units, "
+                                 f"{bars:,} bars in {elapsed:.0f}s, {bars / max(elapsed, 1e-9):,.0f} bars/s")
+
+        results = pd.DataFrame(results, columns=["ticker", "start", "end", "sessions", "bars", "fetched_at", "error"])
+        failed = results["error"].notna().sum() if len(results) else 0
+        elapsed = time.monotonic() - started
+        self.logger.info(f"Backfilled {bars:,} bars for {results['ticker'].nunique() if len(results) else 0} "
+                         f"tickers in {elapsed:.0f}s ({bars / max(elapsed, 1e-9):,.0f} bars/s), {failed} units failed")
+        return results.drop(columns=["sessions"])
+
+    @staticmethod
+    def _record(metrics, shard_results: List[dict]):
+        for result in shard_results:
+            if result["seconds"] is not None:
+                metrics.request(result["seconds"])
+                metrics.rows(result["bars"])
+            if result["write_seconds"] is not None:
+                metrics.write(result["write_seconds"])
+            metrics.unit_done(failed=result["error"] is not None)
+
+    def _mark_covered(self, shard_results: List[dict]):
+        covered: Dict[str, list] = {}
+        for result in shard_results:
+            if result["error"] is None:
+                covered.setdefault(result["ticker"], []).extend(
+                    self.planner.complete_sessions(result["sessions"], result["fetched_at"]))
+        for ticker, sessions in covered.items():
+            self.store.coverage.mark(ticker, sessions)
@@ -0,0 +1,101 @@
+import math
+import logging
+import numpy as np
+import pandas as pd
+import datetime as dt
+from typing import Union, Optional, List, Iterable
+from .planner import FetchRequest
+
+# bar length of each timespan in seconds; timespans of a day or longer yield at most one
+# bar per session
+TIMESPAN_SECONDS = {"second": 1, "minute": 60, "hour": 3600}
+SESSION_TIMESPANS = ["day", "week", "month", "quarter", "year"]
+
+
+class AggregatesChunker:
+    """
+    Splits a range of sessions into the fewest aggregates requests that each return at
+    most `limit` bars, so no request needs `next_url` pagination and none is wasted on a
+    sliver of the range.
+
+    Bars per session are estimated from the calendar: the session length (pre-market to
+    the end of after-hours trading with `extended_hours`, early closes included) divided
+    by the base bar length. Polygon's `limit` counts base aggregates, so a 5-minute
+    request spends the limit like a 1-minute one and the multiplier is not part of the
+    estimate. That is an upper bound, as thinly traded minutes have no bar; `headroom`
+    keeps a margin for calendar differences. Minute bars over 16-hour extended sessions
+    come to 960 a session, about 51 sessions a request.
+    """
+
+    def __init__(self,
+                 market_time_resolver,
+                 limit: int = 50000,
+                 extended_hours: bool = True,
+                 headroom: float = 0.98):
+        self.logger = logging.getLogger(__name__)
+        self.market_time_resolver = market_time_resolver
+        self.limit = limit
+        self.extended_hours = extended_hours
+        self.headroom = headroom
+        # the calendar is the same for every ticker of a range
+        self._bars = {}
+
+    def bars_per_session(self,
+                         start_date: Union[str, dt.datetime, pd.Timestamp],
+                         end_date: Union[str, dt.datetime, pd.Timestamp],
+                         multiplier: int = 1,
+                         timespan: str = "minute") -> pd.Series:
+        """
+        Upper bound of the base aggregates of every session in [start_date, end_date], the
+        unit of `limit`; a request returns about `multiplier` times fewer bars
+        """
+        key = (pd.Timestamp(start_date), pd.Timestamp(end_date), timespan)
+        if key not in self._bars:
+            self._bars[key] = self._bars_per_session(*key)
+        return self._bars[key]
+
+    def _bars_per_session(self, start_date, end_date, timespan) -> pd.Series:
+        hours = self.market_time_resolver.get_detail_hours(start_date, end_date, extended=self.extended_hours)
+        if timespan in SESSION_TIMESPANS:
+            return pd.Series(1, index=hours.index)
+        if timespan not in TIMESPAN_SECONDS:
+            raise ValueError(f"Invalid timespan value {timespan}")
+        first, last = ("pre", "post") if self.extended_hours else ("market_open", "market_close")
+        seconds = (hours[last] - hours[first]).dt.total_seconds()
+        return np.ceil(seconds / TIMESPAN_SECONDS[timespan]).astype(int)
+
+    def chunk(self,
+              start_date: Union[str, dt.datetime, pd.Timestamp],
+              end_date: Union[str, dt.datetime, pd.Timestamp],
+              multiplier: int = 1,
+              timespan: str = "minute",
+              sessions: Optional[Iterable[pd.Timestamp]] = None) -> List[FetchRequest]:
+        """
+        Windows covering `sessions` (default: every session in [start_date, end_date]).
+        A window never spans a session left out of `sessions`, so stored sessions between
+        two gaps are not fetched again.
+        """
+        bars = self.bars_per_session(start_date, end_date, multiplier, timespan)
+        positions = pd.Series(np.arange(len(bars)), index=bars.index)
+        if sessions is not None:
+            wanted = pd.DatetimeIndex(list(sessions)).normalize()
+            bars = bars[bars.index.isin(wanted)]
+            positions = positions[bars.index]
+        budget = math.floor(self.limit * self.headroom)
+        if (bars > budget).any():
+            self.logger.warning(f"Sessions with more than {budget} {timespan} aggregates "
+                                f"will be paginated")
+
+        # greedy is optimal here: closing a window only when the next session would not
+        # fit gives the fewest windows over a sequence of sessions
+        requests, run, total, last = [], [], 0, None
+        for session, count, pos in zip(bars.index, bars.to_numpy(), positions.to_numpy()):
+            if run and (pos != last + 1 or total + count > budget):
+                requests.append(FetchRequest(run[0], run[-1], run))
+                run, total = [], 0
+            run.append(session)
+            total += count
+            last = pos
+        if run:
+            requests.append(FetchRequest(run[0], run[-1], run))
+        return requests
@@ -0,0 +1,159 @@
+import logging
+import threading
+import pandas as pd
+import datetime as dt
+from dataclasses import dataclass, field
+from typing import Optional, List, Callable
+
+
+@dataclass
+class DaemonJob:
+    """A `get_data` call the daemon makes, with its arguments"""
+    job_name: str
+    args: list = field(default_factory=list)
+    kwargs: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "DaemonJob":
+        if "job" not in config:
+            raise ValueError(f"Invalid daemon job {config}, should have a 'job' key")
+        return cls(config["job"], list(config.get("args") or []), dict(config.get("kwargs") or {}))
+
+    def __str__(self):
+        return " ".join([self.job_name] + [str(arg) for arg in self.args])
+
+
+class MarketDaemon:
+    """
+    Long-running loop that fires the end-of-day jobs when a session's data is out,
+    instead of a cron job polling at a fixed time.
+
+    The schedule comes from `MarketTime.get_detail_hours`, so early closes move the
+    run earlier and holidays and weekends are skipped. The first attempt is made at the
+    session close plus the planner's publish delay; jobs whose session is not complete
+    yet (`EnhancedTaskRabbit.is_session_complete`) are run again with an exponential
+    backoff until it is, or until `give_up` after the close. On start, the last closed
+    session is caught up at once.
+
+    While a session is open, `intraday_jobs` (if any) run every `intraday_interval`.
+    Jobs go through a `JobScheduler` when one is given: end-of-day ones as `latest`,
+    intraday ones as `realtime`.
+    """
+
+    def __init__(self,
+                 rabbit,
+                 eod_jobs: List[DaemonJob],
+                 intraday_jobs: Optional[List[DaemonJob]] = None,
+                 intraday_interval: dt.timedelta = dt.timedelta(minutes=15),
+                 poll_backoff: dt.timedelta = dt.timedelta(minutes=1),
+                 poll_backoff_max: dt.timedelta = dt.timedelta(minutes=30),
+                 give_up: dt.timedelta = dt.timedelta(hours=12),
+                 scheduler=None,
+                 clock: Callable[[], pd.Timestamp] = lambda: pd.Timestamp.now(tz="US/Eastern")):
+        self.logger = logging.getLogger(__name__)
+        self.rabbit = rabbit
+        self.eod_jobs = eod_jobs
+        self.intraday_jobs = intraday_jobs or []
+        self.intraday_interval = intraday_interval
+        self.poll_backoff = poll_backoff
+        self.poll_backoff_max = poll_backoff_max
+        self.give_up = give_up
+        self.scheduler = scheduler
+        self.clock = clock
+        self.publish_delay = rabbit.planner.publish_delay
+        self._stop = threading.Event()
+
+    def sessions(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        """Open, close and publish time (close + publish delay) of the sessions in [start, end]"""
+        hours = self.rabbit.market_time_resolver.get_detail_hours(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+        hours = hours[["market_open", "market_close"]].copy()
+        hours["published"] = hours["market_close"] + self.publish_delay
+        return hours
+
+    def stop(self):
+        self._stop.set()
+
+    def _sleep_until(self, when: pd.Timestamp) -> bool:
+        """Sleep until `when`; False if the daemon was stopped meanwhile"""
+        seconds = (when - self.clock()).total_seconds()
+        return not self._stop.wait(max(0.0, seconds))
+
+    def _run(self, job: DaemonJob, priority_class: str):
+        try:
+            if self.scheduler is not None:
+                return self.scheduler.submit(job.job_name, *job.args, priority_class=priority_class,
+                                             **job.kwargs).result()
+            return self.rabbit.get_data(job.job_name, *job.args, **job.kwargs)
+        except Exception as e:
+            self.logger.error(f"{job} failed: {e}")
+            return e
+
+    def run_session(self, session: pd.Timestamp, close: pd.Timestamp) -> bool:
+        """
+        Run the end-of-day jobs for `session` until each one reports the session complete,
+        backing off between attempts. Returns whether all of them did before giving up.
+        """
+        pending, backoff, attempt = list(self.eod_jobs), self.poll_backoff, 0
+        # a session caught up late still gets the full `give_up` window
+        deadline = max(close, self.clock()) + self.give_up
+        while pending:
+            attempt += 1
+            for job in pending:
+                self._run(job, "latest")
+            # a job without a completeness check is done once it ran without raising
+            pending = [job for job in pending
+                       if self.rabbit.is_session_complete(job.job_name, session, *job.args, **job.kwargs) is False]
+            if not pending:
+                break
+            retry_at = self.clock() + backoff
+            if retry_at > deadline:
+                self.logger.error(f"Giving up on {session.date()} after {attempt} attempts, "
+                                  f"incomplete: {', '.join(map(str, pending))}")
+                return False
+            self.logger.info(f"{session.date()} not complete yet for {', '.join(map(str, pending))}, "
+                             f"retrying at {retry_at:%H:%M:%S}")
+            if not self._sleep_until(retry_at):
+                return False
+            backoff = min(2 * backoff, self.poll_backoff_max)
+        self.logger.info(f"{session.date()} complete after {attempt} attempts")
+        return True
+
+    def _intraday(self, open_: pd.Timestamp, close: pd.Timestamp):
+        """Run the intraday jobs every `intraday_interval` until the close"""
+        next_run = max(open_, self.clock())
+        while next_run < close:
+            if not self._sleep_until(next_run):
+                return
+            for job in self.intraday_jobs:
+                self._run(job, "realtime")
+            next_run = max(next_run + self.intraday_interval, self.clock())
+        self._sleep_until(close)
+
+    def run_forever(self):
+        """Catch up on the last closed session, then follow the calendar until `stop`"""
+        done = None
+        while not self._stop.is_set():
+            now = self.clock()
+            # a fortnight either side holds a session whatever the holidays
+            hours = self.sessions(now - pd.Timedelta(days=14), now + pd.Timedelta(days=14))
+            published = hours[hours["published"] <= now]
+            if len(published) and published.index[-1] != done:
+                done = published.index[-1]
+                self.run_session(done, published["market_close"].iloc[-1])
+                continue
+
+            upcoming = hours[hours["published"] > now]
+            if not len(upcoming):
+                raise ValueError(f"Invalid calendar, no session after {now}")
+            session, open_, close, publish = upcoming.index[0], *upcoming.iloc[0]
+            if self.intraday_jobs and now < close:
+                if now < open_:
+                    self.logger.info(f"Next session {session.date()} opens at {open_:%Y-%m-%d %H:%M %Z}")
+                    if not self._sleep_until(open_):
+                        return
+                self._intraday(open_, close)
+                continue
+            self.logger.info(f"Next session {session.date()} closes at {close:%Y-%m-%d %H:%M %Z}, "
+                             f"waking at {publish:%H:%M}")
+            if not self._sleep_until(publish):
+                return
@@ -0,0 +1,84 @@
+import math
+import pandas as pd
+import datetime as dt
+from dataclasses import dataclass
+from typing import Optional
+
+# uncompressed JSON bytes of one result, as sent by the API; a bar is ~110 bytes
+# ({"v":..,"vw":..,"o":..,"c":..,"h":..,"l":..,"t":..,"n":..}), a grouped daily row adds the ticker
+BYTES_PER_RESULT = {"grouped_daily": 130, "aggregates": 110}
+PLAN_COLUMNS = ["ticker", "start", "end", "sessions", "results", "pages", "bytes"]
+
+
+@dataclass
+class JobPlan:
+    """
+    The requests a job would make, with what they are expected to cost.
+
+    `requests` has one row per request: its ticker (None for market-wide endpoints),
+    window, number of sessions, expected results, pages (results over the page `limit`)
+    and bytes. Wall time assumes the pages are spread over `workers` concurrent
+    requests of `latency` seconds each, capped by `requests_per_minute`.
+    """
+    job_name: str
+    mode: str
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    requests: pd.DataFrame
+    workers: int
+    latency: float
+    requests_per_minute: Optional[float] = None
+
+    @property
+    def pages(self) -> int:
+        return int(self.requests["pages"].sum())
+
+    @property
+    def bytes(self) -> int:
+        return int(self.requests["bytes"].sum())
+
+    @property
+    def requests_per_second(self) -> float:
+        rate = self.workers / self.latency
+        return min(rate, self.requests_per_minute / 60) if self.requests_per_minute else rate
+
+    @property
+    def wall_seconds(self) -> float:
+        # bound by the rate limit, or by the busiest worker doing its share of the pages
+        return max(self.pages / self.requests_per_second, math.ceil(self.pages / self.workers) * self.latency)
+
+    def summary(self) -> dict:
+        return {
+            "job": self.job_name,
+            "mode": self.mode,
+            "range": f"{pd.Timestamp(self.start_date):%Y-%m-%d} to {pd.Timestamp(self.end_date):%Y-%m-%d}",
+            "tickers": int(self.requests["ticker"].nunique()),
+            "requests": len(self.requests),
+            "sessions": int(self.requests["sessions"].sum()),
+            "expected results": int(self.requests["results"].sum()),
+            "expected pages": self.pages,
+            "estimated bytes": format_bytes(self.bytes),
+            "concurrency": f"{self.workers} x {self.latency:g}s requests, "
+                           f"{self.requests_per_minute or 'unlimited'} requests/minute",
+            "estimated wall time": str(dt.timedelta(seconds=round(self.wall_seconds))),
+        }
+
+    def to_string(self, max_rows: Optional[int] = 20) -> str:
+        summary = self.summary()
+        width = max(map(len, summary))
+        lines = [f"{key:<{width}}  {value}" for key, value in summary.items()]
+        if len(self.requests):
+            lines += ["", self.requests.to_string(index=False, max_rows=max_rows)]
+        return "\n".join(lines)
+
+
+def format_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024 or unit == "TB":
+            return f"{size:,.1f} {unit}"
+        size /= 1024
+
+
+def plan_frame(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS).astype({"sessions": int, "results": int, "pages": int,
+                                                            "bytes": "int64"})
@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import logging
+import threading
+import pandas as pd
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Union, Optional, List, Dict, Iterable, Callable, Tuple
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    collected INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    UNIQUE (job, endpoint, ticker, start, end)
+);
+CREATE INDEX IF NOT EXISTS units_status ON units (job, status, shard);
+CREATE INDEX IF NOT EXISTS units_ticker ON units (job, ticker, status);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    heartbeat REAL NOT NULL
+);
+"""
+UNIT_STATUSES = ["pending", "leased", "done", "failed"]
+
+
+@dataclass
+class WorkUnit:
+    """One (endpoint, ticker, window) request of a job; `payload` is anything JSON the executor needs"""
+    endpoint: str
+    ticker: str
+    start: pd.Timestamp
+    end: pd.Timestamp
+    payload: dict = field(default_factory=dict)
+
+
+@dataclass
+class Lease:
+    """A unit leased to a worker until it is completed, failed or the lease expires"""
+    id: int
+    unit: WorkUnit
+    attempts: int
+
+
+class JobQueue:
+    """
+    Durable queue of work units shared by worker processes on any number of machines,
+    backed by a single SQLite file (nothing to run; put it on a shared directory for
+    several nodes, with `journal_mode="DELETE"` on network file systems, which cannot
+    share WAL memory).
+
+    Units are leased for `lease_seconds` and kept alive by heartbeats; a unit whose worker
+    died is leased again once its lease expires. A failed unit is retried after an
+    exponential backoff, up to `max_attempts` leases. Enqueuing the same (job, endpoint,
+    ticker, window) twice is a no-op, so every node may plan and enqueue the same job.
+
+    Units are sharded by ticker hash and the shards are split between the live workers
+    of a job, which lease from their own shards first and steal from the others' once
+    theirs are drained. A ticker's units are never leased to two workers at the same
+    time, as they write the same partitions.
+    """
+
+    def __init__(self,
+                 path: Union[str, Path],
+                 lease_seconds: float = 120,
+                 max_attempts: int = 5,
+                 retry_backoff: float = 30,
+                 num_shards: int = 64,
+                 journal_mode: str = "WAL",
+                 timeout: float = 60):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.num_shards = num_shards
+        self.journal_mode = journal_mode
+        self.timeout = timeout
+        # sqlite connections cannot be shared between threads
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection().executescript(QUEUE_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers never select the same units
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def shard_of(self, ticker: str) -> int:
+        return zlib.crc32(ticker.encode()) % self.num_shards
+
+    @staticmethod
+    def _unit(row: tuple) -> WorkUnit:
+        endpoint, ticker, start, end, payload = row
+        return WorkUnit(endpoint, ticker, pd.Timestamp(start), pd.Timestamp(end), json.loads(payload or "{}"))
+
+    def enqueue(self, job: str, units: Iterable[WorkUnit], reset: bool = False) -> int:
+        """
+        Add `units` to `job`. Units already queued are left as they are, unless `reset`
+        puts the ones that are not leased back to pending. Returns the units added or reset.
+        """
+        now = time.time()
+        rows = [(job, unit.endpoint, unit.ticker, unit.start.strftime("%Y-%m-%d"), unit.end.strftime("%Y-%m-%d"),
+                 self.shard_of(unit.ticker), json.dumps(unit.payload, default=str), now) for unit in units]
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO units (job, endpoint, ticker, start, end, shard, payload, "
+                                   "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if reset:
+                connection.executemany(
+                    "UPDATE units SET status = 'pending', attempts = 0, available_at = 0, error = NULL, "
+                    "collected = 0, payload = ?, updated_at = ? WHERE job = ? AND endpoint = ? AND ticker = ? "
+                    "AND start = ? AND end = ? AND status IN ('done', 'failed')",
+                    [(row[6], now) + row[:5] for row in rows])
+            changed = connection.total_changes - before
+        self.logger.info(f"Queued {changed} of {len(rows)} units for {job}")
+        return changed
+
+    def _own_shards(self, connection: sqlite3.Connection, job: str, worker: str, now: float) -> Tuple[int, int]:
+        """(position, count) of `worker` among the live workers of `job`: it owns shards with shard % count == position"""
+        connection.execute("INSERT INTO workers (worker, job, heartbeat) VALUES (?, ?, ?) "
+                           "ON CONFLICT (worker) DO UPDATE SET job = excluded.job, heartbeat = excluded.heartbeat",
+                           (worker, job, now))
+        live = [row[0] for row in connection.execute(
+            "SELECT worker FROM workers WHERE job = ? AND heartbeat >= ? ORDER BY worker",
+            (job, now - self.lease_seconds))]
+        return live.index(worker), len(live)
+
+    def lease(self, job: str, worker: str, max_units: int = 1) -> List[Lease]:
+        """Lease up to `max_units` units of `job`: pending ones, due retries and units whose lease expired"""
+        now = time.time()
+        with self._transaction() as connection:
+            # units whose last lease expired after the final attempt are given up on
+            connection.execute("UPDATE units SET status = 'failed', error = COALESCE(error, 'lease expired'), "
+                               "updated_at = ? WHERE job = ? AND status = 'leased' AND lease_expires < ? "
+                               "AND attempts >= ?", (now, job, now, self.max_attempts))
+            position, count = self._own_shards(connection, job, worker, now)
+            rows = connection.execute(
+                """
+                SELECT id, attempts, endpoint, ticker, start, end, payload FROM units u
+                WHERE job = ? AND available_at <= ?
+                  AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                  AND NOT EXISTS (SELECT 1 FROM units o WHERE o.job = u.job AND o.ticker = u.ticker
+                                  AND o.status = 'leased' AND o.lease_expires >= ? AND o.worker != ?)
+                ORDER BY (shard % ? = ?) DESC, shard, ticker, start
+                LIMIT ?
+                """, (job, now, now, now, worker, count, position, max_units)).fetchall()
+            connection.executemany("UPDATE units SET status = 'leased', worker = ?, lease_expires = ?, "
+                                   "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                                   [(worker, now + self.lease_seconds, now, row[0]) for row in rows])
+        return [Lease(row[0], self._unit(row[2:]), row[1] + 1) for row in rows]
+
+    def heartbeat(self, job: str, worker: str, lease_ids: Iterable[int]) -> List[int]:
+        """Extend the leases of `worker`. Returns the ids it no longer holds."""
+        lease_ids, now = list(lease_ids), time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE workers SET heartbeat = ? WHERE worker = ?", (now, worker))
+            connection.executemany("UPDATE units SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                                   [(now + self.lease_seconds, lease_id, worker) for lease_id in lease_ids])
+            held = {row[0] for row in connection.execute(
+                "SELECT id FROM units WHERE job = ? AND worker = ? AND status = 'leased'", (job, worker))}
+        return [lease_id for lease_id in lease_ids if lease_id not in held]
+
+    def complete(self, lease: Lease, worker: str, result: Optional[dict] = None) -> bool:
+        """Mark a leased unit done. False if the lease was lost to another worker meanwhile."""
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE units SET status = 'done', result = ?, error = NULL, updated_at = ? "
+                                        "WHERE id = ? AND worker = ? AND status = 'leased'",
+                                        (json.dumps(result, default=str), time.time(), lease.id, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, lease: Lease, worker: str, error: str) -> bool:
+        """Give a leased unit back to be retried after a backoff, or fail it after `max_attempts`"""
+        now = time.time()
+        retry_at = now + self.retry_backoff * 2 ** (lease.attempts - 1)
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "available_at = ?, error = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, retry_at, error, now, lease.id, worker))
+        return cursor.rowcount == 1
+
+    def release(self, job: str, worker: str):
+        """Hand back every unit `worker` holds, without counting the attempt, and leave the job"""
+        with self._transaction() as connection:
+            connection.execute("UPDATE units SET status = 'pending', attempts = attempts - 1, updated_at = ? "
+                               "WHERE job = ? AND worker = ? AND status = 'leased'", (time.time(), job, worker))
+            connection.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+    def collect(self, job: str, limit: Optional[int] = None) -> List[Tuple[WorkUnit, dict]]:
+        """Done units not collected yet, with their results; each is returned to one caller only"""
+        with self._transaction() as connection:
+            rows = connection.execute("SELECT id, endpoint, ticker, start, end, payload, result FROM units "
+                                      "WHERE job = ? AND status = 'done' AND collected = 0 ORDER BY id LIMIT ?",
+                                      (job, -1 if limit is None else limit)).fetchall()
+            connection.executemany("UPDATE units SET collected = 1 WHERE id = ?", [(row[0],) for row in rows])
+        return [(self._unit(row[1:6]), json.loads(row[6] or "null")) for row in rows]
+
+    def retry_failed(self, job: str) -> int:
+        """Put failed units back to pending with a fresh attempt budget"""
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE units SET status = 'pending', attempts = 0, available_at = 0, "
+                                        "updated_at = ? WHERE job = ? AND status = 'failed'", (time.time(), job))
+        return cursor.rowcount
+
+    def counts(self, job: str) -> Dict[str, int]:
+        """Number of units of `job` per status"""
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM units WHERE job = ? GROUP BY status",
+                                                 (job,)).fetchall())
+        return {status: counts.get(status, 0) for status in UNIT_STATUSES}
+
+    def is_drained(self, job: str) -> bool:
+        """Whether `job` has no pending or leased unit left"""
+        counts = self.counts(job)
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+    def failures(self, job: str) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT endpoint, ticker, start, end, attempts, error FROM units "
+                                 "WHERE job = ? AND status = 'failed' ORDER BY ticker, start",
+                                 self._connection(), params=(job,))
+
+
+class QueueWorker:
+    """
+    Runs the units of a `JobQueue` job on `threads` threads until the job is drained.
+
+    `execute` is called with each `WorkUnit` and returns a JSON-able result, stored with
+    the done unit; an exception fails the unit, to be retried. Leases are renewed from a
+    heartbeat thread every third of the lease time. Workers on several machines (or
+    several processes on one) just run the same job against the same queue file.
+    """
+
+    def __init__(self,
+                 queue: JobQueue,
+                 job: str,
+                 execute: Callable[[WorkUnit], Optional[dict]],
+                 worker_id: Optional[str] = None,
+                 threads: int = 4,
+                 idle_sleep: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.queue = queue
+        self.job = job
+        self.execute = execute
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = threads
+        self.idle_sleep = idle_sleep
+        self._held: Dict[int, Lease] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            try:
+                lost = self.queue.heartbeat(self.job, self.worker_id, held)
+            except sqlite3.Error as e:
+                self.logger.warning(f"Heartbeat of {self.worker_id} failed: {e}")
+                continue
+            if lost:
+                self.logger.warning(f"{self.worker_id} lost the leases of units {lost}")
+
+    def _run_unit(self, lease: Lease) -> Optional[dict]:
+        try:
+            return self.execute(lease.unit)
+        finally:
+            with self._lock:
+                self._held.pop(lease.id, None)
+
+    def run(self, on_progress: Optional[Callable[[], None]] = None) -> Dict[str, int]:
+        """
+        Work until the job is drained. `on_progress` is called after every unit and while
+        idle (e.g. to collect results). Returns the units this worker completed and failed.
+        """
+        stats = {"done": 0, "failed": 0, "lost": 0}
+        heartbeat = threading.Thread(target=self._heartbeat, name="QueueWorker-heartbeat", daemon=True)
+        heartbeat.start()
+        running = {}
+        try:
+            with ThreadPoolExecutor(self.threads) as pool:
+                while True:
+                    if len(running) < self.threads:
+                        for lease in self.queue.lease(self.job, self.worker_id, self.threads - len(running)):
+                            with self._lock:
+                                self._held[lease.id] = lease
+                            running[pool.submit(self._run_unit, lease)] = lease
+                    if not running:
+                        if self.queue.is_drained(self.job):
+                            break
+                        # units are held by other workers or waiting out a retry backoff
+                        if on_progress:
+                            on_progress()
+                        time.sleep(self.idle_sleep)
+                        continue
+                    done, _ = wait(running, timeout=self.idle_sleep, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        lease = running.pop(future)
+                        try:
+                            recorded = self.queue.complete(lease, self.worker_id, future.result())
+                            stats["done" if recorded else "lost"] += 1
+                        except Exception as e:
+                            self.logger.error(f"Unit {lease.unit.ticker} {lease.unit.start:%Y-%m-%d} to "
+                                              f"{lease.unit.end:%Y-%m-%d} failed (attempt {lease.attempts}): {e}")
+                            self.queue.fail(lease, self.worker_id, f"{type(e).__name__}: {e}")
+                            stats["failed"] += 1
+                    if done and on_progress:
+                        on_progress()
+        finally:
+            self._stop.set()
+            heartbeat.join()
+            self.queue.release(self.job, self.worker_id)
+        self.logger.info(f"{self.worker_id} done with {self.job}: {stats}")
+        return stats
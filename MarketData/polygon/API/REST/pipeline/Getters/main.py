@@ -1,43 +1,206 @@
 import os
+import time
 import yaml
 import logging
 import pandas as pd
 import numpy as np
 import datetime as dt
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from ..MarketData.groupedDaily import PolygonGroupedDailyHandler
 from ..MarketData.aggregates import PolygonAggregatesHandler
 from ..MarketData.tickerTypes import PolygonTickerTypesHandler
 from ..MarketData.marketHolidays import PolygonMarketHolidaysHandler
 from ..MarketData.tickers import PolygonListTickersHandler
+from ..MarketData.ticks import PolygonTradesHandler, PolygonQuotesHandler
+from ..MarketData.parsing import ParsePool
+from ..MarketData.memory import MemoryBudget
 from ..MarketData.tickerTypes import PolygonTickerTypesHandler
+from ..Storage.manifest import DatasetManifest
+from ..Storage.writer import BackgroundWriter
+from ..Storage.formats import WriteOptions
+from ..Storage.checkpoints import CheckpointStore
+from ..Storage.transpose import GroupedDailyTransposer
+from ..Storage.symbols import SymbolDictionary
+from ..Storage.panels import PanelStore
+from ..Storage.universe import UniverseStore
+from ..Storage.minuteBars import MinuteBarStore
+from ..Storage.ticks import TickStore
+from ..Storage.flatfiles import FlatFileImporter
+from .planner import BackfillPlanner
+from .ratelimit import RateLimiter
+from .backfill import MinuteBackfill
+from .chunker import AggregatesChunker
+from .jobqueue import JobQueue, QueueWorker, WorkUnit
+from .scheduler import JobScheduler
+from .daemon import MarketDaemon, DaemonJob
+from .estimates import JobPlan, BYTES_PER_RESULT, plan_frame
+from .metrics import MetricsRegistry, ProgressReporter
 from ... import utils
 from ...utils.overhead import PolygonClient
 
+# metrics registries by port, see TaskRabbit.get_metrics
+_METRICS_REGISTRIES = {}
+
 
 class TaskRabbit:
     def __init__(self, params_config_file, client_params={}):
         self.logger = logging.getLogger(__name__)
+        self.params_config_file = params_config_file
         self.params_config = yaml.load(open(params_config_file), Loader=yaml.FullLoader)
         self.client = self.get_client(**client_params)
         self.market_time_resolver = self.get_market_time_resolver()
+        self.planner = self.get_planner()
+        self.rate_limiter = self.get_rate_limiter()
+        self.memory_budget = self.get_memory_budget()
+        self.metrics = self.get_metrics()
+        # started on first use; a dict so the copies made by the scheduler share the pool
+        self._parse_pools = {}
 
     def get_client(self, client_params={}):
         return PolygonClient(**client_params).get_polygon_client()
 
     def get_market_time_resolver(self):
         return utils.datetimes.MarketTime(self.params_config["global"].get("market_name", None))
-    
 
-class PrepareTaskRabbit(TaskRabbit):
-    def __init__(self, params_config_file, client_params={}):
-        super().__init__(params_config_file, client_params)
+    def get_planner(self):
+        publish_delay = self.params_config["global"].get("publish_delay_minutes", 30)
+        return BackfillPlanner(self.market_time_resolver, publish_delay=dt.timedelta(minutes=publish_delay))
+
+    def get_rate_limiter(self):
+        # one limiter per rabbit: every job and worker thread shares the plan's limit
+        return RateLimiter(self.params_config["global"].get("requests_per_minute", None))
+
+    def get_memory_budget(self):
+        # one budget per rabbit, like the rate limiter: every job and fetch thread of the process shares it
+        budget_mb = self.params_config["global"].get("memory_budget_mb", None)
+        return MemoryBudget(budget_mb * 2**20 if budget_mb else None,
+                            spill_dir=self.params_config["global"].get("spill_dir", None))
+
+    def get_metrics(self):
+        port = (self.params_config.get("metrics") or {}).get("port")
+        if not port:
+            return MetricsRegistry()
+        # one registry per port and process: every rabbit reports through the server bound to it
+        if port not in _METRICS_REGISTRIES:
+            _METRICS_REGISTRIES[port] = MetricsRegistry()
+        return _METRICS_REGISTRIES[port]
+
+    def get_progress_reporter(self, job_name):
+        metrics_config = self.params_config.get("metrics") or {}
+        return ProgressReporter(self.metrics.job(job_name),
+                                interval=metrics_config.get("progress_interval_seconds", 30),
+                                textfile=metrics_config.get("textfile", None))
+
+    def _fetch(self, metrics, fetch_func, *args, **kwargs):
+        """
+        Make one request within the memory budget and the rate limit, recording the time
+        waited on each, the request latency and the rows returned in `metrics`
+
+        Returns:
+            Tuple[data, fetched_at]
+        """
+        metrics.waited("memory", self.memory_budget.wait())
+        metrics.waited("rate_limit", self.rate_limiter.acquire())
+        fetched_at = pd.Timestamp.now(tz="UTC")
+        started = time.monotonic()
+        data = fetch_func(*args, **kwargs)
+        metrics.request(time.monotonic() - started)
+        if isinstance(data, pd.DataFrame):
+            metrics.rows(len(data))
+        return data, fetched_at
+
+    def get_parse_pool(self):
+        """Process pool decoding REST pages for every handler of the rabbit, None if disabled"""
+        processes = self.params_config["global"].get("parse_processes", 0)
+        if not processes:
+            return None
+        if "pool" not in self._parse_pools:
+            self._parse_pools["pool"] = ParsePool(processes,
+                                                  prefetch=self.params_config["global"].get("parse_prefetch", 4))
+        return self._parse_pools["pool"]
+
+    def get_chunker(self):
+        params_config = self.params_config.get("aggregates", {})
+        return AggregatesChunker(self.market_time_resolver,
+                                 limit=params_config.get("limit", 50000),
+                                 extended_hours=params_config.get("extended_hours", True))
+
+    def get_writer(self, write_options=None):
+        return BackgroundWriter(
+            num_workers=self.params_config["global"].get("writer_threads", 2),
+            max_pending=self.params_config["global"].get("writer_queue_size", 8),
+            write_func=(write_options or self.get_write_options()).write_frame
+        )
+
+    def get_write_options(self, run_config=None):
+        """Global `write_options`, overridden by those of the job's run config"""
+        return WriteOptions.from_config({**(self.params_config["global"].get("write_options") or {}),
+                                         **((run_config or {}).get("write_options") or {})})
+
+    @staticmethod
+    def _get_handler_params(params_config):
+        # drop job-level settings that are not request parameters
+        return {k: v for k, v in params_config.items() if k not in ["run_config_file", "checkpoint_dir", "universe_dir",
+                                                                 "workers", "request_latency_seconds",
+                                                                 "extended_hours"]}
+
+    def get_symbols(self):
+        # one dictionary per rabbit, so that every job hands out ids from the same state
+        if getattr(self, "_symbols", None) is None:
+            self._symbols = SymbolDictionary(self.params_config["global"].get("symbols_file", "./polygon/md/symbols.parquet"))
+        return self._symbols
+
+    def get_universe_store(self):
+        params_config = self.params_config.get("tickers", {})
+        return UniverseStore(params_config.get("universe_dir", "./polygon/md/universe"))
 
     def get_tickers(self, date:dt.datetime, **params):
-        handler = PolygonListTickersHandler(client=self.client)
-        params = {**self.params_config.get("tickers", {}), **params}
-        return handler.get_tickers(date, **params)
+        params_config = self.params_config.get("tickers", {})
+        checkpoint_dir = params_config.get("checkpoint_dir", None)
+        handler = PolygonListTickersHandler(
+            client=self.client,
+            checkpoint_store=CheckpointStore(checkpoint_dir) if checkpoint_dir else None
+        )
+        handler.parse_pool = self.get_parse_pool()
+        handler.memory_budget = self.memory_budget
+        params = {**self._get_handler_params(params_config), **params}
+        tickers, _ = self._fetch(self.metrics.job("tickers"), handler.get_tickers, date=date, **params)
+        if not isinstance(tickers, pd.DataFrame):
+            # the API client pages lazily; keep the listings to register them
+            tickers = list(tickers)
+        self.get_symbols().register_listings(tickers)
+        return tickers
+
+    def get_universe(self, date:dt.datetime, **params):
+        """
+        Ticker universe as of `date`, as a frame indexed by ticker. Days already in the
+        universe store (or bracketed by stored days with the same universe) are answered
+        from disk; other days are paged from the API once and stored as a delta.
+        """
+        store = self.get_universe_store()
+        universe = store.get(date)
+        if universe is None:
+            fetched_at = pd.Timestamp.now(tz="UTC")
+            universe = store.write_snapshot(date, self.get_tickers(date, **params), fetched_at)
+        return universe
+
+    def get_run_config(self, job_name):
+        run_config_file = self.params_config.get(job_name, {}).get("run_config_file", None)
+        if not run_config_file:
+            raise ValueError(f"Run config file is required for {job_name}")
+        return yaml.load(open(run_config_file), Loader=yaml.FullLoader) or {}
 
+    def get_fetch_plan(self, manifest, start_date, end_date, overwrite_existing=False, supports_ranges=False):
+        """Requests needed to bring the dataset behind `manifest` up to date over [start_date, end_date]"""
+        stored = {} if overwrite_existing else manifest.stored_sessions()
+        return self.planner.plan(start_date, end_date, stored, supports_ranges=supports_ranges)
+
+
+class PrepareTaskRabbit(TaskRabbit):
+    def __init__(self, params_config_file, client_params={}):
+        super().__init__(params_config_file, client_params)
 
 
 class EnhancedTaskRabbit(TaskRabbit):
@@ -45,10 +208,33 @@ class EnhancedTaskRabbit(TaskRabbit):
         super().__init__(params_config_file, client_params)
 
     def get_data(self, job_name:str, *args, **kwargs):
+        """Run `job_name`, logging its progress and updating its metrics as it goes"""
+        port = (self.params_config.get("metrics") or {}).get("port")
+        if port:
+            # bound by the first job to run, so that plans and dry runs leave the port alone
+            self.metrics.serve(port)
+        with self.get_progress_reporter(job_name):
+            return self._run_job(job_name, *args, **kwargs)
+
+    def _run_job(self, job_name:str, *args, **kwargs):
         if job_name == "grouped_daily":
             return self._get_and_save_grouped_daily(*args, **kwargs)
         elif job_name == "aggregates":
             return self._get_and_save_aggregates(*args, **kwargs)
+        elif job_name == "aggregates_queue":
+            return self._run_aggregates_queue(*args, **kwargs)
+        elif job_name == "daemon":
+            return self._run_daemon(*args, **kwargs)
+        elif job_name == "universe_aggregates":
+            return self._backfill_universe_aggregates(*args, **kwargs)
+        elif job_name in ["trades", "quotes"]:
+            return self._get_and_save_ticks(job_name, *args, **kwargs)
+        elif job_name == "import_flat_files":
+            return self._import_flat_files(*args, **kwargs)
+        elif job_name == "transpose_grouped_daily":
+            return self._transpose_grouped_daily(*args, **kwargs)
+        elif job_name == "grouped_daily_panel":
+            return self._update_grouped_daily_panel(*args, **kwargs)
         else:
             raise ValueError(f"Invalid job name: {job_name}")
     
@@ -66,76 +252,537 @@ class EnhancedTaskRabbit(TaskRabbit):
         if not run_config:
                 raise ValueError("Run config file is required for historical mode")
 
-        if mode == "historical":
-            end_date = run_config.get("end_date", dt.datetime.today())
-            start_date = run_config.get("start_date", end_date - dt.timedelta(days=1460))
-        elif mode == "latest":
-            end_date = dt.datetime.today()
-            start_date = end_date - dt.timedelta(days=1460)
-
-        dates = self.market_time_resolver.get_market_days(start_date, end_date)
-        
-        for date in dates:
-            output_file = f"{output_dir}/{date.strftime('%Y-%m-%d')}.parquet"
-            if os.path.exists(output_file) and not overwrite_existing:
-                self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
-                                 f"- Grouped daily data for {date} already exists, skipping")
-                continue
-
-            self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
-                              f"- Getting grouped daily data for {date}")
-            data = handler.get_grouped_daily(date, **params_config, parse_to_df=True)
-            if isinstance(data, pd.DataFrame):
-                data.to_parquet(output_file)
-                self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
-                                f"- Grouped daily data for {date} saved to {output_file}")
-            else:
-                self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
-                                 f"- Failed to retrieve grouped daily data for {date}")
-                
+        start_date, end_date = self._get_date_range(run_config, mode, 1460)
+
+        write_options = self.get_write_options(run_config)
+        if write_options.format != "parquet":
+            raise ValueError("Grouped daily sessions are stored as parquet files")
+        manifest = DatasetManifest(output_dir)
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        # the listings of each session, so that a reused ticker's old bars keep the old instrument's id
+        universe = self.get_universe_store()
+        requests = self.get_fetch_plan(manifest, start_date, end_date, overwrite_existing)
+        self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
+                         f"- {len(requests)} grouped daily sessions to fetch")
+
+        workers = self.rate_limiter.pool_size(params_config.get("workers", 8),
+                                              latency=params_config.get("request_latency_seconds", 1.0))
+        handler_params = self._get_handler_params(params_config)
+        self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
+                         f"- Fetching with {workers} workers")
 
-    def _get_and_save_aggregates(self, timespan:str, mode:str = 'latest', overwrite_existing=False):
+        metrics = self.metrics.job("grouped_daily")
+        metrics.plan(len(requests))
+
+        def fetch(date):
+            data, fetched_at = self._fetch(metrics, handler.get_grouped_daily, date, **handler_params, parse_to_df=True)
+            # charged until written, so frames waiting on the writer pause the fetchers
+            nbytes = self.memory_budget.charge(data) if isinstance(data, pd.DataFrame) else 0
+            return data, fetched_at, nbytes
+
+        def collect(future, date):
+            try:
+                data, fetched_at, nbytes = future.result()
+            except Exception as e:
+                metrics.unit_done(failed=True)
+                summary[date] = {"status": "failed", "rows": 0, "error": str(e)}
+                return
+            metrics.unit_done()
+            if not isinstance(data, pd.DataFrame) or data.empty:
+                self.memory_budget.release(nbytes)
+                summary[date] = {"status": "empty", "rows": 0, "error": None}
+                return
+            data = self.get_symbols().encode(data, listings=universe.get(date))
+            output_file = manifest.file_for(date)
+            write = self.memory_budget.release_after(metrics.timed_write(writer.write_func), nbytes)
+            writer.submit_call(write, data, Path(output_file),
+                               on_written=partial(self._on_written, manifest, date, len(data), fetched_at, None),
+                               label=output_file)
+            summary[date] = {"status": "ok", "rows": len(data), "error": None}
+
+        summary = {}
+        started = time.monotonic()
+        with self.get_writer(write_options) as writer, ThreadPoolExecutor(workers) as pool:
+            # a couple of sessions per worker in flight: a blocked writer holds back the
+            # fetchers instead of letting whole-market frames pile up in memory
+            in_flight = {}
+            for request in requests:
+                in_flight[pool.submit(fetch, request.start)] = request.start
+                if len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, in_flight.pop(future))
+            # results are written in completion order, each session file on its own
+            for future in as_completed(in_flight):
+                collect(future, in_flight[future])
+        for output_file, error in writer.errors:
+            date = pd.Timestamp(Path(output_file).stem)
+            summary[date] = {"status": "failed", "rows": 0, "error": f"write: {error}"}
+        return self._log_summary("grouped daily", summary, time.monotonic() - started, mode, overwrite_existing)
+
+    def _log_summary(self, name, summary, seconds, mode, overwrite_existing):
+        """Log one line of counts per outcome, then the failed sessions; returns the summary as a frame"""
+        summary = pd.DataFrame.from_dict(summary, orient="index", columns=["status", "rows", "error"]).sort_index()
+        summary.index.name = "date"
+        counts = summary["status"].value_counts().to_dict()
+        self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
+                         f"- {name}: {len(summary)} sessions in {seconds:.1f}s, {counts}")
+        for date, row in summary[summary["status"] == "failed"].iterrows():
+            self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}]"
+                              f"- {name} {date.date()} failed: {row['error']}")
+        return summary
+
+
+    def _get_and_save_aggregates(self, timespan:str, mode:str = 'latest', overwrite_existing=False, tickers=None):
         """
-        Get aggregated OHLCV data and save it to a parquet file. Supports two modes:
+        Get aggregated OHLCV bars per ticker and save them to the ticker/month partitioned
+        store. Supports two modes:
         1) Build up data inventory for historical periods given a config file.
         2) Get data for the last/today only.
+        Sessions already marked in the store's coverage bitmap are not fetched again.
         """
         handler = PolygonAggregatesHandler(client=self.client)
+        handler.parse_pool = self.get_parse_pool()
+        handler.memory_budget = self.memory_budget
         params_config = self.params_config.get("aggregates", {})
-        run_config = yaml.load(open(params_config.get("run_config_file", None)), Loader=yaml.FullLoader)
+        run_config = self.get_run_config("aggregates")
         output_dir = Path(run_config.get("output_dir", "./polygon/md/aggregates")) / timespan
+        tickers = tickers if tickers is not None else run_config.get("tickers", [])
+        if not tickers:
+            raise ValueError("No tickers given for the aggregates job")
 
-        if not run_config:
-            raise ValueError("Run config file is required for historical mode")
+        start_date, end_date = self._get_aggregates_range(run_config, mode)
+        store = MinuteBarStore(output_dir, self.get_symbols(), write_options=self.get_write_options(run_config))
+        units = self._plan_aggregates(store, tickers, start_date, end_date, timespan, mode, overwrite_existing)
+
+        handler_params = self._get_handler_params(params_config)
+        workers = self.rate_limiter.pool_size(params_config.get("workers", 4),
+                                              latency=params_config.get("request_latency_seconds", 1.0))
+        metrics = self.metrics.job("aggregates")
+        metrics.plan(len(units))
+        handler.metrics = metrics
+
+        def fetch(ticker, request):
+            from_, to = request.start.strftime('%Y-%m-%d'), request.end.strftime('%Y-%m-%d')
+            self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                             f"- Getting {ticker} aggregates data for {from_} to {to}")
+            params = {**handler_params, "ticker": ticker, "timespan": timespan, "from_": from_, "to": to}
+            data, fetched_at = self._fetch(metrics, handler.get_aggregates, **params, parse_to_df=True)
+            nbytes = self.memory_budget.charge(data) if isinstance(data, pd.DataFrame) else 0
+            return data, fetched_at, nbytes
+
+        def collect(writer, future, ticker, request):
+            label = f"{ticker} {request.start:%Y-%m-%d} to {request.end:%Y-%m-%d}"
+            try:
+                data, fetched_at, nbytes = future.result()
+            except Exception as e:
+                data, fetched_at, nbytes = e, None, 0
+            if not isinstance(data, pd.DataFrame):
+                metrics.unit_done(failed=True)
+                self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                                  f"- Failed to retrieve {label} aggregates data: {data}")
+                return
+            metrics.unit_done()
+            # only sessions that were final when fetched are marked as covered
+            write = self.memory_budget.release_after(metrics.timed_write(store.write_bars), nbytes)
+            writer.submit_call(write, ticker, data,
+                               sessions=self.planner.complete_sessions(request.sessions, fetched_at),
+                               label=label)
+
+        with self.get_writer() as writer, ThreadPoolExecutor(workers) as pool:
+            # a couple of windows per worker in flight, as in grouped daily: a blocked writer
+            # holds back the fetchers instead of letting fetched frames pile up in memory
+            in_flight = {}
+            for ticker, request in units:
+                in_flight[pool.submit(fetch, ticker, request)] = (ticker, request)
+                if len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(writer, future, *in_flight.pop(future))
+            for future in as_completed(in_flight):
+                collect(writer, future, *in_flight[future])
+        self._log_write_errors(writer, mode, overwrite_existing)
 
+    @staticmethod
+    def _get_date_range(run_config, mode, days, latest_days=None):
+        """[start_date, end_date] of a job: the run config's range in historical mode, up to today in latest mode"""
         if mode == "historical":
             end_date = run_config.get("end_date", dt.datetime.today())
-            start_date = run_config.get("start_date", end_date - dt.timedelta(days=1095))
+            start_date = run_config.get("start_date", pd.Timestamp(end_date) - dt.timedelta(days=days))
         elif mode == "latest":
             end_date = dt.datetime.today()
-            start_date = end_date - dt.timedelta(days=1095)
+            start_date = end_date - dt.timedelta(days=latest_days or days)
+        else:
+            raise ValueError(f"Invalid mode {mode}, should be 'historical' or 'latest'")
+        return start_date, end_date
 
-        dates = self.market_time_resolver.get_detail_hours(start_date, end_date)
-        for date in dates:
-            output_file = f"{output_dir}/{date.strftime('%Y-%m-%d')}.parquet"
-            if os.path.exists(output_file) and not overwrite_existing:
-                self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
-                               f"- Aggregates data for {date} already exists, skipping")
-                continue
+    def _get_aggregates_range(self, run_config, mode):
+        return self._get_date_range(run_config, mode, 1095)
 
+    def _plan_aggregates(self, store, tickers, start_date, end_date, timespan, mode, overwrite_existing):
+        """(ticker, request) pairs still to fetch, in windows sized to fill a request without paginating"""
+        chunker = self.get_chunker()
+        multiplier = self.params_config.get("aggregates", {}).get("multiplier", 1)
+        sessions = self.market_time_resolver.get_market_days(start_date, end_date)
+        units = []
+        for ticker in tickers:
+            covered = [] if overwrite_existing else sessions[store.coverage.covered(ticker, sessions)]
+            status = self.planner.session_status(start_date, end_date, {}, complete_sessions=covered)
+            todo = status.index[status["status"] != "complete"]
+            requests = chunker.chunk(start_date, end_date, multiplier, timespan, sessions=todo) if len(todo) else []
             self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
-                           f"- Getting aggregates data for {date}")
-            
-            
-            data = handler.get_aggregates(date, **params_config, parse_to_df=True)
-            if isinstance(data, pd.DataFrame):
-                data.to_parquet(output_file)
-                self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
-                               f"- Aggregates data for {date} saved to {output_file}")
+                             f"- {len(requests)} aggregates requests to fetch for {ticker}")
+            units.extend((ticker, request) for request in requests)
+        return units
+
+    def get_scheduler(self):
+        scheduler_config = self.params_config.get("scheduler", {})
+        return JobScheduler(self, weights=scheduler_config.get("weights"),
+                            max_running=scheduler_config.get("max_running"))
+
+    def get_daemon(self, scheduler=None):
+        daemon_config = self.params_config.get("daemon", {})
+        return MarketDaemon(
+            self,
+            eod_jobs=[DaemonJob.from_config(job) for job in daemon_config.get("eod_jobs") or []],
+            intraday_jobs=[DaemonJob.from_config(job) for job in daemon_config.get("intraday_jobs") or []],
+            intraday_interval=dt.timedelta(minutes=daemon_config.get("intraday_interval_minutes", 15)),
+            poll_backoff=dt.timedelta(seconds=daemon_config.get("poll_backoff_seconds", 60)),
+            poll_backoff_max=dt.timedelta(seconds=daemon_config.get("poll_backoff_max_seconds", 1800)),
+            give_up=dt.timedelta(hours=daemon_config.get("give_up_hours", 12)),
+            scheduler=scheduler,
+        )
+
+    def _run_daemon(self, use_scheduler=True):
+        """Follow the market calendar until interrupted, see `MarketDaemon`"""
+        scheduler = self.get_scheduler() if use_scheduler else None
+        daemon = self.get_daemon(scheduler)
+        try:
+            daemon.run_forever()
+        except KeyboardInterrupt:
+            self.logger.info("Daemon interrupted")
+        finally:
+            if scheduler is not None:
+                scheduler.shutdown(wait=False)
+
+    def is_session_complete(self, job_name:str, session, *args, **kwargs):
+        """
+        Whether the data of a job is final for `session`, for the jobs that can tell:
+        grouped daily from its manifest, aggregates from the coverage of its tickers.
+        None for the other jobs.
+        """
+        session = pd.Timestamp(session).normalize()
+        if job_name == "grouped_daily":
+            run_config = self.get_run_config("grouped_daily")
+            manifest = DatasetManifest(run_config.get("output_dir", "./ploygon/md/grouped_daily"))
+            status = self.planner.session_status(session, session, manifest.stored_sessions())
+            return bool(len(status)) and bool((status["status"] == "complete").all())
+        elif job_name == "aggregates":
+            timespan = args[0] if args else kwargs.get("timespan", "minute")
+            run_config = self.get_run_config("aggregates")
+            tickers = kwargs.get("tickers") or run_config.get("tickers", [])
+            store = MinuteBarStore(Path(run_config.get("output_dir", "./polygon/md/aggregates")) / timespan,
+                                   self.get_symbols())
+            return all(store.coverage.has(ticker, session) for ticker in tickers)
+        return None
+
+    def get_job_queue(self):
+        queue_config = self.params_config.get("job_queue", {})
+        return JobQueue(queue_config.get("path", "./polygon/queue/jobs.sqlite"),
+                        lease_seconds=queue_config.get("lease_seconds", 120),
+                        max_attempts=queue_config.get("max_attempts", 5),
+                        retry_backoff=queue_config.get("retry_backoff_seconds", 30),
+                        num_shards=queue_config.get("shards", 64),
+                        journal_mode=queue_config.get("journal_mode", "WAL"))
+
+    def _run_aggregates_queue(self, timespan:str = 'minute', role:str = 'worker', mode:str = 'historical',
+                              overwrite_existing=False, tickers=None, worker_id=None):
+        """
+        Aggregates through the shared `JobQueue`, for backfills spread over several machines.
+
+        The coordinator plans the (ticker, window) units and queues them, works on them
+        like any worker and marks the coverage of the units done by every worker: it is
+        the only writer of the coverage bitmap. Workers, on any node sharing the queue
+        file and the store directory, only fetch and upsert bars. Both stop once the job is
+        drained; running the coordinator again queues whatever is still not covered.
+        """
+        if role not in ["coordinator", "worker"]:
+            raise ValueError(f"Invalid role {role}, should be 'coordinator' or 'worker'")
+        handler = PolygonAggregatesHandler(client=self.client)
+        handler.parse_pool = self.get_parse_pool()
+        handler.memory_budget = self.memory_budget
+        params_config = self.params_config.get("aggregates", {})
+        queue_config = self.params_config.get("job_queue", {})
+        run_config = self.get_run_config("aggregates")
+        output_dir = Path(run_config.get("output_dir", "./polygon/md/aggregates")) / timespan
+        store = MinuteBarStore(output_dir, self.get_symbols(), write_options=self.get_write_options(run_config))
+        queue = self.get_job_queue()
+        job = f"aggregates/{timespan}"
+
+        def mark_covered():
+            covered = {}
+            for unit, result in queue.collect(job):
+                covered.setdefault(unit.ticker, []).extend(self.planner.complete_sessions(
+                    pd.DatetimeIndex(unit.payload["sessions"]), pd.Timestamp(result["fetched_at"])))
+            for ticker, sessions in covered.items():
+                store.coverage.mark(ticker, sessions)
+
+        if role == "coordinator":
+            # units done since the last collection are covered before planning again
+            mark_covered()
+            tickers = tickers if tickers is not None else run_config.get("tickers", [])
+            if not tickers:
+                raise ValueError("No tickers given for the aggregates job")
+            # ids are handed out here, before workers elsewhere read the dictionary
+            store.symbols.ids(tickers)
+            start_date, end_date = self._get_aggregates_range(run_config, mode)
+            units = self._plan_aggregates(store, tickers, start_date, end_date, timespan, mode, overwrite_existing)
+            queue.enqueue(job, [WorkUnit(job, ticker, request.start, request.end,
+                                         {"sessions": [session.strftime("%Y-%m-%d") for session in request.sessions]})
+                                for ticker, request in units], reset=True)
+
+        handler_params = self._get_handler_params(params_config)
+
+        metrics = self.metrics.job("aggregates_queue")
+        handler.metrics = metrics
+
+        def execute(unit):
+            params = {**handler_params, "ticker": unit.ticker, "timespan": timespan,
+                      "from_": unit.start.strftime('%Y-%m-%d'), "to": unit.end.strftime('%Y-%m-%d')}
+            data, fetched_at = self._fetch(metrics, handler.get_aggregates, **params, parse_to_df=True)
+            if not isinstance(data, pd.DataFrame):
+                raise ValueError(f"no bars returned, got {type(data)}")
+            nbytes = self.memory_budget.charge(data)
+            try:
+                if len(data):
+                    metrics.timed_write(store.upsert_bars)(unit.ticker, data)
+            finally:
+                self.memory_budget.release(nbytes)
+            # a failed unit goes back to the queue, so only done ones count
+            metrics.unit_done()
+            return {"bars": len(data), "fetched_at": fetched_at.isoformat()}
+
+        threads = self.rate_limiter.pool_size(queue_config.get("threads", 8),
+                                              latency=params_config.get("request_latency_seconds", 1.0))
+        worker = QueueWorker(queue, job, execute, worker_id=worker_id, threads=threads)
+        # the whole queue, shared with the other workers: with several, the ETA of each runs long
+        counts = queue.counts(job)
+        metrics.plan(counts["pending"] + counts["leased"])
+        self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                         f"- {worker.worker_id} working on {job} as {role}: {queue.counts(job)}")
+        stats = worker.run(on_progress=mark_covered if role == "coordinator" else None)
+        if role == "coordinator":
+            mark_covered()
+            failures = queue.failures(job)
+            if len(failures):
+                self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                                  f"- {len(failures)} {job} units failed:\n{failures.to_string()}")
+        return stats
+
+    def get_universe_backfill(self):
+        params_config = self.params_config.get("universe_aggregates", {})
+        run_config = self.get_run_config("aggregates")
+        store = MinuteBarStore(Path(run_config.get("output_dir", "./polygon/md/aggregates")) / "minute",
+                               self.get_symbols(), write_options=self.get_write_options(run_config))
+        return MinuteBackfill(
+            store, self.planner, self.client.API_KEY,
+            processes=params_config.get("processes", 4),
+            io_threads=params_config.get("io_threads", 8),
+            chunker=self.get_chunker(),
+            rate_limiter=self.rate_limiter,
+            handler_params=self._get_handler_params(self.params_config.get("aggregates", {})),
+            memory_budget=self.memory_budget.max_bytes,
+            spill_dir=self.memory_budget.spill_dir,
+        )
+
+    def get_job_plan(self, job_name:str, mode:str = 'historical', overwrite_existing=False, tickers=None,
+                     timespan:str = 'minute'):
+        """
+        The requests `job_name` would make in `mode`, with expected pages, bytes and wall
+        time, worked out from the stores and the calendar without calling the API.
+        """
+        estimates = {**BYTES_PER_RESULT, **(self.params_config.get("estimates") or {})}
+        rpm = self.rate_limiter.requests_per_minute
+        if job_name == "grouped_daily":
+            params_config = self.params_config.get("grouped_daily", {})
+            run_config = self.get_run_config("grouped_daily")
+            start_date, end_date = self._get_date_range(run_config, mode, 1460)
+            manifest = DatasetManifest(run_config.get("output_dir", "./ploygon/md/grouped_daily"))
+            requests = self.get_fetch_plan(manifest, start_date, end_date, overwrite_existing)
+            # a session holds about as many tickers as the ones already stored
+            rows = [entry["rows"] for entry in manifest.entries.values() if entry.get("rows")]
+            results = int(np.mean(rows)) if rows else estimates.get("grouped_daily_results", 12000)
+            plan = plan_frame([(None, request.start, request.end, len(request.sessions), results, 1,
+                                results * estimates["grouped_daily"]) for request in requests])
+            workers = self.rate_limiter.pool_size(params_config.get("workers", 8),
+                                                  latency=params_config.get("request_latency_seconds", 1.0))
+            latency = params_config.get("request_latency_seconds", 1.0)
+        elif job_name in ["aggregates", "universe_aggregates"]:
+            params_config = self.params_config.get("aggregates", {})
+            run_config = self.get_run_config("aggregates")
+            latency = params_config.get("request_latency_seconds", 1.0)
+            if job_name == "aggregates":
+                start_date, end_date = self._get_aggregates_range(run_config, mode)
+                tickers = tickers if tickers is not None else run_config.get("tickers", [])
+                store = MinuteBarStore(Path(run_config.get("output_dir", "./polygon/md/aggregates")) / timespan,
+                                       self.get_symbols())
+                units = self._plan_aggregates(store, tickers, start_date, end_date, timespan, mode, overwrite_existing)
+                workers = self.rate_limiter.pool_size(params_config.get("workers", 4), latency=latency)
             else:
+                universe_config = self.params_config.get("universe_aggregates", {})
+                start_date, end_date = self._get_date_range(run_config, mode, 365, universe_config.get("latest_days", 5))
+                if tickers is None:
+                    # stored universes only: a plan must not page the tickers endpoint
+                    universe = self.get_universe_store().get(end_date)
+                    if universe is None:
+                        raise ValueError(f"No stored universe for {pd.Timestamp(end_date).date()}, pass the tickers")
+                    tickers = list(universe.index)
+                backfill = self.get_universe_backfill()
+                units = backfill.plan(tickers, start_date, end_date, overwrite_existing)
+                workers = backfill.processes * backfill.io_threads
+            multiplier = params_config.get("multiplier", 1)
+            bars = self.get_chunker().bars_per_session(start_date, end_date, multiplier, timespan)
+            limit = params_config.get("limit", 50000)
+            rows = []
+            for ticker, request in units:
+                # pages are counted in base aggregates, results in bars of `multiplier` of them
+                base = int(bars.reindex(pd.DatetimeIndex(request.sessions)).fillna(0).sum())
+                results = -(-base // multiplier)
+                rows.append((ticker, request.start, request.end, len(request.sessions), results,
+                             max(1, -(-base // limit)), results * estimates["aggregates"]))
+            plan = plan_frame(rows)
+        else:
+            raise ValueError(f"Invalid job name {job_name}, plans cover grouped_daily, aggregates "
+                             f"and universe_aggregates")
+        return JobPlan(job_name, mode, pd.Timestamp(start_date), pd.Timestamp(end_date), plan,
+                       workers=workers, latency=latency, requests_per_minute=rpm)
+
+    def _backfill_universe_aggregates(self, date=None, mode:str = 'historical', overwrite_existing=False, tickers=None):
+        """
+        Minute bars for every ticker of the universe listed on `date` (default: the end of
+        the range), fetched by `MinuteBackfill` on a process pool. Sessions already in the
+        store are skipped, so an interrupted backfill is resumed by running it again.
+        """
+        params_config = self.params_config.get("universe_aggregates", {})
+        run_config = self.get_run_config("aggregates")
+        start_date, end_date = self._get_date_range(run_config, mode, 365, params_config.get("latest_days", 5))
+        if tickers is None:
+            # stored, so that plans and reruns of the same day need no request
+            tickers = list(self.get_universe(date or end_date).index)
+        backfill = self.get_universe_backfill()
+        self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                         f"- Backfilling minute bars of {len(tickers)} tickers from {start_date} to {end_date}")
+        return backfill.run(tickers, start_date, end_date, overwrite_existing,
+                            metrics=self.metrics.job("universe_aggregates"))
+
+    def _get_and_save_ticks(self, kind:str, mode:str = 'latest', overwrite_existing=False, tickers=None):
+        """
+        Stream trades or quotes per ticker and session into the ticker/day partitioned tick
+        store, page by page, so a day of a liquid ticker never has to fit in memory.
+        Interrupted days resume from their last committed page; only sessions that are
+        final (closed and published) are fetched.
+        """
+        handler = (PolygonTradesHandler if kind == "trades" else PolygonQuotesHandler)(client=self.client)
+        handler.parse_pool = self.get_parse_pool()
+        handler.memory_budget = self.memory_budget
+        params_config = self.params_config.get(kind, {})
+        run_config = self.get_run_config(kind)
+        store = TickStore(Path(run_config.get("output_dir", "./polygon/md/ticks")) / kind, kind,
+                          rows_per_file=run_config.get("rows_per_file", 2_000_000))
+        tickers = tickers if tickers is not None else run_config.get("tickers", [])
+        if not tickers:
+            raise ValueError(f"No tickers given for the {kind} job")
+
+        start_date, end_date = self._get_date_range(run_config, mode, 30, 5)
+        sessions = self.market_time_resolver.get_market_days(start_date, end_date)
+        sessions = self.planner.complete_sessions(sessions, pd.Timestamp.now(tz="UTC"))
+        days = [(ticker, session) for ticker in tickers for session in sessions
+                if overwrite_existing or not store.is_complete(ticker, session)]
+        metrics = self.metrics.job(kind)
+        metrics.plan(len(days))
+        handler.metrics = metrics
+        for ticker, session in days:
+            self.logger.info(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                             f"- Getting {ticker} {kind} for {session.date()}")
+            try:
+                rows, _ = self._fetch(metrics, handler.download_day, store, ticker, session,
+                                      overwrite=overwrite_existing,
+                                      sleep_time=params_config.get("sleep_time", 0),
+                                      limit=params_config.get("limit", 50000))
+                metrics.rows(rows)
+                metrics.unit_done()
+            except Exception as e:
+                metrics.unit_done(failed=True)
                 self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
-                                f"- Failed to retrieve aggregates data for {date}")
-                
+                                  f"- Failed to retrieve {ticker} {kind} for {session.date()}: {e}")
 
-    
+    def _import_flat_files(self, kind:str = 'day', overwrite_existing=False):
+        """
+        Load locally downloaded flat files (day_aggs_v1 or minute_aggs_v1 CSV.gz) into the
+        grouped daily or minute aggregates datasets, skipping sessions already imported.
+        """
+        if kind not in ["day", "minute"]:
+            raise ValueError(f"Invalid flat file kind {kind}, should be 'day' or 'minute'")
+        params_config = self.params_config.get("flat_files", {})
+        files_dir = params_config.get(f"{kind}_aggs_dir", None)
+        if not files_dir:
+            raise ValueError(f"flat_files.{kind}_aggs_dir is required to import {kind} flat files")
+        files = sorted(Path(files_dir).glob("*.csv*"))
+        importer = FlatFileImporter(
+            self.get_symbols(),
+            universe=self.get_universe_store(),
+            block_size=params_config.get("block_size_mb", 16) * 2**20,
+            num_threads=params_config.get("threads", 4),
+            num_buckets=params_config.get("buckets", 64),
+            spill_dir=params_config.get("spill_dir", None)
+        )
+        self.logger.info(f"input: overwrite[{overwrite_existing}] - {len(files)} {kind} flat files in {files_dir}")
+        if kind == "day":
+            run_config = self.get_run_config("grouped_daily")
+            importer.write_options = self.get_write_options(run_config)
+            return importer.import_day_aggs(files, run_config.get("output_dir", "./ploygon/md/grouped_daily"),
+                                            overwrite=overwrite_existing)
+        run_config = self.get_run_config("aggregates")
+        store = MinuteBarStore(Path(run_config.get("output_dir", "./polygon/md/aggregates")) / "minute",
+                               self.get_symbols(), write_options=self.get_write_options(run_config))
+        return importer.import_minute_aggs(files, store, overwrite=overwrite_existing)
+
+    def _on_written(self, manifest, date, rows, fetched_at, message):
+        # called from a writer thread once the file is in place
+        manifest.record(date, rows, fetched_at)
+        if message:
+            self.logger.info(message)
 
+    def _log_write_errors(self, writer, mode, overwrite_existing):
+        for output_file, error in writer.errors:
+            self.logger.error(f"input: mode[{mode}]/overwrite[{overwrite_existing}] "
+                              f"- Failed to write {output_file}: {error}")
+
+    def _transpose_grouped_daily(self):
+        """
+        Bring the ticker-major copy of the grouped daily data up to date with the
+        date-major files, ingesting only the sessions added or re-fetched since the last run.
+        """
+        run_config = self.get_run_config("grouped_daily")
+        output_dir = run_config.get("output_dir", "./ploygon/md/grouped_daily")
+        transposer = GroupedDailyTransposer(
+            output_dir,
+            run_config.get("by_ticker_dir", f"{output_dir}_by_ticker"),
+            self.get_symbols(),
+            memory_budget=run_config.get("transpose_memory_mb", 512) * 2**20,
+            universe=self.get_universe_store()
+        )
+        return transposer.update()
+
+    def _update_grouped_daily_panel(self):
+        """Append the grouped daily sessions written since the last run to the memory-mapped panels"""
+        run_config = self.get_run_config("grouped_daily")
+        output_dir = run_config.get("output_dir", "./ploygon/md/grouped_daily")
+        panels = PanelStore(
+            run_config.get("panel_dir", f"{output_dir}_panel"),
+            self.market_time_resolver,
+            self.get_symbols(),
+            start_date=run_config.get("panel_start_date", run_config.get("start_date", None)),
+            universe=self.get_universe_store()
+        )
+        return panels.update(output_dir)
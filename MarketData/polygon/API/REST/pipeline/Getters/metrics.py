@@ -0,0 +1,333 @@
+import math
+import time
+import bisect
+import logging
+import threading
+import datetime as dt
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Union, Callable, Dict, Tuple
+from ..Storage.atomic import atomic_path
+from .estimates import format_bytes
+
+# upper bounds of the latency histograms, in seconds: sub-millisecond parses to paginated requests
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PAGES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    # exact: `:g` would round large counters to six digits
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """One metric family: a value per label set, rendered in the Prometheus text format"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    @staticmethod
+    def _key(labels: Optional[dict]) -> tuple:
+        return tuple(sorted((labels or {}).items()))
+
+    def _samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{_format_labels(key)} {_format_value(value)}" for name, key, value in self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels: Optional[dict] = None, value: float = 1):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, labels: Optional[dict] = None, value: float = 0):
+        self.values[self._key(labels)] = value
+
+    def inc(self, labels: Optional[dict] = None, value: float = 1):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=SECONDS_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels: Optional[dict] = None, value: float = 0):
+        key = self._key(labels)
+        counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            counts[i] += 1
+        self.values[key] = (counts, total + value, count + 1)
+
+    def _samples(self):
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", key + (("le", f"{bound:g}"),), cumulative
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), count
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, count
+
+
+class MetricsRegistry:
+    """
+    Metrics of every job a rabbit runs, exposed in the Prometheus text format.
+
+    The exposition can be written to a `textfile` (atomically, for node_exporter's
+    textfile collector) or served over HTTP with `serve`. Jobs record through the
+    `JobMetrics` of `job`, which labels everything with the job name.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # reentrant: a new `JobMetrics` starts its run while the registry is locked
+        self.lock = threading.RLock()
+        self.requests = Counter("polygon_job_requests_total", "Requests made, a paginated request counting once")
+        self.request_seconds = Histogram("polygon_job_request_seconds",
+                                         "Wall time of a request, all of its pages included")
+        self.pages = Counter("polygon_job_pages_total", "REST pages fetched")
+        self.request_pages = Histogram("polygon_job_request_pages", "Pages per paginated REST request", PAGES_BUCKETS)
+        self.page_seconds = Histogram("polygon_job_page_seconds", "Time to fetch one REST page")
+        self.response_bytes = Counter("polygon_job_response_bytes_total", "Bytes of REST response bodies")
+        self.retries = Counter("polygon_job_retries_total", "HTTP retries made by the connection pool")
+        self.parse_seconds = Histogram("polygon_job_parse_seconds", "Time to decode one REST page into a frame")
+        self.rows = Counter("polygon_job_rows_total", "Rows fetched")
+        self.write_seconds = Histogram("polygon_job_write_seconds", "Time to write one frame to its store")
+        self.wait_seconds = Counter("polygon_job_wait_seconds_total",
+                                    "Time fetchers spent waiting, by reason (rate_limit, memory)")
+        self.units = Gauge("polygon_job_units", "Units of work of the current run, by state")
+        self.eta_seconds = Gauge("polygon_job_eta_seconds", "Estimated seconds left in the current run")
+        self.jobs: Dict[str, "JobMetrics"] = {}
+        self._server = None
+
+    def job(self, job_name: str) -> "JobMetrics":
+        with self.lock:
+            if job_name not in self.jobs:
+                self.jobs[job_name] = JobMetrics(self, job_name)
+            return self.jobs[job_name]
+
+    def to_prometheus(self) -> str:
+        with self.lock:
+            for job in self.jobs.values():
+                eta = job.eta_seconds()
+                if eta is not None:
+                    self.eta_seconds.set({"job": job.job_name}, eta)
+            metrics = [metric for metric in vars(self).values() if isinstance(metric, Metric)]
+            return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def write_textfile(self, path: Union[str, Path]):
+        text = self.to_prometheus()
+        with atomic_path(path) as tmp_path:
+            Path(tmp_path).write_text(text)
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serve the exposition on `host:port` (any path) from a daemon thread, once per registry"""
+        with self.lock:
+            if self._server is None:
+                self._server = self._start_server(port, host)
+            return self._server
+
+    def _start_server(self, port: int, host: str) -> ThreadingHTTPServer:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+        self.logger.info(f"Serving metrics on {host}:{port}")
+        return server
+
+
+class JobMetrics:
+    """
+    What one job records: requests and their latency, REST pages with their bytes,
+    retries and parse time, rows, writes, time spent waiting on the rate limit and the
+    memory budget, and the units of work of the current run for the progress line.
+
+    Counters accumulate over the life of the registry; `start` begins a new run, which
+    the rates and the ETA of `progress` are computed over.
+    """
+
+    def __init__(self, registry: MetricsRegistry, job_name: str):
+        self.registry = registry
+        self.job_name = job_name
+        self.labels = {"job": job_name}
+        self.start()
+
+    def start(self, units: int = 0):
+        with self.registry.lock:
+            self.started = time.monotonic()
+            self.run = {"planned": units, "done": 0, "failed": 0, "requests": 0, "pages": 0, "bytes": 0, "rows": 0,
+                        "retries": 0}
+            self._set_units()
+
+    def _set_units(self):
+        for state in ["planned", "done", "failed"]:
+            self.registry.units.set({**self.labels, "state": state}, self.run[state])
+
+    def plan(self, units: int):
+        """Add `units` to the work of the current run"""
+        with self.registry.lock:
+            self.run["planned"] += units
+            self._set_units()
+
+    def request(self, seconds: float):
+        with self.registry.lock:
+            self.run["requests"] += 1
+            self.registry.requests.inc(self.labels)
+            self.registry.request_seconds.observe(self.labels, seconds)
+
+    def page(self, seconds: float, nbytes: int, parse_seconds: Optional[float] = None, retries: int = 0):
+        with self.registry.lock:
+            self.run["pages"] += 1
+            self.run["bytes"] += nbytes
+            self.run["retries"] += retries
+            self.registry.pages.inc(self.labels)
+            self.registry.page_seconds.observe(self.labels, seconds)
+            self.registry.response_bytes.inc(self.labels, nbytes)
+            if retries:
+                self.registry.retries.inc(self.labels, retries)
+            if parse_seconds is not None:
+                self.registry.parse_seconds.observe(self.labels, parse_seconds)
+
+    def request_pages(self, pages: int):
+        with self.registry.lock:
+            self.registry.request_pages.observe(self.labels, pages)
+
+    def rows(self, rows: int):
+        with self.registry.lock:
+            self.run["rows"] += rows
+            self.registry.rows.inc(self.labels, rows)
+
+    def write(self, seconds: float):
+        with self.registry.lock:
+            self.registry.write_seconds.observe(self.labels, seconds)
+
+    def waited(self, reason: str, seconds: float):
+        if seconds:
+            with self.registry.lock:
+                self.registry.wait_seconds.inc({**self.labels, "reason": reason}, seconds)
+
+    def unit_done(self, failed: bool = False):
+        with self.registry.lock:
+            self.run["failed" if failed else "done"] += 1
+            self._set_units()
+
+    def timed_write(self, func: Callable) -> Callable:
+        """`func` recording its duration as a write, e.g. a write handed to a `BackgroundWriter`"""
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            result = func(*args, **kwargs)
+            self.write(time.monotonic() - started)
+            return result
+        wrapper.__name__ = getattr(func, "__name__", "write")
+        return wrapper
+
+    def eta_seconds(self) -> Optional[float]:
+        finished = self.run["done"] + self.run["failed"]
+        left = self.run["planned"] - finished
+        if not finished or left < 0:
+            return None
+        return left * (time.monotonic() - self.started) / finished
+
+    def progress(self) -> dict:
+        with self.registry.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {**self.run, "elapsed": elapsed, "requests_per_second": self.run["requests"] / elapsed,
+                    "bytes_per_second": self.run["bytes"] / elapsed, "rows_per_second": self.run["rows"] / elapsed,
+                    "eta": self.eta_seconds()}
+
+    def progress_line(self) -> str:
+        progress = self.progress()
+        finished = progress["done"] + progress["failed"]
+        share = f" ({finished / progress['planned']:.0%})" if progress["planned"] else ""
+        eta = progress["eta"]
+        eta = "unknown" if eta is None else str(dt.timedelta(seconds=math.ceil(eta)))
+        line = (f"{self.job_name}: {finished}/{progress['planned']} units{share}, {progress['failed']} failed, "
+                f"{progress['requests_per_second']:.2f} req/s, {progress['rows_per_second']:,.0f} rows/s")
+        if progress["pages"]:
+            line += (f", {format_bytes(progress['bytes_per_second'])}/s, "
+                     f"{progress['pages'] / max(progress['requests'], 1):.1f} pages/request, "
+                     f"{progress['retries']} retries")
+        return line + f", elapsed {dt.timedelta(seconds=round(progress['elapsed']))}, ETA {eta}"
+
+
+class ProgressReporter:
+    """
+    Logs the progress line of a job every `interval` seconds while it runs, and rewrites
+    the registry's `textfile` with it, so a long backfill shows its rates and ETA as it
+    goes and scrapers see fresh numbers. Used as a context manager around the job.
+    """
+
+    def __init__(self, metrics: JobMetrics, interval: Optional[float] = 30.0,
+                 textfile: Optional[Union[str, Path]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.metrics = metrics
+        self.interval = interval
+        self.textfile = textfile
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.metrics.start()
+        if self.interval:
+            self._thread = threading.Thread(target=self._report_loop, name="ProgressReporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report()
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        run = self.metrics.run
+        # jobs that neither plan units nor fetch (daemon, transposes) have nothing to show
+        if run["planned"] or run["requests"]:
+            self.logger.info(self.metrics.progress_line())
+        if self.textfile:
+            try:
+                self.metrics.registry.write_textfile(self.textfile)
+            except OSError as e:
+                self.logger.error(f"Failed to write metrics to {self.textfile}: {e}")
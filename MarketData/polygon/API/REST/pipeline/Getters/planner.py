@@ -0,0 +1,131 @@
+import logging
+import pandas as pd
+import datetime as dt
+from dataclasses import dataclass, field
+from typing import Union, Optional, List, Dict, Iterable
+
+
+@dataclass
+class FetchRequest:
+    """A single request against an endpoint, covering one or more consecutive sessions"""
+    start: pd.Timestamp
+    end: pd.Timestamp
+    sessions: List[pd.Timestamp] = field(default_factory=list)
+
+    @property
+    def is_range(self) -> bool:
+        return len(self.sessions) > 1
+
+
+class BackfillPlanner:
+    """
+    Works out which sessions still need fetching for a dataset.
+
+    The sessions in a window come from `MarketTime`. A session counts as stored only if
+    it was fetched after its close plus `publish_delay`; sessions fetched earlier (e.g.
+    today's session while it was still trading) are treated as partial and re-fetched.
+    """
+
+    def __init__(self, market_time_resolver, publish_delay: dt.timedelta = dt.timedelta(minutes=30)):
+        self.logger = logging.getLogger(__name__)
+        self.market_time_resolver = market_time_resolver
+        self.publish_delay = publish_delay
+
+    def session_status(self,
+                       start_date: Union[str, dt.datetime, pd.Timestamp],
+                       end_date: Union[str, dt.datetime, pd.Timestamp],
+                       stored: Dict[pd.Timestamp, dict],
+                       now: Optional[pd.Timestamp] = None,
+                       complete_sessions: Optional[Iterable[pd.Timestamp]] = None) -> pd.DataFrame:
+        """
+        Status of every session in [start_date, end_date] that has already opened.
+        Sessions in `complete_sessions` are known to be final (e.g. from a coverage bitmap) whatever
+        their fetch time.
+
+        Returns:
+            DataFrame indexed by session with market_open, market_close, fetched_at and
+            status ('complete', 'partial' or 'missing')
+        """
+        now = pd.Timestamp.now(tz="UTC") if now is None else pd.Timestamp(now)
+        if now.tzinfo is None:
+            now = now.tz_localize("US/Eastern")
+
+        hours = self.market_time_resolver.get_detail_hours(start_date, end_date)
+        hours = hours.loc[hours["market_open"] <= now, ["market_open", "market_close"]].copy()
+
+        fetched_at = [stored.get(session, {}).get("fetched_at") for session in hours.index]
+        hours["fetched_at"] = pd.to_datetime(fetched_at, utc=True)
+        hours["status"] = "missing"
+        complete = hours["fetched_at"] >= hours["market_close"] + self.publish_delay
+        hours.loc[hours["fetched_at"].notna(), "status"] = "partial"
+        hours.loc[complete, "status"] = "complete"
+        if complete_sessions is not None:
+            hours.loc[hours.index.isin(pd.DatetimeIndex(list(complete_sessions))), "status"] = "complete"
+        return hours
+
+    def complete_sessions(self,
+                          sessions: List[pd.Timestamp],
+                          fetched_at: pd.Timestamp) -> List[pd.Timestamp]:
+        """Subset of `sessions` whose data was already final when fetched at `fetched_at`"""
+        if not len(sessions):
+            return []
+        hours = self.market_time_resolver.get_detail_hours(min(sessions), max(sessions))
+        final = hours.index[hours["market_close"] + self.publish_delay <= pd.Timestamp(fetched_at)]
+        return [session for session in sessions if session in final]
+
+    @staticmethod
+    def coalesce(sessions: Iterable[pd.Timestamp],
+                 positions: Iterable[int],
+                 supports_ranges: bool = True,
+                 max_sessions_per_request: Optional[int] = None) -> List[FetchRequest]:
+        """
+        Requests for `sessions`, in order, given their positions in the trading calendar:
+        runs of consecutive sessions become one request if the endpoint takes ranges
+        """
+        requests = []
+        run, last = [], None
+        for session, pos in zip(sessions, positions):
+            contiguous = run and pos == last + 1
+            full = max_sessions_per_request is not None and len(run) >= max_sessions_per_request
+            if run and (not supports_ranges or not contiguous or full):
+                requests.append(FetchRequest(run[0], run[-1], run))
+                run = []
+            run.append(session)
+            last = pos
+        if run:
+            requests.append(FetchRequest(run[0], run[-1], run))
+        return requests
+
+    def plan(self,
+             start_date: Union[str, dt.datetime, pd.Timestamp],
+             end_date: Union[str, dt.datetime, pd.Timestamp],
+             stored: Dict[pd.Timestamp, dict],
+             supports_ranges: bool = False,
+             max_sessions_per_request: Optional[int] = None,
+             now: Optional[pd.Timestamp] = None,
+             complete_sessions: Optional[Iterable[pd.Timestamp]] = None) -> List[FetchRequest]:
+        """
+        Minimal list of requests that brings the dataset up to date.
+
+        Args:
+            start_date: First day of the window
+            end_date: Last day of the window
+            stored: Sessions already stored, as returned by `DatasetManifest.stored_sessions`
+            supports_ranges: Whether the endpoint accepts a from/to range. If so, runs of
+                consecutive sessions to fetch are coalesced into a single request
+            max_sessions_per_request: Upper bound on the sessions covered by one request
+            now: Reference time (default: now)
+            complete_sessions: Sessions known to be final regardless of `stored`
+
+        Returns:
+            List[FetchRequest]: Requests in session order
+        """
+        status = self.session_status(start_date, end_date, stored, now, complete_sessions)
+        position = pd.Series(range(len(status)), index=status.index)
+        to_fetch = position[status["status"] != "complete"]
+
+        requests = self.coalesce(to_fetch.index, to_fetch.to_numpy(), supports_ranges, max_sessions_per_request)
+
+        self.logger.info(f"Planned {len(requests)} requests for {len(to_fetch)} of {len(status)} sessions "
+                         f"between {start_date} and {end_date}")
+        return requests
@@ -0,0 +1,148 @@
+import math
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread making requests against one API key.
+
+    Tokens refill continuously at `requests_per_minute`; `acquire` takes one, waiting as
+    long as needed. `burst` tokens can be spent at once after an idle spell. Without a
+    rate (unlimited plans) `acquire` never waits.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, burst: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.requests_per_minute = requests_per_minute
+        # one second worth of requests by default
+        self.burst = burst or (max(1, math.ceil(requests_per_minute / 60)) if requests_per_minute else 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.requests_per_minute
+
+    def _refill(self, now: float):
+        rate = self.requests_per_minute / 60
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Take a token, blocking until one is available. Returns the seconds waited."""
+        if self.unlimited:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / (self.requests_per_minute / 60)
+            time.sleep(wait)
+            waited += wait
+
+    def pool_size(self, max_workers: int, latency: float = 1.0) -> int:
+        """
+        Workers needed to keep the limit saturated: at `latency` seconds per request, a
+        worker makes 60 / latency requests a minute, so more workers than
+        rate * latency / 60 only queue on the limiter
+        """
+        if self.unlimited:
+            return max_workers
+        return max(1, min(max_workers, math.ceil(self.requests_per_minute * latency / 60)))
+
+
+class WeightedRateLimiter(RateLimiter):
+    """
+    Token bucket shared by several priority classes, handing tokens to waiting classes in
+    proportion to their `weights` (start-time fair queuing over the token stream).
+
+    A class alone gets the whole rate; while several wait, each gets its share, e.g.
+    with weights 8/4/1 a running backfill keeps 1/13 of the rate once real-time requests
+    queue up and all of it back when they are done. A class that was idle does not save
+    up credit. `for_class` returns a limiter bound to one class, which jobs use in place
+    of a plain `RateLimiter`.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, weights: Optional[dict] = None,
+                 burst: Optional[int] = None):
+        super().__init__(requests_per_minute, burst)
+        self.weights = dict(weights or {"realtime": 8, "latest": 4, "historical": 1})
+        if any(weight <= 0 for weight in self.weights.values()):
+            raise ValueError(f"Invalid weights {self.weights}, should be positive")
+        self._condition = threading.Condition(self._lock)
+        self._waiting = {name: deque() for name in self.weights}
+        self._finish = {name: 0.0 for name in self.weights}
+        self._virtual_time = 0.0
+        self._tickets = itertools.count()
+        self.granted = {name: 0 for name in self.weights}
+
+    def _next_class(self) -> Optional[str]:
+        waiting = [name for name, queue in self._waiting.items() if queue]
+        return min(waiting, key=lambda name: (self._finish[name], -self.weights[name])) if waiting else None
+
+    def acquire(self, priority_class: str = "historical") -> float:
+        """Take a token for `priority_class`, blocking until it is this class' turn. Returns the seconds waited."""
+        if priority_class not in self.weights:
+            raise ValueError(f"Invalid priority class {priority_class}, should be one of {list(self.weights)}")
+        if self.unlimited:
+            return 0.0
+        started = time.monotonic()
+        with self._condition:
+            if not self._waiting[priority_class]:
+                # a class becoming busy starts at the current virtual time, without idle credit
+                self._finish[priority_class] = max(self._finish[priority_class], self._virtual_time)
+            ticket = next(self._tickets)
+            self._waiting[priority_class].append(ticket)
+            while True:
+                if self._next_class() != priority_class or self._waiting[priority_class][0] != ticket:
+                    # not our turn: every grant wakes the waiters up to check again
+                    self._condition.wait()
+                    continue
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._waiting[priority_class].popleft()
+                    self._virtual_time = self._finish[priority_class]
+                    self._finish[priority_class] += 1 / self.weights[priority_class]
+                    self.granted[priority_class] += 1
+                    self._condition.notify_all()
+                    return time.monotonic() - started
+                self._condition.wait((1 - self._tokens) / (self.requests_per_minute / 60))
+
+    def for_class(self, priority_class: str) -> "ClassRateLimiter":
+        if priority_class not in self.weights:
+            raise ValueError(f"Invalid priority class {priority_class}, should be one of {list(self.weights)}")
+        return ClassRateLimiter(self, priority_class)
+
+
+class ClassRateLimiter:
+    """A `WeightedRateLimiter` seen by the jobs of one priority class, with the `RateLimiter` interface"""
+
+    def __init__(self, limiter: WeightedRateLimiter, priority_class: str):
+        self.limiter = limiter
+        self.priority_class = priority_class
+
+    @property
+    def requests_per_minute(self) -> Optional[float]:
+        return self.limiter.requests_per_minute
+
+    @property
+    def unlimited(self) -> bool:
+        return self.limiter.unlimited
+
+    def acquire(self) -> float:
+        return self.limiter.acquire(self.priority_class)
+
+    def pool_size(self, max_workers: int, latency: float = 1.0) -> int:
+        # sized for the whole rate, which a class gets when it runs alone
+        return self.limiter.pool_size(max_workers, latency)
@@ -0,0 +1,145 @@
+import copy
+import heapq
+import logging
+import threading
+import itertools
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List
+from .ratelimit import WeightedRateLimiter
+
+# lower runs first; weights are the shares of the rate limit while classes compete
+PRIORITY_CLASSES = ["realtime", "latest", "historical"]
+DEFAULT_WEIGHTS = {"realtime": 8, "latest": 4, "historical": 1}
+DEFAULT_MAX_RUNNING = {"realtime": 2, "latest": 2, "historical": 1}
+
+
+@dataclass(order=True)
+class ScheduledJob:
+    """An `EnhancedTaskRabbit.get_data` call waiting for a slot of its priority class"""
+    rank: int
+    seq: int
+    priority_class: str = field(compare=False)
+    job_name: str = field(compare=False)
+    args: tuple = field(compare=False, default=())
+    kwargs: dict = field(compare=False, default_factory=dict)
+    future: Future = field(compare=False, default_factory=Future)
+
+
+class JobScheduler:
+    """
+    Runs `EnhancedTaskRabbit` jobs side by side in priority classes: `realtime`,
+    `latest` (end-of-day) and `historical` (background backfills).
+
+    Jobs wait in a priority queue and start as soon as their class has one of its
+    `max_running` slots free, higher classes first. Running jobs share one
+    `WeightedRateLimiter`: every job runs on a copy of the rabbit whose `rate_limiter`
+    is bound to its class, so the end-of-day `latest` job takes most of the request
+    budget the moment it starts, while a months-long backfill keeps going at the
+    remaining share and gets the full rate back afterwards.
+    """
+
+    def __init__(self, rabbit, weights: Optional[dict] = None, max_running: Optional[dict] = None):
+        self.logger = logging.getLogger(__name__)
+        self.rabbit = rabbit
+        self.rate_limiter = WeightedRateLimiter(rabbit.rate_limiter.requests_per_minute,
+                                                weights={**DEFAULT_WEIGHTS, **(weights or {})})
+        self.max_running = {**DEFAULT_MAX_RUNNING, **(max_running or {})}
+        # every copy shares the dictionary, so ids are never assigned twice
+        rabbit.get_symbols()
+        self._rabbits = {priority_class: self._bind(priority_class) for priority_class in PRIORITY_CLASSES}
+        self._pending: List[ScheduledJob] = []
+        self._running: Dict[str, int] = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="JobScheduler", daemon=True)
+        self._dispatcher.start()
+
+    def _bind(self, priority_class: str):
+        rabbit = copy.copy(self.rabbit)
+        rabbit.rate_limiter = self.rate_limiter.for_class(priority_class)
+        return rabbit
+
+    @staticmethod
+    def default_class(kwargs: dict) -> str:
+        return "historical" if kwargs.get("mode") == "historical" else "latest"
+
+    def submit(self, job_name: str, *args, priority_class: Optional[str] = None, **kwargs) -> Future:
+        """
+        Queue `rabbit.get_data(job_name, *args, **kwargs)`.
+
+        Args:
+            job_name: Any job of `EnhancedTaskRabbit.get_data`
+            priority_class: 'realtime', 'latest' or 'historical'; by default the job's
+                `mode` decides between 'historical' and 'latest'
+
+        Returns:
+            Future: Resolves to the job's return value
+        """
+        priority_class = priority_class or self.default_class(kwargs)
+        if priority_class not in PRIORITY_CLASSES:
+            raise ValueError(f"Invalid priority class {priority_class}, should be one of {PRIORITY_CLASSES}")
+        job = ScheduledJob(PRIORITY_CLASSES.index(priority_class), next(self._seq), priority_class,
+                           job_name, args, kwargs)
+        with self._condition:
+            if self._closed:
+                raise ValueError("Invalid submit, the scheduler is shut down")
+            heapq.heappush(self._pending, job)
+            self._condition.notify_all()
+        self.logger.info(f"Queued {job_name} as {priority_class}")
+        return job.future
+
+    def _next_job(self) -> Optional[ScheduledJob]:
+        # the best job whose class has a free slot; lower classes may overtake a full one
+        for job in sorted(self._pending):
+            if self._running[job.priority_class] < self.max_running[job.priority_class]:
+                self._pending.remove(job)
+                heapq.heapify(self._pending)
+                return job
+        return None
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait()
+                    job = self._next_job()
+                self._running[job.priority_class] += 1
+            threading.Thread(target=self._run, args=(job,), name=f"JobScheduler-{job.job_name}", daemon=True).start()
+
+    def _run(self, job: ScheduledJob):
+        if job.future.set_running_or_notify_cancel():
+            self.logger.info(f"Starting {job.job_name} as {job.priority_class}")
+            try:
+                job.future.set_result(self._rabbits[job.priority_class].get_data(job.job_name, *job.args, **job.kwargs))
+            except BaseException as e:
+                self.logger.error(f"{job.job_name} ({job.priority_class}) failed: {e}")
+                job.future.set_exception(e)
+        with self._condition:
+            self._running[job.priority_class] -= 1
+            self._condition.notify_all()
+
+    def running(self) -> Dict[str, int]:
+        with self._condition:
+            return dict(self._running)
+
+    def shutdown(self, wait: bool = True):
+        """Stop taking jobs; queued jobs still run. With `wait`, block until all are done."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            self._dispatcher.join()
+            with self._condition:
+                while any(self._running.values()):
+                    self._condition.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -4,3 +4,6 @@ from .tickerTypes import *
 from .marketHolidays import *
 from .tickerTypes import *
 from .tickers import *
+from .ticks import *
+from .parsing import ParsePool
+from .memory import MemoryBudget, PageBuffer
@@ -6,12 +6,13 @@ from ...utils.overhead import PolygonClient
 from .utils import parse_aggregates
 from .basic import PolygonBaseHandler
 from functools import partial
+from itertools import islice
 from .static.base import aggregatesStatic
 
 
 class PolygonAggregatesHandler(PolygonBaseHandler):
-    def __init__(self, client=None):
-        super().__init__(client)
+    def __init__(self, client=None, polygonCarrier=None):
+        super().__init__(polygonCarrier, client)
         self.polygon_api_func = self.client.list_aggs
 
     def _input_validation(self, ticker, multiplier, timespan, from_date, to_date, adjusted, sort, limit):
@@ -82,13 +83,21 @@ class PolygonAggregatesHandler(PolygonBaseHandler):
         return response
 
     def get_aggregates_API(self, caller_locals):
-        response = caller_locals.pop("client").list_aggs(**caller_locals)
+        # only the client's own arguments: caller_locals also holds self, method and parse_to_df
+        response = caller_locals["client"].list_aggs(**{
+            key: caller_locals[key] for key in ["ticker", "multiplier", "timespan", "from_", "to",
+                                                "adjusted", "sort", "limit", "raw"]},
+            params=caller_locals.get("params") or None)
 
         if caller_locals.get("raw", False):
             return self._process_response_api(response)
         
         if caller_locals.get("parse_to_df", True):
-            return parse_aggregates(response)
+            # the client pages lazily; a page of bar objects at a time becomes a frame
+            # instead of the whole range as a list first
+            page_size = caller_locals.get("limit") or 50000
+            pages = iter(lambda: list(islice(response, page_size)), [])
+            return self.collect_pages(parse_aggregates(page) for page in pages)
         return response
 
 
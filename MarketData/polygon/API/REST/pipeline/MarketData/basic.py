@@ -1,26 +1,40 @@
 import time
-import json
 import logging
 import urllib3
 import pandas as pd
 from urllib3.util.retry import Retry
 import certifi
+from typing import Iterable
 from ...utils.overhead import PolygonClient
+from .parsing import parse_json_REST, count_retries
+from .memory import PageBuffer
 
 class PolygonBaseHandler:
     def __init__(self, 
                  polygonCarrier = None, 
                  client = None, 
                  num_pools:int=1, 
-                 retries:int=5):
+                 retries:int=5,
+                 checkpoint_store=None,
+                 parse_pool=None,
+                 memory_budget=None,
+                 metrics=None):
         self.logger = logging.getLogger(__name__)
-        self.polygonCarrier = polygonCarrier or PolygonClient()
+        # a handler given a client authorizes its REST requests with that client's key
+        self.polygonCarrier = polygonCarrier or PolygonClient(getattr(client, "API_KEY", None))
         self.client = client or self.polygonCarrier.client
         self.headers = {
             "Authorization": "Bearer " + self.polygonCarrier.api_key,
             "Accept-Encoding": "gzip",
             "User-Agent": f"Polygon.io PythonClient/unknown",
         }
+        self.checkpoint_store = checkpoint_store
+        # a `ParsePool` decodes pages in other processes; jobs may also set it after construction
+        self.parse_pool = parse_pool
+        # a `MemoryBudget` bounds the pages held by paginated requests, spilling them past it
+        self.memory_budget = memory_budget
+        # a `JobMetrics` recording every REST page: fetch and parse time, bytes and retries
+        self.metrics = metrics
         self.__init_pool_manager(num_pools, retries, self.headers)
 
     def authorize_REST(self, url):
@@ -66,45 +80,84 @@ class PolygonBaseHandler:
             limit:int, 
             sleep_time:int=15, 
             response_parser=None, 
+            checkpoint=None,
             **params
         ):
-        paginate_results = []
-        while True:
+        """
+        Follow `next_url` until the last page and concatenate the results. With a
+        `checkpoint`, every page is committed to disk as it arrives and an interrupted
+        run resumes from the last committed page.
+        """
+        with PageBuffer(self.memory_budget) as paginate_results:
+            if checkpoint is not None:
+                resume_url, resumed = checkpoint.load()
+                for results in resumed:
+                    paginate_results.append(results)
+                # a checkpoint with pages but no cursor left has already fetched its last page
+                url = resume_url if resumed else url
+            for results, url in self.iter_pages_REST(url, limit, sleep_time, response_parser):
+                paginate_results.append(results)
+                if checkpoint is not None:
+                    checkpoint.commit(len(paginate_results) - 1, results, url)
+            results = paginate_results.result()
+        if checkpoint is not None:
+            checkpoint.clear()
+        return results
+
+    def collect_pages(self, pages: Iterable[pd.DataFrame]) -> pd.DataFrame:
+        """Concatenate `pages` as they come, within the `memory_budget`"""
+        with PageBuffer(self.memory_budget) as buffer:
+            for page in pages:
+                buffer.append(page)
+            return buffer.result(ignore_index=True)
+
+    def wait_for_memory(self):
+        """Pause until the `memory_budget` has room, before fetching more"""
+        if self.memory_budget is not None:
+            self.memory_budget.wait()
+    
+    def iter_pages_REST(self, url:str, limit:int=None, sleep_time:int=15, response_parser=None):
+        """
+        Yield `(results, next_url)` one page at a time, following `next_url` until the last
+        page, so callers can write each page out before the next one is requested.
+        With a `parse_pool`, pages are decoded in its processes while the next ones are fetched.
+        """
+        pages = 0
+        if self.parse_pool is not None:
+            for results, url in self.parse_pool.iter_pages(self.pool_manager, url, limit, sleep_time,
+                                                           response_parser, metrics=self.metrics):
+                pages += 1
+                yield results, url
+            self._record_request_pages(pages)
+            return
+        while url:
+            started = time.monotonic()
             resp = self.pool_manager.request('GET', url)
+            fetched = time.monotonic()
             results, iter_more, url, count = self._process_response_REST(resp, response_parser)
-            paginate_results.append(results)
+            if self.metrics is not None:
+                self.metrics.page(fetched - started, len(resp.data), time.monotonic() - fetched,
+                                  count_retries(resp))
+            pages += 1
+            yield results, url
             if iter_more and url:
                 if limit:
                     assert count == limit, f"Count mismatch with limit: {count} != {limit}"
                 time.sleep(sleep_time)
             else:
                 break
-        return pd.concat(paginate_results, axis=0)
-    
+        self._record_request_pages(pages)
+
+    def _record_request_pages(self, pages: int):
+        if self.metrics is not None and pages:
+            self.metrics.request_pages(pages)
+
     @staticmethod
     def _process_response_REST(response: dict, add_response_parser = None) -> tuple:
         """Process the REST response and format if needed"""
-        # Add any custom processing logic here
-
         if response.status != 200:
             raise ValueError(f"Error fetching tickers: REST request failed with status {response.status}")
-
-        json_data = json.loads(response.data)
-        status = json_data.get("status", None)
-        if status != "OK":
-            raise ValueError(f"Error fetching tickers: data request from REST failed with status {status}")
-
-        request_id = json_data.get("request_id", None)
-        count = json_data.get("count", None)
-        next_url = json_data.get("next_url", None)
-        if add_response_parser is None:
-            results = pd.DataFrame(json_data.get("results", []))
-        else:
-            results = add_response_parser(json_data).to_dataframe()
-
-        if next_url:
-            return results, True, next_url, count
-        return results, False, None, count
+        return parse_json_REST(response.data, add_response_parser)
 
 
     def get_REST(self, caller_locals, RESTStatic, polygon_api_func):
@@ -120,6 +173,8 @@ class PolygonBaseHandler:
         results = self.paginate_REST(
             url, 
             limit=params.get("limit", None), 
-            response_parser=RESTStatic.parse_response,
+            # not every static class has a schema to parse its results with
+            response_parser=getattr(RESTStatic, "parse_response", None),
+            checkpoint=self.checkpoint_store.open(url) if self.checkpoint_store else None,
         )
         return results
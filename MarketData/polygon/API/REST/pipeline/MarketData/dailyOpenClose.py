@@ -11,8 +11,8 @@ from .static.base import dailyOpenCloseStatic
 
 
 class PolygonDailyOpenCloseHandler(PolygonBaseHandler):
-    def __init__(self, client=None):
-        super().__init__(client)
+    def __init__(self, client=None, polygonCarrier=None):
+        super().__init__(polygonCarrier, client)
         self.polygon_api_func = self.client.get_daily_open_close_agg
 
     def _input_validation(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp], adjusted: bool):
@@ -0,0 +1,155 @@
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Optional, Callable, Union
+
+
+class MemoryBudget:
+    """
+    Byte budget shared by every fetcher of one process.
+
+    Frames are `charge`d when they are decoded and `release`d once they are written out
+    (or spilled). Fetchers call `wait` before a request: while the frames in flight
+    exceed `max_bytes` it blocks until writes free enough, which holds the network back
+    instead of letting frames pile up; fetches already under way still land, so the
+    peak can pass the budget by a frame per fetcher. Sizes are
+    `DataFrame.memory_usage(deep=True)`, an estimate of what a frame holds, not of the
+    process RSS. Without `max_bytes` nothing ever waits.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, spill_dir: Optional[Union[str, Path]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.in_use = 0
+        self.peak = 0
+        self.spilled = 0
+        self._condition = threading.Condition()
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.max_bytes
+
+    @property
+    def exhausted(self) -> bool:
+        return not self.unlimited and self.in_use >= self.max_bytes
+
+    @staticmethod
+    def sizeof(frame: pd.DataFrame) -> int:
+        return int(frame.memory_usage(index=True, deep=True).sum())
+
+    def charge(self, frame: Union[pd.DataFrame, int]) -> int:
+        """Count `frame` (or a number of bytes) as in flight; returns the bytes charged"""
+        nbytes = frame if isinstance(frame, int) else self.sizeof(frame)
+        with self._condition:
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+        return nbytes
+
+    def release(self, nbytes: int):
+        with self._condition:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._condition.notify_all()
+
+    def wait(self) -> float:
+        """Block while the budget is exhausted. Returns the seconds waited."""
+        if self.unlimited:
+            return 0.0
+        started = time.monotonic()
+        with self._condition:
+            if self.exhausted:
+                self.logger.debug(f"Memory budget exhausted ({self.in_use:,} of {self.max_bytes:,} bytes), "
+                                  f"pausing fetch")
+            while self.exhausted:
+                self._condition.wait()
+        return time.monotonic() - started
+
+    def release_after(self, func: Callable, nbytes: int) -> Callable:
+        """`func` releasing `nbytes` once it returns or raises, e.g. a write handed to a `BackgroundWriter`"""
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.release(nbytes)
+        wrapper.__name__ = getattr(func, "__name__", "write")
+        return wrapper
+
+
+class PageBuffer:
+    """
+    Pages of one request, accumulated until they are concatenated into its result.
+
+    Each page is charged to the `budget`. When the budget is exhausted the pages held
+    so far are spilled to a temporary directory (pickled, so any frame round-trips) and
+    released, then the fetcher waits for room before the next page: a single request
+    larger than the budget ends up on disk instead of in memory. `result` reads the
+    spilled pages back, so the concatenated frame itself still has to fit.
+    """
+
+    def __init__(self, budget: Optional[MemoryBudget] = None):
+        self.logger = logging.getLogger(__name__)
+        self.budget = budget
+        # in order, either a frame with its charge or the path of a spilled page
+        self.pages = []
+        self.held = 0
+        self._spill_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def append(self, page: pd.DataFrame):
+        if self.budget is None or self.budget.unlimited:
+            self.pages.append((page, 0))
+            return
+        nbytes = self.budget.charge(page)
+        self.pages.append((page, nbytes))
+        self.held += nbytes
+        if self.budget.exhausted:
+            self.spill()
+            self.budget.wait()
+
+    def spill(self):
+        """Move the pages held in memory to disk and release their charge"""
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="pages_", dir=self.budget.spill_dir))
+        spilled = 0
+        for i, page in enumerate(self.pages):
+            if isinstance(page, Path):
+                continue
+            frame, nbytes = page
+            path = self._spill_dir / f"page_{i:06d}.pkl"
+            frame.to_pickle(path)
+            self.pages[i] = path
+            spilled += nbytes
+        if spilled:
+            self.logger.info(f"Spilled {spilled:,} bytes of pages to {self._spill_dir}")
+            self.held -= spilled
+            self.budget.spilled += spilled
+            self.budget.release(spilled)
+
+    def result(self, ignore_index: bool = False) -> pd.DataFrame:
+        """The pages concatenated; their charge is released, the caller charges the result if it keeps it"""
+        frames = [pd.read_pickle(page) if isinstance(page, Path) else page[0] for page in self.pages]
+        results = pd.concat(frames, axis=0, ignore_index=ignore_index) if frames else pd.DataFrame()
+        self.close()
+        return results
+
+    def close(self):
+        """Release the pages still held and remove the spilled ones"""
+        if self.held and self.budget is not None:
+            self.budget.release(self.held)
+        self.held = 0
+        self.pages = []
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
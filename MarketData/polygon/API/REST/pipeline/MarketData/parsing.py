@@ -0,0 +1,206 @@
+import re
+import json
+import time
+import pickle
+import logging
+import multiprocessing
+import pandas as pd
+import pyarrow as pa
+from collections import deque
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Callable, Iterator, Tuple
+
+NEXT_URL = re.compile(rb'"next_url"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def parse_json_REST(data: bytes, response_parser: Optional[Callable] = None) -> tuple:
+    """Decode a REST response body into `(results, iter_more, next_url, count)`"""
+    json_data = json.loads(data)
+    status = json_data.get("status", None)
+    if status != "OK":
+        raise ValueError(f"Error fetching tickers: data request from REST failed with status {status}")
+
+    count = json_data.get("count", None)
+    next_url = json_data.get("next_url", None)
+    if response_parser is None:
+        results = pd.DataFrame(json_data.get("results", []))
+    else:
+        results = response_parser(json_data).to_dataframe()
+    return results, bool(next_url), next_url or None, count
+
+
+def peek_next_url(data: bytes) -> Optional[str]:
+    """`next_url` of a raw response body, found without decoding the results before it"""
+    # the cursor follows the results, so the search starts from the end
+    start = data.rfind(b'"next_url"')
+    match = NEXT_URL.match(data, start) if start >= 0 else None
+    return json.loads(match.group(1)) if match else None
+
+
+def count_retries(response) -> int:
+    """Retries urllib3 made before `response` came back"""
+    retries = getattr(response, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def _parse_page(data: bytes, response_parser: Optional[Callable], use_shared_memory: bool) -> tuple:
+    """
+    Runs in a parse process: decode a page and hand the frame back as an Arrow IPC
+    stream, written into a shared memory block (returned by name) or returned as bytes.
+    Frames Arrow cannot represent are pickled instead. The decoding time comes last.
+    """
+    started = time.monotonic()
+    payload, iter_more, next_url, count = _encode_page(data, response_parser, use_shared_memory)
+    return payload, iter_more, next_url, count, time.monotonic() - started
+
+
+def _encode_page(data: bytes, response_parser: Optional[Callable], use_shared_memory: bool) -> tuple:
+    results, iter_more, next_url, count = parse_json_REST(data, response_parser)
+    try:
+        table = pa.Table.from_pandas(results, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError):
+        return ("pickle", pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)), iter_more, next_url, count
+
+    if not use_shared_memory:
+        stream = pa.BufferOutputStream()
+        with pa.ipc.new_stream(stream, table.schema) as writer:
+            writer.write_table(table)
+        return ("ipc", stream.getvalue().to_pybytes()), iter_more, next_url, count
+
+    # sized first, so the stream is written straight into the block
+    sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    size = sink.size()
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        buffer = pa.py_buffer(block.buf)
+        stream = pa.FixedSizeBufferWriter(buffer)
+        with pa.ipc.new_stream(stream, table.schema) as writer:
+            writer.write_table(table)
+        stream.close()
+        # the views on the block have to go before it can be closed
+        del writer, stream, buffer
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    # the parent process maps the block and unlinks it
+    block.close()
+    return ("shm", block.name, size), iter_more, next_url, count
+
+
+def _discard_page(payload: tuple):
+    """Free the shared memory of a page that will not be loaded"""
+    if payload[0] == "shm":
+        block = shared_memory.SharedMemory(name=payload[1])
+        block.close()
+        block.unlink()
+
+
+def _load_page(payload: tuple) -> pd.DataFrame:
+    """Turn the payload of `_parse_page` back into a DataFrame in this process"""
+    kind = payload[0]
+    if kind == "pickle":
+        return pickle.loads(payload[1])
+    if kind == "ipc":
+        return pa.ipc.open_stream(pa.py_buffer(payload[1])).read_all().to_pandas()
+    _, name, size = payload
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # one copy out of the block: the frame may keep zero-copy views on its buffer,
+        # which would pin the mapping past the unlink
+        data = bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+class ParsePool:
+    """
+    Process pool that decodes REST pages off the fetching threads.
+
+    JSON decoding and building the DataFrame hold the GIL, so with many fetch threads a
+    single core parses while the network idles. Handlers with a `parse_pool` keep the
+    HTTP requests on their threads and send the raw response bodies here; the decoded
+    columns come back as Arrow IPC buffers in shared memory (`use_shared_memory`) or as
+    one bytes object, never as a pickled frame.
+
+    Pages of one paginated request are pipelined too: `next_url` is read from the raw
+    body without decoding it, so the next page is requested while up to `prefetch`
+    earlier ones are being parsed. Parse functions must be picklable (the schema
+    classes and the `*Static.parse_response` methods are).
+    """
+
+    def __init__(self,
+                 processes: Optional[int] = None,
+                 prefetch: int = 4,
+                 use_shared_memory: bool = True,
+                 start_method: str = "spawn"):
+        self.logger = logging.getLogger(__name__)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.prefetch = prefetch
+        self.use_shared_memory = use_shared_memory
+        # fetch threads may already be running when the pool starts; forking them is unsafe
+        self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(start_method))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def submit(self, data: bytes, response_parser: Optional[Callable] = None):
+        return self.executor.submit(_parse_page, data, response_parser, self.use_shared_memory)
+
+    def parse(self, data: bytes, response_parser: Optional[Callable] = None) -> tuple:
+        """Blocking `parse_json_REST` in a parse process"""
+        payload, iter_more, next_url, count, _ = self.submit(data, response_parser).result()
+        return _load_page(payload), iter_more, next_url, count
+
+    def iter_pages(self,
+                   pool_manager,
+                   url: str,
+                   limit: Optional[int] = None,
+                   sleep_time: float = 0,
+                   response_parser: Optional[Callable] = None,
+                   metrics=None) -> Iterator[Tuple[pd.DataFrame, Optional[str]]]:
+        """
+        `PolygonBaseHandler.iter_pages_REST` with the pages parsed in the pool, in order;
+        each page is recorded in `metrics` (a `JobMetrics`) if given
+        """
+        in_flight = deque()
+        try:
+            while url or in_flight:
+                if url and len(in_flight) < self.prefetch:
+                    started = time.monotonic()
+                    resp = pool_manager.request('GET', url)
+                    if resp.status != 200:
+                        raise ValueError(f"Error fetching tickers: REST request failed with status {resp.status}")
+                    fetch_seconds = time.monotonic() - started
+                    next_url = peek_next_url(resp.data)
+                    in_flight.append((self.submit(resp.data, response_parser), fetch_seconds, len(resp.data),
+                                      count_retries(resp)))
+                    url = next_url
+                    if url:
+                        time.sleep(sleep_time)
+                    continue
+                future, fetch_seconds, nbytes, retries = in_flight.popleft()
+                payload, iter_more, next_url, count, parse_seconds = future.result()
+                if metrics is not None:
+                    metrics.page(fetch_seconds, nbytes, parse_seconds, retries)
+                if iter_more and next_url and limit:
+                    assert count == limit, f"Count mismatch with limit: {count} != {limit}"
+                yield _load_page(payload), next_url
+        finally:
+            # pages parsed ahead of a failure or of a consumer that stopped early
+            for future, *_ in in_flight:
+                try:
+                    _discard_page(future.result()[0])
+                except Exception:
+                    pass
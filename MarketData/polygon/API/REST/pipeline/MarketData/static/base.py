@@ -1,4 +1,5 @@
 from ....response.schema.MarketData.dailyOpenClose import DailyOpenCloseResponse
+from ....response.schema.MarketData.ticks import TicksResponse
 
 # it is a static config class for tickers
 class baseStatic:
@@ -48,3 +49,22 @@ class dailyOpenCloseStatic(baseStatic):
     
     def parse_response(self, response):
         return self.response_parser.from_dict(response)
+
+
+class ticksStatic(baseStatic):
+    base_url = "https://api.polygon.io/v3/{kind}/{ticker}?"
+    response_parser = TicksResponse
+
+    def __init__(self, kind, ticker):
+        self.base_url = self.base_url.format(
+            kind = kind,
+            ticker = ticker
+        )
+
+    def formulate_REST_request_url(self, **params):
+        # remove ticker from params
+        params = {k: v for k, v in params.items() if k not in ['ticker']}
+        return self.base_url + "&".join([f"{k}={v}" for k, v in params.items()])
+
+    def parse_response(self, response):
+        return self.response_parser.from_dict(response)
@@ -16,8 +16,8 @@ from .basic import PolygonBaseHandler
 
 
 class PolygonListTickersHandler(PolygonBaseHandler):
-    def __init__(self, client = None):
-        super().__init__(client)
+    def __init__(self, client = None, checkpoint_store = None, polygonCarrier = None):
+        super().__init__(polygonCarrier, client, checkpoint_store=checkpoint_store)
         self.polygon_api_func = self.client.list_tickers
 
     def _input_validation(self, market, exchange, type, active, sort, order, limit):
@@ -76,7 +76,13 @@ class PolygonListTickersHandler(PolygonBaseHandler):
         return response
     
     def get_tickers_API(self, caller_locals):
-        response = caller_locals.pop("client").list_tickers(**caller_locals)
+        # only the client's own arguments: caller_locals also holds self and method
+        date = caller_locals.get("date")
+        response = caller_locals["client"].list_tickers(**{
+            key: caller_locals[key] for key in ["market", "exchange", "type", "active", "sort", "order",
+                                                "limit", "raw"]},
+            date=pd.Timestamp(date).strftime("%Y-%m-%d") if date is not None else None,
+            params=caller_locals.get("params") or None)
 
         if caller_locals.get("raw", False):
             return self._process_response_api(response)
@@ -0,0 +1,186 @@
+from typing import Union, Optional, Iterator, Tuple
+import datetime as dt
+import pandas as pd
+from .basic import PolygonBaseHandler
+from .static.base import ticksStatic
+
+
+class PolygonTicksHandler(PolygonBaseHandler):
+    """
+    Shared logic of the trades and quotes endpoints (/v3/{kind}/{ticker}).
+
+    A liquid ticker has tens of millions of quotes a day, so besides `get_{kind}`, which
+    returns a DataFrame, pages can be streamed one at a time (`stream`) or straight into a
+    `TickStore` (`download_day`) without ever holding more than a part file in memory.
+    """
+    kind = None
+
+    def __init__(self, client=None, polygonCarrier=None, checkpoint_store=None):
+        super().__init__(polygonCarrier, client, checkpoint_store=checkpoint_store)
+        self.polygon_api_func = getattr(self.client, f"list_{self.kind}")
+
+    @staticmethod
+    def _input_validation(ticker, sort, order, limit):
+        if not isinstance(ticker, str):
+            raise ValueError(f"Invalid ticker value, should be a string, {type(ticker)} provided")
+        if sort not in ['timestamp']:
+            raise ValueError("Invalid sort value")
+        if order not in ['asc', 'desc']:
+            raise ValueError("Invalid order value")
+        if limit > 50000:
+            raise ValueError(f"Invalid limit value, max is 50000, {limit} provided")
+
+    def get_ticks(self, caller_locals: dict, method: str):
+        caller_locals['client'] = self.client
+        self._input_validation(caller_locals['ticker'], caller_locals['sort'],
+                               caller_locals['order'], caller_locals['limit'])
+        if method == "API":
+            return self.get_ticks_API(caller_locals)
+        elif method == "REST":
+            # v3 pages carry no count to check against the limit, so no `get_REST`
+            RESTStatic = ticksStatic(self.kind, caller_locals['ticker'])
+            url = RESTStatic.formulate_REST_request_url(**self._get_params(self.polygon_api_func, caller_locals))
+            return self.paginate_REST(url, limit=None, sleep_time=0,
+                                      response_parser=RESTStatic.parse_response,
+                                      checkpoint=self.checkpoint_store.open(url) if self.checkpoint_store else None)
+        raise ValueError(f"Invalid method {method}, should be 'API' or 'REST'")
+
+    def get_ticks_API(self, caller_locals):
+        caller_locals.pop("method", None)
+        caller_locals.pop("parse_to_df", None)
+        response = self.polygon_api_func(**{k: v for k, v in caller_locals.items() if k != "client"})
+        if caller_locals.get("raw", False):
+            return response
+        return pd.DataFrame([vars(item) for item in response])
+
+    def request_url(self,
+                    ticker: str,
+                    date: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+                    timestamp_gte: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                    timestamp_lt: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                    limit: int = 50000,
+                    sort: str = 'timestamp',
+                    order: str = 'asc') -> str:
+        """First page url of a day (`date`) or of a nanosecond range"""
+        self._input_validation(ticker, sort, order, limit)
+        timestamp = pd.Timestamp(date).strftime("%Y-%m-%d") if date is not None else None
+        caller_locals = dict(locals(), params={})
+        caller_locals['client'] = self.client
+        params = self._get_params(self.polygon_api_func, caller_locals)
+        return ticksStatic(self.kind, ticker).formulate_REST_request_url(**params)
+
+    def stream(self, url: str, sleep_time: float = 0) -> Iterator[Tuple[pd.DataFrame, Optional[str]]]:
+        """Pages of `url` as `(ticks, next_url)`, fetched only as they are consumed"""
+        return self.iter_pages_REST(url, sleep_time=sleep_time,
+                                    response_parser=ticksStatic(self.kind, "").parse_response)
+
+    def download_day(self,
+                     store,
+                     ticker: str,
+                     date: Union[str, dt.datetime, pd.Timestamp],
+                     overwrite: bool = False,
+                     sleep_time: float = 0,
+                     limit: int = 50000) -> int:
+        """
+        Stream a day of ticks into a `TickStore`, resuming an interrupted download
+
+        Args:
+            store: The `TickStore` of this handler's kind
+            ticker: The ticker symbol
+            date: The session date
+            overwrite: Download a day that is already complete again
+            sleep_time: Seconds between pages, for rate-limited plans
+            limit: Results per page
+
+        Returns:
+            int: Number of ticks stored for the day
+        """
+        if store.kind != self.kind:
+            raise ValueError(f"Invalid store, holds {store.kind} instead of {self.kind}")
+        if store.is_complete(ticker, date) and not overwrite:
+            return store.state(ticker, date)["rows"]
+        writer = store.open_day(ticker, date, overwrite=overwrite)
+        # interrupted after committing the last page: starting over would store it twice
+        if not writer.last_page:
+            url = writer.resume_url or self.request_url(ticker, date=date, limit=limit)
+            for page, next_url in self.stream(url, sleep_time=sleep_time):
+                writer.append(page, next_url)
+                self.wait_for_memory()
+        writer.close()
+        return writer.rows
+
+
+class PolygonTradesHandler(PolygonTicksHandler):
+    kind = "trades"
+
+    def get_trades(self,
+                   method: str,
+                   ticker: str,
+                   timestamp: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+                   timestamp_lt: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_lte: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_gt: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_gte: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   limit: int = 50000,
+                   sort: str = 'timestamp',
+                   order: str = 'asc',
+                   raw: bool = False,
+                   params: Optional[dict] = None):
+        """
+        Get the trades of a ticker, for a day (`timestamp` as YYYY-MM-DD) or a time range
+
+        Args:
+            method: Method to use for fetching data ('API' or 'REST')
+            ticker: The ticker symbol
+            timestamp: A date or exact nanosecond timestamp
+            timestamp_lt, timestamp_lte, timestamp_gt, timestamp_gte: Range bounds
+            limit: Limit of results per page
+            sort: Sort field
+            order: Sort direction ('asc' or 'desc')
+            raw: Return the raw iterator of the API client
+
+        Returns:
+            DataFrame: One row per trade, timestamps in Unix ns
+        """
+        caller_locals = locals()
+        caller_locals.pop("self")
+        caller_locals['params'] = params or {}
+        return self.get_ticks(caller_locals, method)
+
+
+class PolygonQuotesHandler(PolygonTicksHandler):
+    kind = "quotes"
+
+    def get_quotes(self,
+                   method: str,
+                   ticker: str,
+                   timestamp: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+                   timestamp_lt: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_lte: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_gt: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   timestamp_gte: Optional[Union[dt.datetime, pd.Timestamp]] = None,
+                   limit: int = 50000,
+                   sort: str = 'timestamp',
+                   order: str = 'asc',
+                   raw: bool = False,
+                   params: Optional[dict] = None):
+        """
+        Get the NBBO quotes of a ticker, for a day (`timestamp` as YYYY-MM-DD) or a time range
+
+        Args:
+            method: Method to use for fetching data ('API' or 'REST')
+            ticker: The ticker symbol
+            timestamp: A date or exact nanosecond timestamp
+            timestamp_lt, timestamp_lte, timestamp_gt, timestamp_gte: Range bounds
+            limit: Limit of results per page
+            sort: Sort field
+            order: Sort direction ('asc' or 'desc')
+            raw: Return the raw iterator of the API client
+
+        Returns:
+            DataFrame: One row per quote, timestamps in Unix ns
+        """
+        caller_locals = locals()
+        caller_locals.pop("self")
+        caller_locals['params'] = params or {}
+        return self.get_ticks(caller_locals, method)
@@ -0,0 +1,15 @@
+from .atomic import *
+from .formats import *
+from .manifest import *
+from .checkpoints import *
+from .writer import *
+from .reader import *
+from .transpose import *
+from .symbols import *
+from .panels import *
+from .parts import *
+from .minuteBars import *
+from .query import *
+from .universe import *
+from .ticks import *
+from .flatfiles import *
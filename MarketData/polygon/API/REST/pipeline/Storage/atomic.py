@@ -0,0 +1,48 @@
+import os
+import uuid
+import pandas as pd
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Union
+
+PARQUET_MAGIC = b"PAR1"
+
+
+@contextmanager
+def atomic_path(path: Union[str, Path]):
+    """
+    Yield a temporary path next to `path`; once the block exits cleanly the temporary file
+    is fsynced and renamed over `path`. If the block raises, the temporary file is removed
+    and `path` is left untouched, so readers only ever see a complete file or none at all.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield tmp_path
+        # a writable handle: fsync of a read-only one fails on Windows
+        with open(tmp_path, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def atomic_to_parquet(data: pd.DataFrame, path: Union[str, Path], **kwargs):
+    """Crash-safe replacement for `data.to_parquet(path)`"""
+    with atomic_path(path) as tmp_path:
+        data.to_parquet(tmp_path, **kwargs)
+
+
+def is_complete_parquet(path: Union[str, Path]) -> bool:
+    """Cheap check that a parquet file was fully written: it must end with the footer magic bytes"""
+    path = Path(path)
+    try:
+        if path.stat().st_size < 2 * len(PARQUET_MAGIC):
+            return False
+        with open(path, "rb") as f:
+            f.seek(-len(PARQUET_MAGIC), os.SEEK_END)
+            return f.read() == PARQUET_MAGIC
+    except OSError:
+        return False
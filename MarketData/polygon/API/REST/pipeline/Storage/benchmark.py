@@ -0,0 +1,159 @@
+import time
+import shutil
+import string
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pathlib import Path
+from typing import Optional, Dict
+from .formats import WriteOptions
+
+
+# candidate settings compared by default; pandas' `to_parquet` defaults come first
+CANDIDATES = {
+    "parquet-snappy": WriteOptions(),
+    "parquet-zstd-1": WriteOptions(compression="zstd", compression_level=1),
+    "parquet-zstd-9": WriteOptions(compression="zstd", compression_level=9),
+    "parquet-lz4": WriteOptions(compression="lz4"),
+    "parquet-none": WriteOptions(compression=None),
+    "parquet-zstd-rg64k": WriteOptions(compression="zstd", compression_level=1, row_group_size=65536),
+    "parquet-zstd-nodict": WriteOptions(compression="zstd", compression_level=1, dictionary_columns=[]),
+    "parquet-zstd-nostats": WriteOptions(compression="zstd", compression_level=1, write_statistics=False),
+    "ipc-none": WriteOptions(format="ipc", compression=None),
+    "ipc-lz4": WriteOptions(format="ipc", compression="lz4"),
+    "ipc-zstd": WriteOptions(format="ipc", compression="zstd"),
+}
+
+
+def synthetic_tickers(num_tickers: int, seed: int = 0) -> np.ndarray:
+    """Unique upper-case symbols of 1 to 5 letters"""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_uppercase))
+    tickers = set()
+    while len(tickers) < num_tickers:
+        length = rng.integers(1, 6)
+        tickers.add("".join(rng.choice(letters, length)))
+    return np.array(sorted(tickers), dtype=object)
+
+
+def _bars(tickers: np.ndarray, timestamps: np.ndarray, rng: np.random.Generator) -> pa.Table:
+    # random walks per ticker, so prices look like the real thing to the encoders
+    num_tickers, num_steps = len(tickers), len(timestamps)
+    start = np.exp(rng.normal(3, 1.2, num_tickers))[:, None]
+    close = np.round(start * np.exp(np.cumsum(rng.normal(0, 0.01, (num_tickers, num_steps)), axis=1)), 2)
+    spread = np.abs(rng.normal(0, 0.005, (num_tickers, num_steps))) * close
+    volume = np.round(np.exp(rng.normal(8, 2, (num_tickers, num_steps))))
+    return pa.table({
+        "ticker": pa.array(np.repeat(tickers, num_steps)),
+        "open": np.round(close + rng.normal(0, 0.5, spread.shape) * spread, 2).ravel(),
+        "high": np.round(close + spread, 2).ravel(),
+        "low": np.round(close - spread, 2).ravel(),
+        "close": close.ravel(),
+        "volume": volume.ravel(),
+        "vwap": np.round(close + rng.normal(0, 0.1, spread.shape) * spread, 4).ravel(),
+        "timestamp": np.tile(timestamps, num_tickers),
+        "transactions": np.maximum(1, volume / rng.integers(50, 200, volume.shape)).astype(np.int64).ravel(),
+        "otc": np.zeros(volume.size, dtype=bool),
+    })
+
+
+def synthetic_grouped_daily(num_tickers: int = 10000, seed: int = 0) -> pa.Table:
+    """One session of grouped daily bars, in the (unsorted) order the API returns them"""
+    rng = np.random.default_rng(seed)
+    tickers = synthetic_tickers(num_tickers, seed)
+    session_close = int(pd.Timestamp("2024-01-02 16:00", tz="US/Eastern").timestamp() * 1000)
+    table = _bars(tickers, np.array([session_close], dtype=np.int64), rng)
+    return table.take(rng.permutation(table.num_rows))
+
+
+def synthetic_minute_bars(num_sessions: int = 21, seed: int = 0) -> pa.Table:
+    """A month of extended-hours minute bars (04:00-20:00) of one ticker"""
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range("2024-01-02", periods=num_sessions)
+    minutes = pd.DatetimeIndex(np.concatenate([
+        pd.date_range(session + pd.Timedelta(hours=4), session + pd.Timedelta(hours=20), freq="min", inclusive="left")
+        for session in sessions
+    ])).tz_localize("US/Eastern")
+    # thinly traded extended hours: most pre/post-market minutes have no bar
+    regular = (minutes.hour * 60 + minutes.minute >= 570) & (minutes.hour < 16)
+    minutes = minutes[regular | (rng.random(len(minutes)) < 0.3)]
+    timestamps = (minutes.asi8 // 10**6).astype(np.int64)
+    return _bars(np.array(["AAPL"], dtype=object), timestamps, rng).drop(["ticker"])
+
+
+def benchmark_write_options(table: pa.Table,
+                            candidates: Optional[Dict[str, WriteOptions]] = None,
+                            scan_filter: Optional[ds.Expression] = None,
+                            repeat: int = 3,
+                            work_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Write `table` with every candidate setting and time it.
+
+    For each candidate reports the best-of-`repeat` write time and throughput (in MB of
+    in-memory Arrow data per second), the file size and compression ratio, the time to
+    scan the whole file and, if `scan_filter` is given, the time of a filtered scan, which
+    is where row-group size, sorting and statistics pay off.
+    """
+    candidates = candidates or CANDIDATES
+    work_dir = Path(tempfile.mkdtemp(dir=work_dir, prefix="storage-benchmark-"))
+    raw_mb = table.nbytes / 2**20
+    results = []
+    try:
+        for name, options in candidates.items():
+            path = work_dir / f"{name}{options.suffix}"
+            write_s = min(_timed(options.write_table, table, path) for _ in range(repeat))
+            file_format = "ipc" if options.format == "ipc" else "parquet"
+            scan_s = min(_timed(lambda: ds.dataset(path, format=file_format).to_table()) for _ in range(repeat))
+            row = {
+                "name": name,
+                "write_s": write_s,
+                "write_mb_s": raw_mb / write_s,
+                "file_mb": path.stat().st_size / 2**20,
+                "ratio": raw_mb / (path.stat().st_size / 2**20),
+                "scan_s": scan_s,
+            }
+            if scan_filter is not None:
+                row["filtered_scan_s"] = min(
+                    _timed(lambda: ds.dataset(path, format=file_format).to_table(filter=scan_filter))
+                    for _ in range(repeat))
+            results.append(row)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return pd.DataFrame(results).set_index("name")
+
+
+def _timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run_default_benchmarks(repeat: int = 3) -> Dict[str, pd.DataFrame]:
+    """Benchmark the candidate settings on synthetic grouped daily and minute data"""
+    grouped_daily = synthetic_grouped_daily()
+    tickers = grouped_daily.column("ticker").to_numpy(zero_copy_only=False)
+    sorted_candidates = {f"{name}-by-ticker": WriteOptions(**{**vars(options), "sort_by": ["ticker"]})
+                         for name, options in CANDIDATES.items() if name in ["parquet-snappy", "parquet-zstd-1"]}
+    minute = synthetic_minute_bars()
+    first_session = minute.column("timestamp")[0].as_py()
+    return {
+        "grouped_daily": benchmark_write_options(
+            grouped_daily, {**CANDIDATES, **sorted_candidates, "parquet-zstd-1-by-ticker-rg1k": WriteOptions(
+                compression="zstd", compression_level=1, row_group_size=1024, sort_by=["ticker"])},
+            scan_filter=ds.field("ticker").isin(list(np.sort(tickers)[:50])), repeat=repeat),
+        "minute": benchmark_write_options(
+            minute, scan_filter=(ds.field("timestamp") >= first_session)
+                                & (ds.field("timestamp") < first_session + 86400000),
+            repeat=repeat),
+    }
+
+
+if __name__ == "__main__":
+    # python -m MarketData.polygon.API.REST.pipeline.Storage.benchmark
+    logging.basicConfig(level=logging.INFO)
+    pd.set_option("display.width", 200)
+    for dataset, result in run_default_benchmarks().items():
+        print(f"\n{dataset}\n{result.round(4)}")
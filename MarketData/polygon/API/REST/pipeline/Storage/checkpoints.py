@@ -0,0 +1,67 @@
+import json
+import shutil
+import hashlib
+import logging
+import pandas as pd
+from pathlib import Path
+from typing import Union, Optional, List, Tuple
+from .atomic import atomic_path, atomic_to_parquet
+
+
+class PaginationCheckpoint:
+    """
+    On-disk state of one paginated request.
+
+    Each fetched page is committed as its own parquet file, followed by the cursor
+    (the `next_url` to request next and the number of committed pages). A restarted job
+    loads the committed pages and carries on from the cursor instead of page one.
+    """
+    cursor_name = "cursor.json"
+
+    def __init__(self, checkpoint_dir: Union[str, Path], url: str):
+        self.logger = logging.getLogger(__name__)
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.url = url
+        self.cursor_path = self.checkpoint_dir / self.cursor_name
+
+    def _page_path(self, page: int) -> Path:
+        return self.checkpoint_dir / f"page_{page:06d}.parquet"
+
+    def load(self) -> Tuple[Optional[str], List[pd.DataFrame]]:
+        """
+        Returns:
+            Tuple[next_url, pages]: the url to resume from and the pages committed so far,
+            or (None, []) when there is nothing to resume
+        """
+        if not self.cursor_path.exists():
+            return None, []
+        with open(self.cursor_path) as f:
+            cursor = json.load(f)
+        pages = [pd.read_parquet(self._page_path(page)) for page in range(cursor["pages"])]
+        self.logger.info(f"Resuming {self.url} from page {cursor['pages']}")
+        return cursor["next_url"], pages
+
+    def commit(self, page: int, results: pd.DataFrame, next_url: Optional[str]):
+        """Persist page number `page` (0-based) and the cursor that follows it"""
+        atomic_to_parquet(results, self._page_path(page))
+        with atomic_path(self.cursor_path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump({"url": self.url, "next_url": next_url, "pages": page + 1}, f)
+
+    def clear(self):
+        """Drop the checkpoint once the request has completed"""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+class CheckpointStore:
+    """Directory of pagination checkpoints, one sub-directory per request url"""
+
+    def __init__(self, root_dir: Union[str, Path]):
+        self.root_dir = Path(root_dir)
+
+    @staticmethod
+    def request_key(url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()[:16]
+
+    def open(self, url: str) -> PaginationCheckpoint:
+        return PaginationCheckpoint(self.root_dir / self.request_key(url), url)
@@ -0,0 +1,237 @@
+import re
+import shutil
+import logging
+import threading
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, List, Iterable, Iterator, Dict
+from .manifest import DatasetManifest
+from .formats import WriteOptions
+from .reader import STORED_BARS_SCHEMA
+from .symbols import SymbolDictionary
+from .universe import UniverseStore
+from .minuteBars import MinuteBarStore, MINUTE_BARS_SCHEMA
+
+# columns of the us_stocks_sip day_aggs_v1 and minute_aggs_v1 flat files; `window_start`
+# is in Unix ns
+FLAT_FILE_TYPES = {
+    "ticker": pa.string(),
+    "volume": pa.float64(),
+    "open": pa.float64(),
+    "close": pa.float64(),
+    "high": pa.float64(),
+    "low": pa.float64(),
+    "window_start": pa.int64(),
+    "transactions": pa.int64(),
+}
+FLAT_FILE_DATE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+# what is stored: grouped daily sessions keyed by ticker id, minute bars partitioned by
+# ticker, spilled minute bars with the ticker id to split them by later
+GROUPED_DAILY_SCHEMA = pa.schema([field for field in STORED_BARS_SCHEMA if field.name != "ticker"])
+SPILL_SCHEMA = pa.schema([("ticker_id", pa.int32())] + list(MINUTE_BARS_SCHEMA))
+
+
+def flat_file_session(path: Union[str, Path]) -> pd.Timestamp:
+    """Session of a flat file, from its YYYY-MM-DD name"""
+    match = FLAT_FILE_DATE.search(Path(path).name)
+    if match is None:
+        raise ValueError(f"Invalid flat file name {Path(path).name}, should contain the YYYY-MM-DD session")
+    return pd.Timestamp(match.group(1))
+
+
+def read_flat_file(path: Union[str, Path], block_size: int = 16 * 2**20) -> Iterator[pa.RecordBatch]:
+    """
+    Stream a (gzipped) flat file as record batches of about `block_size` bytes of CSV,
+    with `window_start` converted to the stored `timestamp` in Unix ms. Decompression
+    streams too, so only one block is held in memory.
+    """
+    stream = pa.input_stream(str(path), compression="detect")
+    reader = pacsv.open_csv(
+        stream,
+        read_options=pacsv.ReadOptions(block_size=block_size, use_threads=True),
+        convert_options=pacsv.ConvertOptions(column_types=FLAT_FILE_TYPES,
+                                             include_columns=list(FLAT_FILE_TYPES)))
+    try:
+        for batch in reader:
+            timestamp = pc.divide(batch.column("window_start"), pa.scalar(1_000_000, pa.int64()))
+            yield pa.RecordBatch.from_arrays(
+                [batch.column(name) if name != "window_start" else timestamp for name in FLAT_FILE_TYPES],
+                names=[name if name != "window_start" else "timestamp" for name in FLAT_FILE_TYPES])
+    finally:
+        stream.close()
+
+
+class FlatFileImporter:
+    """
+    Bulk load of locally downloaded Polygon flat files (`day_aggs_v1` and `minute_aggs_v1`
+    CSV.gz, one file per session) into the datasets the REST jobs write:
+
+        day aggs     one `{YYYY-MM-DD}.parquet` per session in the grouped daily directory,
+                     with ticker ids and a `DatasetManifest` entry, as `EnhancedTaskRabbit`
+                     writes them
+        minute aggs  the ticker/month partitions of a `MinuteBarStore`, with the sessions
+                     marked in its coverage bitmap
+
+    Files are read in blocks of `block_size` bytes, several at a time (gzip streams cannot
+    be split, so decompression is parallel across files), and Arrow parses each block on
+    its own threads. Minute files are bucketed by ticker id into spill files, one month at
+    a time, and each bucket is then split into its tickers and upserted, so memory is
+    bounded by a block per reader plus one bucket. Flat files carry no vwap and no OTC
+    flag, those columns are left null.
+
+    Imported sessions are recorded (the minute ones in `{store}/_flat_files`), so an
+    interrupted import picks up where it stopped and files already imported are skipped.
+    With a `universe`, day aggs are keyed by the listing each ticker named that session.
+    """
+
+    def __init__(self,
+                 symbols: SymbolDictionary,
+                 block_size: int = 16 * 2**20,
+                 num_threads: int = 4,
+                 num_buckets: int = 64,
+                 write_options: Optional[WriteOptions] = None,
+                 spill_dir: Optional[Union[str, Path]] = None,
+                 universe: Optional[UniverseStore] = None):
+        self.logger = logging.getLogger(__name__)
+        self.symbols = symbols
+        self.universe = universe
+        self.block_size = block_size
+        self.num_threads = num_threads
+        self.num_buckets = num_buckets
+        self.write_options = write_options or WriteOptions()
+        self.spill_dir = spill_dir
+
+    @staticmethod
+    def _fetched_at(path: Path) -> pd.Timestamp:
+        # flat files are published after the session is final; their mtime stands in for the fetch time
+        return pd.Timestamp(path.stat().st_mtime, unit="s", tz="UTC")
+
+    @staticmethod
+    def _pending(files: Iterable[Union[str, Path]], stored: Iterable[pd.Timestamp]) -> Dict[pd.Timestamp, Path]:
+        files = {flat_file_session(path): Path(path) for path in files}
+        stored = set(stored)
+        return {session: path for session, path in sorted(files.items()) if session not in stored}
+
+    def _conform(self, batch: pa.RecordBatch, schema: pa.Schema, listings: Optional[pd.DataFrame] = None) -> pa.Table:
+        """`batch` with its tickers replaced by ids, in the columns of `schema`; missing ones are null"""
+        ids = self.symbols.ids(batch.column("ticker").to_numpy(zero_copy_only=False), listings=listings)
+        columns = {field.name: (pa.array(ids, type=pa.int32()) if field.name == "ticker_id"
+                                else batch.column(field.name) if field.name in batch.schema.names
+                                else pa.nulls(batch.num_rows, field.type)) for field in schema}
+        return pa.table(columns).cast(schema)
+
+    def import_day_aggs(self, files: Iterable[Union[str, Path]], output_dir: Union[str, Path],
+                        overwrite: bool = False) -> int:
+        """Import day aggregate files as grouped daily sessions. Returns the sessions imported."""
+        manifest = DatasetManifest(output_dir)
+        manifest.output_dir.mkdir(parents=True, exist_ok=True)
+        pending = self._pending(files, [] if overwrite else manifest.stored_sessions())
+
+        def import_session(session: pd.Timestamp, path: Path):
+            listings = self.universe.get(session) if self.universe is not None else None
+            table = pa.concat_tables([self._conform(batch, GROUPED_DAILY_SCHEMA, listings)
+                                      for batch in read_flat_file(path, self.block_size)]
+                                     + [GROUPED_DAILY_SCHEMA.empty_table()])
+            self.write_options.write_table(table, manifest.file_for(session))
+            manifest.record(session, table.num_rows, self._fetched_at(path))
+
+        with ThreadPoolExecutor(self.num_threads) as pool:
+            for future in [pool.submit(import_session, session, path) for session, path in pending.items()]:
+                future.result()
+        self.logger.info(f"Imported {len(pending)} day aggregate files into {output_dir}")
+        return len(pending)
+
+    def import_minute_aggs(self, files: Iterable[Union[str, Path]], store: MinuteBarStore,
+                           overwrite: bool = False) -> int:
+        """Import minute aggregate files into a `MinuteBarStore`. Returns the bars imported."""
+        manifest = DatasetManifest(store.root_dir / "_flat_files")
+        # the sessions end up in the month partitions, so the entries are read directly
+        pending = self._pending(files, [] if overwrite else [pd.Timestamp(key) for key in manifest.entries])
+        months = pd.DatetimeIndex(list(pending)).to_period("M")
+        imported = 0
+        for month in months.unique():
+            sessions = [session for session, in_month in zip(pending, months == month) if in_month]
+            started = pd.Timestamp.now()
+            rows = self._import_month(store, month, {session: pending[session] for session in sessions})
+            manifest.record_many([(session, rows[session], self._fetched_at(pending[session])) for session in sessions])
+            bars = sum(rows.values())
+            seconds = (pd.Timestamp.now() - started).total_seconds()
+            self.logger.info(f"Imported {bars} minute bars of {month} ({len(sessions)} sessions) "
+                             f"in {seconds:.1f}s, {bars / max(seconds, 1e-9):,.0f} bars/s")
+            imported += bars
+        return imported
+
+    def _import_month(self, store: MinuteBarStore, month: pd.Period,
+                      files: Dict[pd.Timestamp, Path]) -> Dict[pd.Timestamp, int]:
+        spill_dir = Path(tempfile.mkdtemp(dir=self.spill_dir, prefix=f"flat-files-{month}-"))
+        writers = {}
+        try:
+            def spill(path: Path) -> int:
+                rows = 0
+                for batch in read_flat_file(path, self.block_size):
+                    table = self._conform(batch, SPILL_SCHEMA)
+                    buckets = table.column("ticker_id").to_numpy() % self.num_buckets
+                    for bucket in np.unique(buckets):
+                        writers[bucket].write_table(table.filter(pa.array(buckets == bucket)))
+                    rows += table.num_rows
+                return rows
+
+            for bucket in range(self.num_buckets):
+                writers[bucket] = _SpillFile(spill_dir / f"{bucket:03d}.arrow")
+            with ThreadPoolExecutor(self.num_threads) as pool:
+                rows = dict(zip(files, pool.map(spill, files.values())))
+            for writer in writers.values():
+                writer.close()
+
+            with ThreadPoolExecutor(self.num_threads) as pool:
+                for bucket in range(self.num_buckets):
+                    self._write_bucket(store, month, writers[bucket].path, list(files), pool)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        return rows
+
+    def _write_bucket(self, store: MinuteBarStore, month: pd.Period, path: Path,
+                      sessions: List[pd.Timestamp], pool: ThreadPoolExecutor):
+        table = ds.dataset(path, format="ipc").to_table()
+        if not table.num_rows:
+            return
+        table = table.sort_by([("ticker_id", "ascending"), ("timestamp", "ascending")])
+        ids = table.column("ticker_id").to_numpy()
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        starts, ends = np.r_[0, bounds], np.r_[bounds, len(ids)]
+        tickers = self.symbols.tickers(ids[starts])
+        bars = table.drop_columns(["ticker_id"])
+        # a flat file holds the whole market, so its sessions are covered even for a
+        # ticker without a bar on some of them
+        list(pool.map(lambda i: store._write_month(tickers[i], month, bars.slice(starts[i], ends[i] - starts[i])),
+                      range(len(starts))))
+        store.coverage.mark(tickers, sessions)
+
+
+class _SpillFile:
+    """Arrow IPC spill file shared by the reader threads"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writer = pa.ipc.new_file(str(path), SPILL_SCHEMA)
+
+    def write_table(self, table: pa.Table):
+        with self._lock:
+            self._writer.write_table(table)
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
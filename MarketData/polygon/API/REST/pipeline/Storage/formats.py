@@ -0,0 +1,92 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+from pathlib import Path
+from dataclasses import dataclass, fields
+from typing import Union, Optional, List, Dict
+from .atomic import atomic_path
+
+FILE_FORMATS = {"parquet": ".parquet", "ipc": ".arrow"}
+
+
+@dataclass
+class WriteOptions:
+    """
+    How tables are encoded on disk.
+
+    Args:
+        format: 'parquet', or 'ipc' for Arrow IPC (feather v2) files
+        compression: Codec name ('snappy', 'zstd', 'lz4', 'gzip', 'brotli' or None); IPC
+            only supports 'zstd' and 'lz4'
+        compression_level: Codec level, None for the codec's default
+        row_group_size: Rows per parquet row group (or IPC record batch), None for pyarrow's default
+        dictionary_columns: Columns to dictionary-encode, None for every column
+        sort_by: Columns to sort rows by before writing; recorded as the parquet sorting columns
+        write_statistics: Whether to write parquet min/max statistics, which readers use to skip row groups
+        column_encoding: Parquet encoding per column, e.g. {'timestamp': 'DELTA_BINARY_PACKED'};
+            these columns must not be dictionary-encoded
+    """
+    format: str = "parquet"
+    compression: Optional[str] = "snappy"
+    compression_level: Optional[int] = None
+    row_group_size: Optional[int] = None
+    dictionary_columns: Optional[List[str]] = None
+    sort_by: Optional[List[str]] = None
+    write_statistics: bool = True
+    column_encoding: Optional[Dict[str, str]] = None
+
+    def __post_init__(self):
+        if self.format not in FILE_FORMATS:
+            raise ValueError(f"Invalid format {self.format}, should be one of {list(FILE_FORMATS)}")
+        if self.format == "ipc" and self.compression not in [None, "zstd", "lz4"]:
+            raise ValueError(f"Invalid compression {self.compression} for Arrow IPC, should be zstd, lz4 or None")
+        if self.column_encoding and (self.dictionary_columns is None
+                                     or set(self.column_encoding) & set(self.dictionary_columns)):
+            raise ValueError("Invalid column_encoding, its columns have to be left out of dictionary_columns")
+
+    @classmethod
+    def from_config(cls, config: Optional[dict] = None) -> "WriteOptions":
+        """Options from a config section; unknown keys are rejected so typos do not go unnoticed"""
+        config = dict(config or {})
+        unknown = set(config) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Invalid write options {sorted(unknown)}")
+        return cls(**config)
+
+    @property
+    def suffix(self) -> str:
+        return FILE_FORMATS[self.format]
+
+    def write_table(self, table: pa.Table, path: Union[str, Path]):
+        """Atomically write `table` to `path`"""
+        if self.sort_by:
+            table = table.sort_by([(column, "ascending") for column in self.sort_by])
+        with atomic_path(path) as tmp_path:
+            if self.format == "ipc":
+                feather.write_feather(table, tmp_path,
+                                      compression=self.compression or "uncompressed",
+                                      compression_level=self.compression_level,
+                                      chunksize=self.row_group_size)
+            else:
+                sorting_columns = (pq.SortingColumn.from_ordering(table.schema, [(column, "ascending") for column in self.sort_by])
+                                   if self.sort_by else None)
+                pq.write_table(table, tmp_path,
+                               row_group_size=self.row_group_size,
+                               compression=self.compression or "none",
+                               compression_level=self.compression_level,
+                               use_dictionary=self.dictionary_columns if self.dictionary_columns is not None else True,
+                               write_statistics=self.write_statistics,
+                               sorting_columns=sorting_columns,
+                               column_encoding=self.column_encoding)
+
+    def write_frame(self, data: pd.DataFrame, path: Union[str, Path]):
+        """`write_table` for a DataFrame, a drop-in `write_func` for `BackgroundWriter`"""
+        self.write_table(pa.Table.from_pandas(data), path)
+
+
+def read_table(path: Union[str, Path], columns: Optional[List[str]] = None) -> pa.Table:
+    """Read a file written by `WriteOptions.write_table`, whatever its format"""
+    if Path(path).suffix == FILE_FORMATS["ipc"]:
+        return feather.read_table(path, columns=columns)
+    return pq.read_table(path, columns=columns)
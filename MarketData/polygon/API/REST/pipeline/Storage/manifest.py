@@ -0,0 +1,104 @@
+import json
+import logging
+import threading
+import pandas as pd
+import datetime as dt
+from pathlib import Path
+from typing import Union, Optional, Dict
+from .atomic import atomic_path, is_complete_parquet
+
+
+class DatasetManifest:
+    """
+    Bookkeeping for a per-session dataset directory ({output_dir}/{YYYY-MM-DD}.parquet).
+
+    For every session written it records the number of rows and the time the data was
+    fetched, so a later run can tell a finished session from one that was captured while
+    it was still trading or before the data was published.
+    """
+    manifest_name = "_manifest.json"
+    file_suffix = ".parquet"
+
+    def __init__(self, output_dir: Union[str, Path]):
+        self.logger = logging.getLogger(__name__)
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / self.manifest_name
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    @staticmethod
+    def session_key(session: Union[str, dt.datetime, pd.Timestamp]) -> str:
+        return pd.Timestamp(session).strftime("%Y-%m-%d")
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.path.exists():
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _dump(self):
+        with atomic_path(self.path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+    def file_for(self, session: Union[str, dt.datetime, pd.Timestamp]) -> Path:
+        return self.output_dir / f"{self.session_key(session)}{self.file_suffix}"
+
+    def record(self,
+               session: Union[str, dt.datetime, pd.Timestamp],
+               rows: int,
+               fetched_at: Optional[pd.Timestamp] = None):
+        """Record that a session has been written with `rows` rows, fetched at `fetched_at` (default: now)."""
+        self.record_many([(session, rows, fetched_at)])
+
+    def record_many(self, records, **fields):
+        """
+        Record several (session, rows, fetched_at) tuples with a single manifest rewrite.
+        Keyword `fields` are stored with every entry, e.g. the run a session was copied into.
+        """
+        now = pd.Timestamp.now(tz="UTC")
+        with self._lock:
+            for session, rows, fetched_at in records:
+                fetched_at = now if fetched_at is None else pd.Timestamp(fetched_at)
+                if fetched_at.tzinfo is None:
+                    fetched_at = fetched_at.tz_localize("UTC")
+                self.entries[self.session_key(session)] = {
+                    "rows": int(rows),
+                    "fetched_at": fetched_at.tz_convert("UTC").isoformat(),
+                    **fields,
+                }
+            self._dump()
+
+    def remove(self, session: Union[str, dt.datetime, pd.Timestamp]):
+        with self._lock:
+            if self.entries.pop(self.session_key(session), None) is not None:
+                self._dump()
+
+    def get(self, session: Union[str, dt.datetime, pd.Timestamp]) -> Optional[dict]:
+        return self.entries.get(self.session_key(session))
+
+    def stored_sessions(self) -> Dict[pd.Timestamp, dict]:
+        """
+        Sessions already on disk, keyed by session date.
+
+        Files written before the manifest existed are picked up from the directory listing,
+        using the file modification time as the fetch time; truncated files are ignored.
+        Entries whose file has since disappeared are not reported.
+        """
+        stored = {
+            pd.Timestamp(key): {"rows": entry.get("rows"), "fetched_at": pd.Timestamp(entry["fetched_at"])}
+            for key, entry in self.entries.items()
+            if not entry.get("rows") or self.file_for(key).exists()
+        }
+        if self.output_dir.exists():
+            for file in self.output_dir.glob(f"*{self.file_suffix}"):
+                try:
+                    session = pd.Timestamp(file.stem)
+                except ValueError:
+                    continue
+                if session not in stored and is_complete_parquet(file):
+                    stored[session] = {
+                        "rows": None,
+                        "fetched_at": pd.Timestamp(file.stat().st_mtime, unit="s", tz="UTC"),
+                    }
+        return stored
@@ -0,0 +1,251 @@
+import json
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import datetime as dt
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pathlib import Path
+from urllib.parse import quote
+from collections import defaultdict
+from typing import Union, Optional, List, Iterable
+from .atomic import atomic_path
+from .reader import BARS_SCHEMA, to_bars_table
+from .symbols import SymbolDictionary
+from .parts import PartitionParts
+from .formats import WriteOptions
+
+
+# bars of a single ticker: the ticker is the partition key rather than a column
+MINUTE_BARS_SCHEMA = pa.schema([field for field in BARS_SCHEMA if field.name != "ticker"])
+
+
+def session_dates(timestamps: Union[pd.Series, np.ndarray], tz: str = "US/Eastern") -> pd.DatetimeIndex:
+    """Session date of Unix ms timestamps"""
+    return (pd.DatetimeIndex(pd.to_datetime(np.asarray(timestamps), unit="ms", utc=True))
+            .tz_convert(tz).normalize().tz_localize(None))
+
+
+class CoverageBitmap:
+    """
+    One bit per (day, ticker id) recording which sessions of which tickers are stored.
+
+    Stored as `{coverage_dir}/coverage.bin`, a uint8 array with one row per calendar day
+    since `start_date` and `ticker_capacity / 8` bytes per row; ticker ids come from the
+    `SymbolDictionary`. A lookup is a single byte read, no data file is touched. Rows
+    are appended as later days are marked; the ticker capacity grows by a one-off rewrite.
+    """
+    meta_name = "coverage.json"
+    data_name = "coverage.bin"
+
+    def __init__(self,
+                 coverage_dir: Union[str, Path],
+                 symbols: SymbolDictionary,
+                 start_date: Union[str, dt.datetime, pd.Timestamp] = "2000-01-01",
+                 ticker_capacity: int = 16384):
+        self.logger = logging.getLogger(__name__)
+        self.coverage_dir = Path(coverage_dir)
+        self.symbols = symbols
+        self.meta_path = self.coverage_dir / self.meta_name
+        self.data_path = self.coverage_dir / self.data_name
+        self._lock = threading.Lock()
+        self._view = None
+        if self.meta_path.exists():
+            self._load_meta()
+        else:
+            self.meta = {
+                "start_date": pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+                "ticker_capacity": int(-(-ticker_capacity // 8) * 8),
+                "num_days": 0,
+            }
+        self.start_date = pd.Timestamp(self.meta["start_date"])
+
+    def _load_meta(self):
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+        self._view = None
+
+    def _save_meta(self):
+        with atomic_path(self.meta_path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(self.meta, f, indent=1)
+        self._view = None
+
+    @property
+    def row_bytes(self) -> int:
+        return self.meta["ticker_capacity"] // 8
+
+    def _rows(self, sessions: Iterable) -> np.ndarray:
+        rows = (pd.DatetimeIndex(list(sessions)).normalize() - self.start_date).days.to_numpy()
+        if (rows < 0).any():
+            raise ValueError(f"Invalid sessions, coverage starts on {self.meta['start_date']}")
+        return rows
+
+    def _bitmap(self) -> np.ndarray:
+        if self._view is None and self.meta["num_days"]:
+            self._view = np.memmap(self.data_path, dtype=np.uint8, mode="r",
+                                   shape=(self.meta["num_days"], self.row_bytes))
+        return self._view
+
+    def mark(self, ticker: Union[str, Iterable[str]], sessions: Iterable, covered: bool = True):
+        """Set (or clear) the coverage bits of `ticker`, or of several tickers at once, for `sessions`"""
+        rows = self._rows(sessions)
+        ticker_ids = self.symbols.ids([ticker] if isinstance(ticker, str) else list(ticker)).astype(np.int64)
+        if not len(rows) or not len(ticker_ids):
+            return
+        with self._lock:
+            if self.meta_path.exists():
+                self._load_meta()
+            if ticker_ids.max() >= self.meta["ticker_capacity"]:
+                self._grow(max(2 * self.meta["ticker_capacity"], -(-(int(ticker_ids.max()) + 1) // 8) * 8))
+            num_days = max(self.meta["num_days"], int(rows.max()) + 1)
+            self.coverage_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.data_path, "r+b" if self.data_path.exists() else "wb") as f:
+                # new days start out uncovered
+                f.truncate(num_days * self.row_bytes)
+            bitmap = np.memmap(self.data_path, dtype=np.uint8, mode="r+", shape=(num_days, self.row_bytes))
+            # one mask over the whole row, so tickers sharing a byte are set together
+            mask = np.zeros(self.row_bytes, dtype=np.uint8)
+            np.bitwise_or.at(mask, ticker_ids >> 3, (1 << (ticker_ids & 7)).astype(np.uint8))
+            if covered:
+                bitmap[rows] |= mask
+            else:
+                bitmap[rows] &= ~mask
+            bitmap.flush()
+            del bitmap
+            self.meta["num_days"] = num_days
+            self._save_meta()
+
+    def _grow(self, new_capacity: int):
+        self.logger.info(f"Growing coverage bitmap from {self.meta['ticker_capacity']} to {new_capacity} tickers")
+        if self.meta["num_days"]:
+            old = np.memmap(self.data_path, dtype=np.uint8, mode="r", shape=(self.meta["num_days"], self.row_bytes))
+            with atomic_path(self.data_path) as tmp_path:
+                new = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(self.meta["num_days"], new_capacity // 8))
+                new[:, :self.row_bytes] = old
+                new.flush()
+                del new
+            del old
+        self.meta["ticker_capacity"] = int(new_capacity)
+        self._save_meta()
+
+    def has(self, ticker: str, session: Union[str, dt.datetime, pd.Timestamp]) -> bool:
+        """Whether bars of `ticker` are stored for `session`"""
+        ticker_id = self.symbols.id_of(ticker)
+        row = (pd.Timestamp(session).normalize() - self.start_date).days
+        if row >= self.meta["num_days"] and self.meta_path.exists():
+            # another process may have marked later days since the meta was read
+            self._load_meta()
+        if ticker_id < 0 or ticker_id >= self.meta["ticker_capacity"] or not 0 <= row < self.meta["num_days"]:
+            return False
+        return bool(self._bitmap()[row, ticker_id >> 3] & (1 << (ticker_id & 7)))
+
+    def covered(self, ticker: str, sessions: Iterable) -> np.ndarray:
+        """Vectorized `has` over many sessions of one ticker"""
+        rows = self._rows(sessions)
+        ticker_id = self.symbols.id_of(ticker)
+        result = np.zeros(len(rows), dtype=bool)
+        if ticker_id < 0 or ticker_id >= self.meta["ticker_capacity"] or not self.meta["num_days"]:
+            return result
+        inside = rows < self.meta["num_days"]
+        result[inside] = (self._bitmap()[rows[inside], ticker_id >> 3] & (1 << (ticker_id & 7))) > 0
+        return result
+
+
+class MinuteBarStore:
+    """
+    Intraday bars partitioned by ticker and month:
+
+        {root_dir}/ticker={ticker}/month={YYYY-MM}/part-*.parquet
+
+    Each month partition is a `PartitionParts` directory: small single-row-group files
+    holding sorted, non-overlapping timestamp ranges. Writing bars upserts them by
+    timestamp (the ticker being the partition key), so re-fetching a few sessions only
+    rewrites the parts those bars fall into. Stored sessions are marked in the
+    `CoverageBitmap` kept in `{root_dir}/_coverage`.
+    """
+
+    def __init__(self,
+                 root_dir: Union[str, Path],
+                 symbols: SymbolDictionary,
+                 row_group_size: int = 8192,
+                 write_options: Optional[WriteOptions] = None):
+        self.logger = logging.getLogger(__name__)
+        self.root_dir = Path(root_dir)
+        self.symbols = symbols
+        self.row_group_size = row_group_size
+        self.write_options = write_options
+        self.coverage = CoverageBitmap(self.root_dir / "_coverage", symbols)
+        self._lock = threading.Lock()
+        self._partition_locks = defaultdict(threading.Lock)
+
+    @staticmethod
+    def _partition_value(ticker: str) -> str:
+        # keep tickers such as X:BTCUSD usable as directory names
+        return quote(ticker, safe="")
+
+    def month_dir(self, ticker: str, month: Union[str, pd.Period]) -> Path:
+        return self.root_dir / f"ticker={self._partition_value(ticker)}" / f"month={pd.Period(month, 'M')}"
+
+    def month_parts(self, ticker: str, month: Union[str, pd.Period]) -> PartitionParts:
+        return PartitionParts(self.month_dir(ticker, month), key="timestamp",
+                              part_rows=self.row_group_size, write_options=self.write_options)
+
+    def write_bars(self, ticker: str, bars: pd.DataFrame, sessions: Optional[Iterable] = None):
+        """
+        Upsert `bars` of `ticker` by timestamp: stored bars with the same timestamp are
+        replaced, the others are kept.
+
+        Args:
+            ticker: The ticker symbol
+            bars: Bars as returned by `PolygonAggregatesHandler.get_aggregates`
+            sessions: Sessions to mark as covered (default: the sessions present in `bars`);
+                pass the sessions a request spanned so sessions without bars are covered too
+        """
+        sessions_of_bars = self.upsert_bars(ticker, bars)
+        self.coverage.mark(ticker, sessions if sessions is not None else sessions_of_bars.unique())
+
+    def upsert_bars(self, ticker: str, bars: pd.DataFrame) -> pd.DatetimeIndex:
+        """
+        `write_bars` without touching the coverage bitmap, for writers in other processes
+        that leave the marking to a single owner. Returns the session of every bar.
+        """
+        table = to_bars_table(bars, MINUTE_BARS_SCHEMA)
+        sessions_of_bars = session_dates(table.column("timestamp").to_numpy())
+        months = sessions_of_bars.to_period("M")
+        for month in months.unique():
+            self._write_month(ticker, month, table.filter(pa.array(np.asarray(months == month))))
+        return sessions_of_bars
+
+    def _write_month(self, ticker: str, month: pd.Period, table: pa.Table):
+        parts = self.month_parts(ticker, month)
+        with self._lock:
+            partition_lock = self._partition_locks[parts.partition_dir]
+        with partition_lock:
+            rows, rewritten = parts.upsert(table)
+        self.logger.debug(f"Upserted {rows} bars into {parts.partition_dir}, rewriting {rewritten} parts")
+
+    def has(self, ticker: str, session: Union[str, dt.datetime, pd.Timestamp]) -> bool:
+        """Whether bars of `ticker` are stored for `session`, answered from the coverage bitmap"""
+        return self.coverage.has(ticker, session)
+
+    def load(self,
+             ticker: str,
+             start: Union[str, dt.datetime, pd.Timestamp],
+             end: Union[str, dt.datetime, pd.Timestamp],
+             columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Bars of one ticker for sessions in [start, end], reading only the month files in range"""
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        files = [str(file) for month in pd.period_range(start, end, freq="M")
+                 for file in self.month_parts(ticker, month).files()]
+        columns = ["timestamp"] + [c for c in (columns or MINUTE_BARS_SCHEMA.names) if c != "timestamp"]
+        if not files:
+            return MINUTE_BARS_SCHEMA.empty_table().select(columns).to_pandas()
+
+        bounds = [int(bound.tz_localize("US/Eastern").tz_convert("UTC").timestamp() * 1000)
+                  for bound in (start, end + pd.Timedelta(days=1))]
+        timestamp = ds.field("timestamp")
+        return (ds.dataset(files, format="parquet", schema=MINUTE_BARS_SCHEMA)
+                .to_table(columns=columns, filter=(timestamp >= bounds[0]) & (timestamp < bounds[1]))
+                .to_pandas())
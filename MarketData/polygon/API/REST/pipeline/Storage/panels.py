@@ -0,0 +1,216 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+import datetime as dt
+from pathlib import Path
+from typing import Union, Optional, List
+from .atomic import atomic_path
+from .manifest import DatasetManifest
+from .symbols import SymbolDictionary
+from .universe import UniverseStore
+
+
+# one (session x ticker-id) array per field, with a fixed dtype; counts are integers so
+# that they stay exact past float32's 2**24
+PANEL_FIELDS = {
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "volume": "float64",
+    "vwap": "float64",
+    "transactions": "int64",
+}
+# integer fields cannot hold NaN: a missing count is stored as -1
+MISSING_COUNT = -1
+FIELD_ALIASES = {"o": "open", "h": "high", "l": "low", "c": "close", "v": "volume", "vw": "vwap", "n": "transactions"}
+
+
+class PanelStore:
+    """
+    Date x ticker panels of the grouped daily fields, stored as raw memory-mapped arrays.
+
+    Each field lives in `{panel_dir}/{field}.bin`, a C-ordered array with one row per
+    `MarketTime` session since `start_date` and one column per id of the
+    `SymbolDictionary`, missing values being NaN (`MISSING_COUNT` in integer fields). Rows are only ever appended (or patched
+    in place when a session is re-fetched), so adding a session never rewrites the file;
+    the row count is kept in `panel.json`, which is replaced atomically after the data.
+    Readers get read-only `np.memmap` views, shared through the page cache.
+
+    The column count is fixed at `ticker_capacity`; when the symbol dictionary outgrows
+    it the panels are rewritten once with twice the capacity.
+    """
+    meta_name = "panel.json"
+
+    def __init__(self,
+                 panel_dir: Union[str, Path],
+                 market_time_resolver,
+                 symbols: SymbolDictionary,
+                 start_date: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+                 ticker_capacity: int = 16384,
+                 universe: Optional[UniverseStore] = None):
+        self.logger = logging.getLogger(__name__)
+        self.panel_dir = Path(panel_dir)
+        self.market_time_resolver = market_time_resolver
+        self.symbols = symbols
+        # resolves the tickers of sessions stored before ids to that session's listings
+        self.universe = universe
+        self.meta_path = self.panel_dir / self.meta_name
+        self.manifest = DatasetManifest(self.panel_dir)
+        if self.meta_path.exists():
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            if start_date is None:
+                raise ValueError("start_date is required to create a new panel store")
+            self.meta = {
+                "start_date": pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+                "ticker_capacity": int(ticker_capacity),
+                "num_sessions": 0,
+                "fields": PANEL_FIELDS,
+            }
+
+    @property
+    def num_sessions(self) -> int:
+        return self.meta["num_sessions"]
+
+    @property
+    def ticker_capacity(self) -> int:
+        return self.meta["ticker_capacity"]
+
+    def _file(self, field: str) -> Path:
+        return self.panel_dir / f"{field}.bin"
+
+    def _dtype(self, field: str) -> np.dtype:
+        return np.dtype(self.meta["fields"][field])
+
+    @staticmethod
+    def _missing(dtype: np.dtype):
+        return np.nan if dtype.kind == "f" else MISSING_COUNT
+
+    def _save_meta(self):
+        with atomic_path(self.meta_path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(self.meta, f, indent=1)
+
+    @property
+    def _first_session(self) -> int:
+        """Ordinal of the first row's session in the calendar's session table"""
+        return int(self.market_time_resolver.sessions.searchsorted(pd.Timestamp(self.meta["start_date"])))
+
+    def row_of(self, session: Union[str, dt.datetime, pd.Timestamp]) -> int:
+        session = pd.Timestamp(session).normalize()
+        ordinal = self.market_time_resolver.session_index(session)
+        if ordinal < self._first_session:
+            raise ValueError(f"Invalid session {session.date()}, not a market day on or after {self.meta['start_date']}")
+        return ordinal - self._first_session
+
+    def sessions(self) -> pd.DatetimeIndex:
+        """Session date of every row: the next `num_sessions` sessions of the calendar from `start_date`"""
+        first = self._first_session
+        return self.market_time_resolver.sessions[first:first + self.num_sessions]
+
+    def append_session(self, session: Union[str, dt.datetime, pd.Timestamp], data: pd.DataFrame):
+        """Write one session of grouped daily bars, keyed by `ticker_id` or `ticker`, as a row of every panel"""
+        row = self.row_of(session)
+        if "ticker_id" in data.columns:
+            ids = data["ticker_id"].to_numpy(dtype=np.int32)
+        else:
+            ids = self.symbols.ids(data["ticker"],
+                                   listings=self.universe.get(session) if self.universe is not None else None)
+        valid = ids >= 0
+        if len(ids) and ids.max() >= self.ticker_capacity:
+            self._grow(max(2 * self.ticker_capacity, int(ids.max()) + 1))
+
+        self.panel_dir.mkdir(parents=True, exist_ok=True)
+        capacity = self.ticker_capacity
+        for field in self.meta["fields"]:
+            dtype = self._dtype(field)
+            values = np.full(capacity, self._missing(dtype), dtype=dtype)
+            if field in data.columns:
+                values[ids[valid]] = data[field].to_numpy(dtype=dtype, na_value=self._missing(dtype))[valid]
+            if row < self.num_sessions:
+                panel = np.memmap(self._file(field), dtype=dtype, mode="r+", shape=(self.num_sessions, capacity))
+                panel[row] = values
+                panel.flush()
+                del panel
+            else:
+                with open(self._file(field), "r+b" if self._file(field).exists() else "wb") as f:
+                    # anything past the recorded row count is a leftover of an interrupted append
+                    f.truncate(self.num_sessions * capacity * dtype.itemsize)
+                    f.seek(0, 2)
+                    gap = np.full(capacity, self._missing(dtype), dtype=dtype).tobytes()
+                    for _ in range(self.num_sessions, row):
+                        f.write(gap)
+                    f.write(values.tobytes())
+        self.meta["num_sessions"] = max(self.num_sessions, row + 1)
+        self._save_meta()
+
+    def _grow(self, new_capacity: int):
+        self.logger.info(f"Growing panels from {self.ticker_capacity} to {new_capacity} tickers")
+        for field in self.meta["fields"]:
+            dtype = self._dtype(field)
+            if not self.num_sessions or not self._file(field).exists():
+                continue
+            old = np.memmap(self._file(field), dtype=dtype, mode="r", shape=(self.num_sessions, self.ticker_capacity))
+            with atomic_path(self._file(field)) as tmp_path:
+                new = np.memmap(tmp_path, dtype=dtype, mode="w+", shape=(self.num_sessions, new_capacity))
+                new[:] = self._missing(dtype)
+                new[:, :self.ticker_capacity] = old
+                new.flush()
+                del new
+            del old
+        self.meta["ticker_capacity"] = int(new_capacity)
+        self._save_meta()
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Read-only (session x ticker-id) view of a field; `o/h/l/c/v/vw/n` are accepted as
+        aliases. Columns beyond the symbol dictionary's size are unassigned and all missing.
+        """
+        name = FIELD_ALIASES.get(name, name)
+        if name not in self.meta["fields"]:
+            raise ValueError(f"Invalid field {name}, should be one of {list(self.meta['fields'])}")
+        if not self.num_sessions:
+            return np.empty((0, self.ticker_capacity), dtype=self._dtype(name))
+        return np.memmap(self._file(name), dtype=self._dtype(name), mode="r",
+                         shape=(self.num_sessions, self.ticker_capacity))
+
+    def frame(self,
+              name: str,
+              start: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+              end: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+              tickers: Optional[List[str]] = None) -> pd.DataFrame:
+        """Field as a DataFrame indexed by session with one column per ticker; missing counts are <NA>"""
+        sessions = self.sessions()
+        rows = slice(sessions.searchsorted(pd.Timestamp(start)) if start is not None else 0,
+                     sessions.searchsorted(pd.Timestamp(end), side="right") if end is not None else len(sessions))
+        panel = self.field(name)
+        if tickers is None:
+            ids = np.arange(len(self.symbols))
+            values = panel[rows, :len(ids)]
+        else:
+            ids = self.symbols.ids(tickers, assign=False)
+            if (ids < 0).any():
+                raise ValueError(f"Unknown tickers {list(np.asarray(tickers)[ids < 0])}")
+            values = panel[rows][:, ids]
+        frame = pd.DataFrame(values, index=sessions[rows], columns=self.symbols.tickers(ids), copy=False)
+        if values.dtype.kind != "f":
+            frame = frame.astype("Int64").mask(frame == MISSING_COUNT)
+        return frame
+
+    def update(self, source_dir: Union[str, Path]) -> int:
+        """Append the grouped daily sessions not yet in the panels, and patch the re-fetched ones"""
+        source = DatasetManifest(source_dir)
+        done = {pd.Timestamp(key): pd.Timestamp(entry["fetched_at"]) for key, entry in self.manifest.entries.items()}
+        stored = source.stored_sessions()
+        pending = sorted(session for session, entry in stored.items()
+                         if session >= pd.Timestamp(self.meta["start_date"])
+                         and (session not in done or done[session] < entry["fetched_at"]))
+        for session in pending:
+            data = pd.read_parquet(source.file_for(session))
+            self.append_session(session, data)
+            self.manifest.record(session, len(data), stored[session]["fetched_at"])
+        self.logger.info(f"Appended {len(pending)} sessions from {source_dir} to panels in {self.panel_dir}")
+        return len(pending)
@@ -0,0 +1,147 @@
+import json
+import uuid
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from dataclasses import replace
+from typing import Union, Optional, List, Tuple
+from .atomic import atomic_path, is_complete_parquet
+from .formats import WriteOptions
+
+
+def dedupe_sorted(table: pa.Table, key: str) -> pa.Table:
+    """Keep the last row of every run of equal `key` values in a table sorted by `key`"""
+    if table.num_rows < 2:
+        return table
+    keys = table.column(key).to_numpy()
+    keep = np.append(keys[1:] != keys[:-1], True)
+    return table if keep.all() else table.filter(pa.array(keep))
+
+
+def upsert_table(existing: pa.Table, new: pa.Table, key: str) -> pa.Table:
+    """
+    Merge `new` rows into `existing`, sorted by `key`; where both hold a row with the same
+    key the row from `new` wins.
+    """
+    # sort_indices is stable, so for equal keys the rows of `new` come last and are kept
+    merged = pa.concat_tables([existing, new.cast(existing.schema)])
+    return dedupe_sorted(merged.take(pc.sort_indices(merged, [(key, "ascending")])), key)
+
+
+class PartitionParts:
+    """
+    A partition directory stored as several part files, each a single row group holding a
+    sorted, non-overlapping range of `key`.
+
+    The live parts and their key ranges are listed in `_parts.json`, which is replaced
+    atomically after new parts are written: that swap is the commit point, so readers never
+    see a half-applied upsert, and files left behind by an interrupted one are simply not
+    listed. An `upsert` only rewrites the parts its keys fall into (or next to), so the
+    cost of a refresh follows the size of the change rather than the size of the partition.
+
+    Directories written before the part list existed are read from their parquet footers.
+    """
+    parts_name = "_parts.json"
+
+    def __init__(self,
+                 partition_dir: Union[str, Path],
+                 key: str = "timestamp",
+                 part_rows: int = 8192,
+                 write_options: Optional[WriteOptions] = None):
+        self.logger = logging.getLogger(__name__)
+        self.partition_dir = Path(partition_dir)
+        self.key = key
+        self.part_rows = part_rows
+        # parts are always parquet files kept in key order, one row group each
+        self.write_options = replace(write_options or WriteOptions(), format="parquet", sort_by=None)
+        self.path = self.partition_dir / self.parts_name
+
+    def parts(self) -> List[dict]:
+        """Live parts as {"file", "min", "max", "rows"} dicts, in key order"""
+        if self.path.exists():
+            with open(self.path) as f:
+                return json.load(f)["parts"]
+        if not self.partition_dir.exists():
+            return []
+        parts = []
+        for file in sorted(self.partition_dir.glob("*.parquet")):
+            if not is_complete_parquet(file):
+                continue
+            keys = pq.read_table(file, columns=[self.key]).column(self.key)
+            if len(keys):
+                parts.append(self._entry(file.name, pc.min(keys).as_py(), pc.max(keys).as_py(), len(keys)))
+        return sorted(parts, key=lambda part: part["min"])
+
+    def files(self) -> List[Path]:
+        return [self.partition_dir / part["file"] for part in self.parts()]
+
+    @staticmethod
+    def _entry(file: str, key_min, key_max, rows: int) -> dict:
+        return {"file": file, "min": key_min, "max": key_max, "rows": int(rows)}
+
+    def upsert(self, table: pa.Table) -> Tuple[int, int]:
+        """
+        Merge `table` into the partition by `key`, replacing rows whose key is already stored.
+        Not safe against concurrent writers of the same partition; callers serialise them.
+
+        Returns:
+            (rows written, parts rewritten)
+        """
+        if not table.num_rows:
+            return 0, 0
+        table = dedupe_sorted(table.take(pc.sort_indices(table, [(self.key, "ascending")])), self.key)
+        parts = self.parts()
+        keys = table.column(self.key).to_numpy()
+
+        # every new key goes to the last part starting at or before it (keys before the
+        # first part go to the first one), which keeps the parts non-overlapping
+        if parts:
+            owner = np.searchsorted(np.array([part["min"] for part in parts]), keys, side="right") - 1
+            owner = np.clip(owner, 0, None)
+        else:
+            owner = np.full(len(keys), -1)
+        bounds = np.flatnonzero(np.diff(owner)) + 1
+        starts, ends = np.r_[0, bounds], np.r_[bounds, len(keys)]
+
+        replaced, written = [], []
+        for start, end in zip(starts, ends):
+            chunk = table.slice(start, end - start)
+            index = int(owner[start])
+            if index >= 0:
+                part = parts[index]
+                existing = pq.read_table(self.partition_dir / part["file"], schema=table.schema)
+                chunk = upsert_table(existing, chunk, self.key)
+                replaced.append(part)
+            written.extend(self._write_parts(chunk))
+
+        replaced_files = {part["file"] for part in replaced}
+        live = sorted([part for part in parts if part["file"] not in replaced_files] + written,
+                      key=lambda part: part["min"])
+        self._commit(live, replaced_files)
+        return table.num_rows, len(replaced)
+
+    def _write_parts(self, table: pa.Table) -> List[dict]:
+        # a part that outgrows twice the target size is split into even pieces
+        num_parts = max(1, -(-table.num_rows // self.part_rows)) if table.num_rows > 2 * self.part_rows else 1
+        size = -(-table.num_rows // num_parts)
+        entries = []
+        for offset in range(0, table.num_rows, size):
+            piece = table.slice(offset, size)
+            name = f"part-{uuid.uuid4().hex[:16]}.parquet"
+            replace(self.write_options, row_group_size=piece.num_rows).write_table(piece, self.partition_dir / name)
+            keys = piece.column(self.key)
+            entries.append(self._entry(name, keys[0].as_py(), keys[-1].as_py(), piece.num_rows))
+        return entries
+
+    def _commit(self, live: List[dict], replaced_files: set):
+        with atomic_path(self.path) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump({"key": self.key, "parts": live}, f, indent=1)
+        live_files = {part["file"] for part in live}
+        for file in self.partition_dir.glob("*.parquet"):
+            # replaced parts, and leftovers of upserts that never committed
+            if file.name not in live_files and (file.name in replaced_files or file.name.startswith("part-")):
+                file.unlink()
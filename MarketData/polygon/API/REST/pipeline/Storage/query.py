@@ -0,0 +1,204 @@
+import yaml
+import logging
+import pandas as pd
+import datetime as dt
+import pyarrow as pa
+from pathlib import Path
+from typing import Union, Optional, Dict, List
+from .reader import BARS_SCHEMA, MarketDataStore
+from .parts import PartitionParts
+
+# duckdb type of every stored bars column
+SQL_TYPES = {
+    pa.string(): "VARCHAR",
+    pa.float64(): "DOUBLE",
+    pa.int64(): "BIGINT",
+    pa.bool_(): "BOOLEAN",
+}
+SESSION_DATE_SQL = "CAST(timezone('America/New_York', to_timestamp({timestamp} / 1000)) AS DATE)"
+MINUTE_HIVE_SQL = "hive_partitioning = true, hive_types = {'ticker': VARCHAR, 'month': VARCHAR}"
+
+
+def _sql_literal(value: Union[str, Path]) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class MarketDataSQL:
+    """
+    SQL over the stored datasets through an embedded DuckDB connection.
+
+    The datasets are registered as views, so every query streams over the files with
+    DuckDB's multi-threaded vectorized engine instead of loading them into pandas:
+
+        grouped_daily            one row per (session, ticker), plus a `date` column; stored
+                                 ticker ids are decoded through `symbols`
+        aggregates_{timespan}    one view per timespan directory, with the `ticker` and
+                                 `month` hive partitions and a `date` column
+        symbols                  the ticker id dictionary (id, ticker, composite_figi, current)
+        calendar                 one row per session: date, market_open, market_close
+
+    Columns are cast to the types of `BARS_SCHEMA`, so files written with slightly
+    different encodings read the same; `timestamp` stays in Unix ms. For example, the
+    average daily dollar volume per ticker over five years:
+
+        sql.query(\"\"\"
+            SELECT ticker, avg(volume * vwap) AS adv
+            FROM grouped_daily WHERE date >= current_date - INTERVAL 5 YEAR
+            GROUP BY ticker ORDER BY adv DESC
+        \"\"\", output="pandas")
+
+    Views read whatever files exist when a query runs. Minute-bar parts are joined on the
+    `_parts.json` list of their partition, read by the same query, so parts that are written
+    but not committed yet, or replaced but not deleted yet, are left out. A query racing a
+    writer may still read the list before a commit and the parts after it; query settled data.
+    """
+
+    def __init__(self,
+                 grouped_daily_dir: Optional[Union[str, Path]] = None,
+                 aggregates_dir: Optional[Union[str, Path]] = None,
+                 symbols_file: Optional[Union[str, Path]] = None,
+                 market_time_resolver=None,
+                 calendar_start: Union[str, dt.datetime, pd.Timestamp] = "2000-01-01",
+                 database: str = ":memory:",
+                 threads: Optional[int] = None,
+                 memory_limit: Optional[str] = None):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("MarketDataSQL requires duckdb, install it with `pip install duckdb`") from e
+
+        self.logger = logging.getLogger(__name__)
+        self.grouped_daily_dir = Path(grouped_daily_dir) if grouped_daily_dir else None
+        self.aggregates_dir = Path(aggregates_dir) if aggregates_dir else None
+        self.symbols_file = Path(symbols_file) if symbols_file else None
+        self.market_time_resolver = market_time_resolver
+        self.calendar_start = pd.Timestamp(calendar_start)
+        self.connection = duckdb.connect(database)
+        if threads is not None:
+            self.connection.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            self.connection.execute(f"SET memory_limit = {_sql_literal(memory_limit)}")
+        self.refresh()
+
+    @classmethod
+    def from_config(cls, params_config_file: Union[str, Path], **kwargs) -> 'MarketDataSQL':
+        """Views over the output directories and symbol dictionary named in the job configs"""
+        from ...utils.datetimes import MarketTime
+
+        params_config = yaml.load(open(params_config_file), Loader=yaml.FullLoader)
+        global_config = params_config.get("global", {})
+        store = MarketDataStore.from_config(params_config_file)
+        return cls(store.grouped_daily_dir, store.aggregates_dir,
+                   symbols_file=global_config.get("symbols_file", "./polygon/md/symbols.parquet"),
+                   market_time_resolver=MarketTime(global_config.get("market_name", None)),
+                   **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _bars_select(columns: Dict[str, str], extra: str = "", table: str = "") -> str:
+        prefix = f"{table}." if table else ""
+        casts = ", ".join(f"CAST({prefix}{name} AS {sql_type}) AS {name}" for name, sql_type in columns.items())
+        return f"SELECT {SESSION_DATE_SQL.format(timestamp=prefix + 'timestamp')} AS date, {casts}{extra}"
+
+    def _grouped_daily_select(self, source: str, has_symbols: bool) -> str:
+        stored = {row[0] for row in self.connection.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+        columns = {field.name: SQL_TYPES[field.type] for field in BARS_SCHEMA if field.name != "ticker"}
+        if "ticker_id" not in stored:
+            return f"{self._bars_select(columns, ', CAST(NULL AS INTEGER) AS ticker_id, g.ticker', 'g')} FROM {source} g"
+        if not has_symbols:
+            raise ValueError("Grouped daily files store ticker ids, a symbols file is needed to decode them")
+        # sessions written before ticker ids were introduced keep their ticker strings
+        ticker = "coalesce(s.ticker, g.ticker)" if "ticker" in stored else "s.ticker"
+        return (f"{self._bars_select(columns, f', g.ticker_id, {ticker} AS ticker', 'g')} "
+                f"FROM {source} g LEFT JOIN symbols s ON s.id = g.ticker_id")
+
+    @staticmethod
+    def _minute_source(timespan_dir: Path) -> str:
+        """FROM clause of the live parts of a timespan directory, as listed by their partitions' `_parts.json`"""
+        source = (f"read_parquet({_sql_literal(timespan_dir / 'ticker=*/month=*/*.parquet')}, "
+                  f"{MINUTE_HIVE_SQL}, union_by_name = true, filename = true) b")
+        parts_glob = timespan_dir / "ticker=*" / "month=*" / PartitionParts.parts_name
+        if not any(timespan_dir.glob(f"ticker=*/month=*/{PartitionParts.parts_name}")):
+            return source
+        # partitions written before the part list existed have no entry and keep every file
+        return (f"{source} LEFT JOIN ("
+                f"SELECT ticker, month, list(part.file) AS files FROM ("
+                f"SELECT ticker, month, unnest(parts) AS part FROM read_json({_sql_literal(parts_glob)}, "
+                f"{MINUTE_HIVE_SQL}, columns = {{'parts': 'STRUCT(file VARCHAR)[]'}})) "
+                f"GROUP BY ticker, month) p ON p.ticker = b.ticker AND p.month = b.month "
+                f"WHERE p.files IS NULL OR list_contains(p.files, parse_filename(b.filename))")
+
+    def refresh(self) -> List[str]:
+        """(Re)create the views, picking up datasets created since the connection was opened"""
+        views = {}
+        bars_columns = {field.name: SQL_TYPES[field.type] for field in BARS_SCHEMA}
+
+        if self.symbols_file is not None and self.symbols_file.exists():
+            views["symbols"] = f"SELECT * FROM read_parquet({_sql_literal(self.symbols_file)}, union_by_name = true)"
+            self.connection.execute(f"CREATE OR REPLACE VIEW symbols AS {views['symbols']}")
+
+        if self.grouped_daily_dir is not None and any(self.grouped_daily_dir.glob("*.parquet")):
+            source = f"read_parquet({_sql_literal(self.grouped_daily_dir / '*.parquet')}, union_by_name = true)"
+            views["grouped_daily"] = self._grouped_daily_select(source, "symbols" in views)
+
+        if self.aggregates_dir is not None and self.aggregates_dir.exists():
+            minute_columns = {name: sql_type for name, sql_type in bars_columns.items() if name != "ticker"}
+            for timespan_dir in sorted(path for path in self.aggregates_dir.iterdir() if path.is_dir()):
+                if not any(timespan_dir.glob("ticker=*/month=*/*.parquet")):
+                    continue
+                # partition values are url-quoted tickers (X%3ABTCUSD)
+                views[f"aggregates_{timespan_dir.name}"] = (
+                    f"{self._bars_select(minute_columns, ', url_decode(b.ticker) AS ticker, b.month', 'b')} "
+                    f"FROM {self._minute_source(timespan_dir)}")
+
+        for name, select in views.items():
+            self.connection.execute(f"CREATE OR REPLACE VIEW {name} AS {select}")
+        names = sorted(views)
+        if self.market_time_resolver is not None:
+            self._register_calendar()
+            names.append("calendar")
+        self.logger.info(f"Registered {names}")
+        return names
+
+    def _register_calendar(self):
+        hours = self.market_time_resolver.get_detail_hours(
+            self.calendar_start, pd.Timestamp.today().normalize() + pd.Timedelta(days=366))
+        calendar = pa.table({
+            "date": pa.array(hours.index.date, type=pa.date32()),
+            "market_open": pa.array(hours["market_open"].dt.tz_convert("UTC")),
+            "market_close": pa.array(hours["market_close"].dt.tz_convert("UTC")),
+        })
+        self.connection.register("calendar_arrow", calendar)
+        self.connection.execute("CREATE OR REPLACE TABLE calendar AS SELECT * FROM calendar_arrow")
+        self.connection.unregister("calendar_arrow")
+
+    def register_parquet(self, name: str, path: Union[str, Path], hive_partitioning: bool = False):
+        """Expose further parquet files (a path or glob) as a view, e.g. reference tables"""
+        self.connection.execute(
+            f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet({_sql_literal(path)}, "
+            f"hive_partitioning = {str(hive_partitioning).lower()}, union_by_name = true)")
+
+    def query(self, sql: str, params: Optional[list] = None, output: str = "arrow") -> Union[pa.Table, pd.DataFrame]:
+        """
+        Run `sql` against the registered views.
+
+        Args:
+            sql: The query
+            params: Values for `?` placeholders in `sql`
+            output: 'arrow' for a `pyarrow.Table`, 'pandas' for a DataFrame
+        """
+        if output not in ["arrow", "pandas"]:
+            raise ValueError(f"Invalid output {output}, should be 'arrow' or 'pandas'")
+        result = self.connection.execute(sql, params or [])
+        if output == "pandas":
+            return result.df()
+        # to_arrow_table replaced fetch_arrow_table in duckdb 1.4
+        return (getattr(result, "to_arrow_table", None) or result.fetch_arrow_table)()
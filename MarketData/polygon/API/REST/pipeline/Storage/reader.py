@@ -0,0 +1,263 @@
+import yaml
+import logging
+import pandas as pd
+import datetime as dt
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+from pathlib import Path
+from urllib.parse import quote, unquote
+from typing import Union, Optional, List
+from .manifest import DatasetManifest
+from .parts import PartitionParts
+from .symbols import SymbolDictionary
+
+
+# column layout of the bars written by the grouped daily and aggregates jobs
+BARS_SCHEMA = pa.schema([
+    ("ticker", pa.string()),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.float64()),
+    ("vwap", pa.float64()),
+    ("timestamp", pa.int64()),
+    ("transactions", pa.int64()),
+    ("otc", pa.bool_()),
+])
+
+# grouped daily files store the symbol dictionary id in place of the ticker; files
+# written before ids were introduced have the ticker string instead
+STORED_BARS_SCHEMA = pa.schema([("ticker_id", pa.int32())] + list(BARS_SCHEMA))
+
+# short field names used by the raw REST responses and schema dataclasses
+SHORT_FIELD_NAMES = {"T": "ticker", "o": "open", "h": "high", "l": "low", "c": "close",
+                     "v": "volume", "vw": "vwap", "t": "timestamp", "n": "transactions"}
+
+
+def to_bars_table(bars: pd.DataFrame, schema: pa.Schema = BARS_SCHEMA) -> pa.Table:
+    """
+    Conform a frame of bars, as returned by the API or REST handlers, to `schema`:
+    short names are expanded, a datetime index becomes the `timestamp` column (Unix ms),
+    missing columns are filled with nulls and extra ones dropped.
+    """
+    bars = bars.rename(columns=SHORT_FIELD_NAMES)
+    if "timestamp" not in bars.columns and isinstance(bars.index, pd.DatetimeIndex):
+        index = bars.index.tz_localize("UTC") if bars.index.tz is None else bars.index
+        bars = bars.reset_index(drop=True).assign(timestamp=index.as_unit("ms").asi8)
+    columns = {}
+    for field in schema:
+        if field.name in bars.columns:
+            columns[field.name] = pa.array(bars[field.name], from_pandas=True).cast(field.type)
+        else:
+            columns[field.name] = pa.nulls(len(bars), type=field.type)
+    return pa.table(columns, schema=schema)
+
+
+class MarketDataStore:
+    """
+    Read side of the datasets written by `EnhancedTaskRabbit`.
+
+    Date predicates prune whole session files by name, ticker predicates and column
+    projection are pushed down into the Arrow dataset scan, and the files are scanned in
+    parallel into a single frame typed after `BARS_SCHEMA`. Ticker ids stored in the files
+    are decoded through `symbols` into a categorical `ticker` column.
+
+    Grouped daily loads of given tickers are read from the ticker-major copy in
+    `by_ticker_dir` (see `GroupedDailyTransposer`) when it holds every session of the
+    range, which touches a few bucket files instead of every session file.
+    """
+
+    def __init__(self,
+                 grouped_daily_dir: Optional[Union[str, Path]] = None,
+                 aggregates_dir: Optional[Union[str, Path]] = None,
+                 symbols: Optional[SymbolDictionary] = None,
+                 by_ticker_dir: Optional[Union[str, Path]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.grouped_daily_dir = Path(grouped_daily_dir) if grouped_daily_dir else None
+        self.aggregates_dir = Path(aggregates_dir) if aggregates_dir else None
+        self.symbols = symbols
+        self.by_ticker_dir = Path(by_ticker_dir) if by_ticker_dir else None
+        self._by_ticker = None
+
+    @classmethod
+    def from_config(cls, params_config_file: Union[str, Path]) -> 'MarketDataStore':
+        """Build a store over the output directories named in the jobs' run config files"""
+        params_config = yaml.load(open(params_config_file), Loader=yaml.FullLoader)
+        output_dirs, run_configs = {}, {}
+        for job_name, default_dir in [("grouped_daily", "./ploygon/md/grouped_daily"),
+                                      ("aggregates", "./polygon/md/aggregates")]:
+            run_config_file = params_config.get(job_name, {}).get("run_config_file", None)
+            if run_config_file:
+                run_configs[job_name] = yaml.load(open(run_config_file), Loader=yaml.FullLoader) or {}
+                output_dirs[job_name] = run_configs[job_name].get("output_dir", default_dir)
+        by_ticker_dir = None
+        if "grouped_daily" in output_dirs:
+            # where the transpose_grouped_daily job writes
+            by_ticker_dir = run_configs["grouped_daily"].get("by_ticker_dir", f"{output_dirs['grouped_daily']}_by_ticker")
+        symbols_file = params_config.get("global", {}).get("symbols_file", "./polygon/md/symbols.parquet")
+        return cls(output_dirs.get("grouped_daily"), output_dirs.get("aggregates"),
+                   SymbolDictionary(symbols_file) if Path(symbols_file).exists() else None,
+                   by_ticker_dir)
+
+    @staticmethod
+    def _session_files(directory: Path,
+                       start: Union[str, dt.datetime, pd.Timestamp],
+                       end: Union[str, dt.datetime, pd.Timestamp]) -> List[str]:
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        files = []
+        for file in sorted(directory.glob(f"*{DatasetManifest.file_suffix}")):
+            try:
+                session = pd.Timestamp(file.stem)
+            except ValueError:
+                continue
+            if start <= session <= end:
+                files.append(str(file))
+        return files
+
+    def _scan(self,
+              directory: Optional[Path],
+              start: Union[str, dt.datetime, pd.Timestamp],
+              end: Union[str, dt.datetime, pd.Timestamp],
+              tickers: Optional[List[str]] = None,
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+        if directory is None:
+            raise ValueError("No directory configured for this dataset")
+
+        columns = ["ticker", "timestamp"] + [c for c in (columns or BARS_SCHEMA.names) if c not in ["ticker", "timestamp"]]
+        unknown = set(columns) - set(BARS_SCHEMA.names)
+        if unknown:
+            raise ValueError(f"Invalid columns {sorted(unknown)}, should be in {BARS_SCHEMA.names}")
+
+        files = self._session_files(directory, start, end)
+        if files:
+            dataset = ds.dataset(files, format="parquet", schema=STORED_BARS_SCHEMA)
+            filter_expr = None
+            if tickers is not None:
+                filter_expr = ds.field("ticker").isin(list(tickers))
+                if self.symbols is not None:
+                    filter_expr = filter_expr | ds.field("ticker_id").isin(self.symbols.all_ids(tickers).tolist())
+            table = dataset.to_table(columns=["ticker_id"] + columns, filter=filter_expr, use_threads=True)
+        else:
+            table = STORED_BARS_SCHEMA.empty_table().select(["ticker_id"] + columns)
+
+        data = table.drop_columns(["ticker_id", "ticker"]).to_pandas()
+        data.insert(0, "ticker", self._decode_tickers(table.column("ticker_id"), table.column("ticker")))
+        data.insert(0, "date", (pd.to_datetime(data["timestamp"], unit="ms", utc=True)
+                                .dt.tz_convert("US/Eastern").dt.normalize().dt.tz_localize(None)))
+        self.logger.info(f"Loaded {len(data)} rows from {len(files)} files in {directory}")
+        return data
+
+    def _decode_tickers(self, ids: pa.ChunkedArray, tickers: pa.ChunkedArray):
+        if ids.null_count == len(ids):
+            return tickers.to_pandas()
+        if self.symbols is None:
+            raise ValueError("A SymbolDictionary is needed to decode the stored ticker ids")
+        if not ids.null_count:
+            return self.symbols.decode(ids.to_numpy())
+        # a range spanning files written before and after ticker ids were introduced
+        values = tickers.to_numpy(zero_copy_only=False).astype(object)
+        has_id = pc.is_valid(ids).to_numpy(zero_copy_only=False)
+        values[has_id] = self.symbols.tickers(ids.drop_null().to_numpy())
+        return pd.Categorical(values)
+
+    @property
+    def by_ticker(self):
+        """`GroupedDailyTransposer` over `by_ticker_dir`, None while there is no ticker-major copy"""
+        if self._by_ticker is None and self.by_ticker_dir is not None and self.symbols is not None \
+                and self.grouped_daily_dir is not None and self.by_ticker_dir.exists():
+            # imported here: the transposer builds on this module's schemas
+            from .transpose import GroupedDailyTransposer
+            self._by_ticker = GroupedDailyTransposer(self.grouped_daily_dir, self.by_ticker_dir, self.symbols)
+        return self._by_ticker
+
+    def _load_by_ticker(self,
+                        start: Union[str, dt.datetime, pd.Timestamp],
+                        end: Union[str, dt.datetime, pd.Timestamp],
+                        tickers: List[str],
+                        columns: Optional[List[str]] = None) -> pd.DataFrame:
+        columns = [c for c in (columns or BARS_SCHEMA.names) if c not in ["ticker", "timestamp"]]
+        unknown = set(columns) - set(BARS_SCHEMA.names)
+        if unknown:
+            raise ValueError(f"Invalid columns {sorted(unknown)}, should be in {BARS_SCHEMA.names}")
+        data = self.by_ticker.load_tickers(tickers, start, end, columns)
+        data.insert(0, "date", (pd.to_datetime(data["timestamp"], unit="ms", utc=True)
+                                .dt.tz_convert("US/Eastern").dt.normalize().dt.tz_localize(None)))
+        self.logger.info(f"Loaded {len(data)} rows of {len(tickers)} tickers from {self.by_ticker_dir}")
+        return data
+
+    def load_grouped_daily(self,
+                           start: Union[str, dt.datetime, pd.Timestamp],
+                           end: Union[str, dt.datetime, pd.Timestamp],
+                           tickers: Optional[List[str]] = None,
+                           columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Load grouped daily bars for sessions in [start, end]. With `tickers`, they are read
+        from the ticker-major copy when it is up to date over the range, ordered by ticker
+        and time instead of by session.
+
+        Args:
+            start: First session to load
+            end: Last session to load
+            tickers: Only load these tickers (default: all)
+            columns: Only load these columns of `BARS_SCHEMA` (default: all); ticker and
+                timestamp are always included
+
+        Returns:
+            DataFrame with a `date` column followed by the requested columns
+        """
+        if tickers is not None and self.by_ticker is not None and self.by_ticker.covers(start, end):
+            return self._load_by_ticker(start, end, tickers, columns)
+        return self._scan(self.grouped_daily_dir, start, end, tickers, columns)
+
+    def load_aggregates(self,
+                        timespan: str,
+                        start: Union[str, dt.datetime, pd.Timestamp],
+                        end: Union[str, dt.datetime, pd.Timestamp],
+                        tickers: Optional[List[str]] = None,
+                        columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Load aggregate bars of the given timespan for sessions in [start, end] from the
+        ticker/month partitioned `MinuteBarStore` layout; see `load_grouped_daily`.
+
+        Only the month partitions in range (and the ticker partitions asked for) are
+        opened, and the time range is pushed down to the row-group statistics.
+        """
+        if self.aggregates_dir is None:
+            raise ValueError("No directory configured for this dataset")
+        root = self.aggregates_dir / timespan
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        months = [str(month) for month in pd.period_range(start, end, freq="M")]
+        columns = ["ticker", "timestamp"] + [c for c in (columns or BARS_SCHEMA.names) if c not in ["ticker", "timestamp"]]
+        unknown = set(columns) - set(BARS_SCHEMA.names)
+        if unknown:
+            raise ValueError(f"Invalid columns {sorted(unknown)}, should be in {BARS_SCHEMA.names}")
+
+        partitioning = ds.partitioning(pa.schema([("ticker", pa.string()), ("month", pa.string())]), flavor="hive")
+        schema = pa.schema([f for f in BARS_SCHEMA if f.name != "ticker"] + [("ticker", pa.string()), ("month", pa.string())])
+        if tickers is not None:
+            partitions = [root / f"ticker={quote(ticker, safe='')}" / f"month={month}"
+                          for ticker in tickers for month in months]
+        else:
+            partitions = [partition for partition in root.glob("ticker=*/month=*")
+                          if months[0] <= partition.name.split("=", 1)[1] <= months[-1]]
+        files = [str(file) for partition in partitions for file in PartitionParts(partition).files()]
+
+        if files:
+            bounds = [int(bound.tz_localize("US/Eastern").tz_convert("UTC").timestamp() * 1000)
+                      for bound in (start, end + pd.Timedelta(days=1))]
+            timestamp = ds.field("timestamp")
+            dataset = ds.dataset(files, format="parquet", schema=schema,
+                                 partitioning=partitioning, partition_base_dir=str(root))
+            table = dataset.to_table(columns=columns, use_threads=True,
+                                     filter=(timestamp >= bounds[0]) & (timestamp < bounds[1]))
+        else:
+            table = BARS_SCHEMA.empty_table().select(columns)
+
+        data = table.to_pandas()
+        data["ticker"] = data["ticker"].map({value: unquote(value) for value in data["ticker"].unique()})
+        data.insert(0, "date", (pd.to_datetime(data["timestamp"], unit="ms", utc=True)
+                                .dt.tz_convert("US/Eastern").dt.normalize().dt.tz_localize(None)))
+        self.logger.info(f"Loaded {len(data)} rows from {len(files)} files in {root}")
+        return data
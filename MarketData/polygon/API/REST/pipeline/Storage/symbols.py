@@ -0,0 +1,213 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Union, Optional, Iterable, List
+from .atomic import atomic_path
+
+
+SYMBOLS_SCHEMA = pa.schema([
+    ("id", pa.int32()),
+    ("ticker", pa.string()),
+    ("composite_figi", pa.string()),
+    ("current", pa.bool_()),
+])
+
+
+class SymbolDictionary:
+    """
+    Append-only mapping from listings to stable int32 ids, persisted as a parquet file.
+
+    A listing is a (ticker, composite_figi) pair, so a ticker that is reused by another
+    instrument gets a new id while the old instrument keeps its own. Ids are handed out in
+    order of first appearance and never reused or reassigned, so they can be used as
+    positions (e.g. panel columns) and as integer join keys across every stored dataset.
+
+    Bars only carry the ticker. Given the universe of the bars' date, as stored by
+    `UniverseStore`, a ticker resolves to the listing that used it that day; otherwise it
+    resolves to its current listing: the one registered last for that ticker. Tickers seen
+    in bars before their listing is known get an id without a FIGI, which the listing
+    adopts when it is registered.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.logger = logging.getLogger(__name__)
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        table = pq.read_table(self.path) if self.path.exists() else SYMBOLS_SCHEMA.empty_table()
+        self._tickers = table.column("ticker").to_pylist()
+        # dictionaries written before listings were tracked have no FIGI column
+        self._figis = (table.column("composite_figi").to_pylist() if "composite_figi" in table.column_names
+                       else [None] * len(self._tickers))
+        self._listings = {(ticker, figi): i for i, (ticker, figi) in enumerate(zip(self._tickers, self._figis))}
+        # without the flag the listing added last is the current one
+        current = (table.column("current").to_pylist() if "current" in table.column_names
+                   else [True] * len(self._tickers))
+        self._ids = {ticker: i for i, (ticker, is_current) in enumerate(zip(self._tickers, current)) if is_current}
+        self._all_ids = {}
+        for i, ticker in enumerate(self._tickers):
+            self._all_ids.setdefault(ticker, []).append(i)
+        self._categories = None
+
+    def __len__(self) -> int:
+        return len(self._tickers)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self._ids
+
+    def _save(self):
+        table = pa.table({"id": pa.array(np.arange(len(self._tickers), dtype=np.int32)),
+                          "ticker": pa.array(self._tickers, type=pa.string()),
+                          "composite_figi": pa.array(self._figis, type=pa.string()),
+                          "current": pa.array([self._ids[ticker] == i for i, ticker in enumerate(self._tickers)])},
+                         schema=SYMBOLS_SCHEMA)
+        with atomic_path(self.path) as tmp_path:
+            pq.write_table(table, tmp_path)
+
+    def _append(self, ticker: str, figi: Optional[str], current: bool = True) -> int:
+        new_id = len(self._tickers)
+        self._tickers.append(ticker)
+        self._figis.append(figi)
+        self._listings[(ticker, figi)] = new_id
+        if current or ticker not in self._ids:
+            self._ids[ticker] = new_id
+        self._all_ids.setdefault(ticker, []).append(new_id)
+        self._categories = None
+        return new_id
+
+    def id_of(self, ticker: str) -> int:
+        """Id of the current listing of a ticker, -1 if it has none"""
+        return self._ids.get(ticker, -1)
+
+    @staticmethod
+    def _listed_figis(tickers: pd.Index, listings: Optional[pd.DataFrame]) -> List[Optional[str]]:
+        """Composite FIGI each ticker had in `listings`, None where it is not listed or has none"""
+        if listings is None or "composite_figi" not in listings.columns:
+            return [None] * len(tickers)
+        figis = listings["composite_figi"]
+        if "ticker" in listings.columns:
+            figis = figis.set_axis(listings["ticker"].to_numpy())
+        figis = figis[~figis.index.duplicated(keep="last")].reindex(tickers)
+        return [figi if isinstance(figi, str) and figi else None for figi in figis]
+
+    def _listing_id(self, ticker: str, figi: Optional[str], assign: bool) -> Optional[int]:
+        """Id of the listing `figi` of `ticker` (default: its current one); None if it needs an id and `assign` is off"""
+        listing_id = self._listings.get((ticker, figi)) if figi is not None else None
+        if listing_id is not None:
+            return listing_id
+        current = self._ids.get(ticker)
+        if current is not None and (figi is None or self._figis[current] is None):
+            # without both FIGIs the listings cannot be told apart; a registration sorts it out
+            return current
+        if not assign:
+            return None
+        # another instrument than the current one, e.g. the one that used the ticker before
+        return self._append(ticker, figi, current=False)
+
+    def ids(self, tickers: Iterable[str], assign: bool = True, listings: Optional[pd.DataFrame] = None) -> np.ndarray:
+        """
+        Ids of the listings of `tickers`. Unknown tickers get new ids when `assign` is set,
+        otherwise -1.
+
+        Args:
+            tickers: Ticker of every row
+            assign: Whether to hand out ids to listings that have none yet
+            listings: Universe of the rows' date (`UniverseStore.get`, or a frame with a
+                `ticker` column) with `composite_figi`: tickers resolve to the listing that
+                used them that day instead of their current one
+        """
+        codes, uniques = pd.factorize(pd.Series(list(tickers), dtype=object))
+        figis = self._listed_figis(pd.Index(uniques, dtype=object), listings)
+        with self._lock:
+            size = len(self)
+            unique_ids = [self._listing_id(ticker, figi, assign) for ticker, figi in zip(uniques, figis)]
+            if len(self) > size:
+                self._save()
+                self.logger.info(f"Assigned ids to {len(self) - size} new listings")
+            # the trailing -1 is picked up by missing tickers, which factorize codes as -1
+            unique_ids = np.array([-1 if i is None else i for i in unique_ids] + [-1], dtype=np.int32)
+        return unique_ids[codes]
+
+    def all_ids(self, tickers: Iterable[str]) -> np.ndarray:
+        """Ids of every listing that ever used one of `tickers`, for filtering stored rows"""
+        return np.array(sorted(i for ticker in set(tickers) for i in self._all_ids.get(ticker, [])), dtype=np.int32)
+
+    def register_listings(self, listings) -> np.ndarray:
+        """
+        Make sure every (ticker, composite_figi) listing has an id and is the current one of
+        its ticker; returns their ids.
+
+        Args:
+            listings: DataFrame with `ticker` and `composite_figi` columns, or an iterable of
+                ticker records (dicts or the polygon client's `Ticker` objects)
+        """
+        if isinstance(listings, pd.DataFrame):
+            figis = listings["composite_figi"] if "composite_figi" in listings.columns else [None] * len(listings)
+            pairs = list(zip(listings["ticker"], figis))
+        else:
+            pairs = [(item.get("ticker"), item.get("composite_figi")) if isinstance(item, dict)
+                     else (item.ticker, getattr(item, "composite_figi", None)) for item in listings]
+
+        ids, added = [], 0
+        with self._lock:
+            for ticker, figi in pairs:
+                figi = figi if isinstance(figi, str) and figi else None
+                listing_id = self._listings.get((ticker, figi))
+                current = self._ids.get(ticker)
+                if listing_id is None and figi is None and current is not None:
+                    # a listing without a FIGI cannot be told apart from the current one
+                    listing_id = current
+                elif listing_id is None:
+                    if current is not None and self._figis[current] is None:
+                        # a ticker first seen in bars: its id now belongs to this listing
+                        self._listings.pop((ticker, None), None)
+                        self._figis[current] = figi
+                        self._listings[(ticker, figi)] = current
+                        listing_id = current
+                    else:
+                        listing_id = self._append(ticker, figi)
+                    added += 1
+                elif self._ids[ticker] != listing_id and figi is not None:
+                    # the ticker was handed back to an instrument listed under it before
+                    self._ids[ticker] = listing_id
+                    added += 1
+                ids.append(listing_id)
+            if added:
+                self._save()
+                self.logger.info(f"Registered {added} new or changed listings")
+        return np.array(ids, dtype=np.int32)
+
+    def tickers(self, ids: Iterable[int]) -> np.ndarray:
+        """Tickers for `ids`"""
+        return np.asarray(self._tickers, dtype=object)[np.asarray(ids, dtype=np.int64)]
+
+    def figis(self, ids: Iterable[int]) -> np.ndarray:
+        """Composite FIGIs for `ids`, None where unknown"""
+        return np.asarray(self._figis, dtype=object)[np.asarray(ids, dtype=np.int64)]
+
+    def decode(self, ids: Iterable[int]) -> pd.Categorical:
+        """
+        Tickers for `ids` as a Categorical over the dictionary's tickers: the codes are
+        mapped, no string is materialised per row. Ids of -1 decode to NaN.
+        """
+        with self._lock:
+            if self._categories is None:
+                codes, uniques = pd.factorize(pd.Series(self._tickers, dtype=object))
+                # the trailing -1 is picked up by ids of -1
+                self._categories = (np.append(codes, -1).astype(np.int32), pd.Index(uniques, dtype=object))
+            codes, categories = self._categories
+        return pd.Categorical.from_codes(codes[np.asarray(ids, dtype=np.int64)], categories=categories)
+
+    def encode(self, data: pd.DataFrame, listings: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        `data` with its `ticker` column replaced by `ticker_id`, assigning ids to new tickers;
+        pass the universe of the bars' date as `listings` to resolve them point in time
+        """
+        position = data.columns.get_loc("ticker")
+        ids = self.ids(data["ticker"], listings=listings)
+        data = data.drop(columns=["ticker"])
+        data.insert(position, "ticker_id", ids)
+        return data
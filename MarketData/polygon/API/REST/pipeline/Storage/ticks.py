@@ -0,0 +1,242 @@
+import json
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import datetime as dt
+from pathlib import Path
+from urllib.parse import quote
+from typing import Union, Optional, List
+from .atomic import atomic_path
+from .formats import WriteOptions
+
+# nanosecond timestamps and sequence numbers are near-monotonic within a day, so they are
+# stored as deltas; exchange, tape and condition codes come from small sets and are
+# dictionary-encoded
+TICK_TIMESTAMPS = ["sip_timestamp", "participant_timestamp", "trf_timestamp", "sequence_number"]
+CODE_LISTS = ["conditions", "indicators"]
+
+TRADES_SCHEMA = pa.schema([
+    ("sip_timestamp", pa.int64()),
+    ("participant_timestamp", pa.int64()),
+    ("trf_timestamp", pa.int64()),
+    ("sequence_number", pa.int64()),
+    ("price", pa.float64()),
+    ("size", pa.float64()),
+    ("exchange", pa.int16()),
+    ("tape", pa.int8()),
+    ("conditions", pa.dictionary(pa.int32(), pa.string())),
+    ("correction", pa.int16()),
+    ("trf_id", pa.int16()),
+    ("id", pa.string()),
+])
+
+QUOTES_SCHEMA = pa.schema([
+    ("sip_timestamp", pa.int64()),
+    ("participant_timestamp", pa.int64()),
+    ("trf_timestamp", pa.int64()),
+    ("sequence_number", pa.int64()),
+    ("bid_price", pa.float64()),
+    ("bid_size", pa.float64()),
+    ("bid_exchange", pa.int16()),
+    ("ask_price", pa.float64()),
+    ("ask_size", pa.float64()),
+    ("ask_exchange", pa.int16()),
+    ("tape", pa.int8()),
+    ("conditions", pa.dictionary(pa.int32(), pa.string())),
+    ("indicators", pa.dictionary(pa.int32(), pa.string())),
+])
+
+TICK_SCHEMAS = {"trades": TRADES_SCHEMA, "quotes": QUOTES_SCHEMA}
+
+
+def tick_write_options(schema: pa.Schema, compression: str = "zstd", compression_level: Optional[int] = 1,
+                       row_group_size: int = 1 << 20) -> WriteOptions:
+    """Delta encoding for the timestamp columns, dictionary encoding for the code columns"""
+    return WriteOptions(compression=compression,
+                        compression_level=compression_level,
+                        row_group_size=row_group_size,
+                        dictionary_columns=[f.name for f in schema if f.name not in TICK_TIMESTAMPS
+                                            and f.type != pa.float64() and f.name != "id"],
+                        column_encoding={name: "DELTA_BINARY_PACKED" for name in TICK_TIMESTAMPS})
+
+
+def to_tick_table(page: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """
+    A page of trades or quotes conformed to `schema`: missing columns are null, lists of
+    condition codes become dictionary-encoded "12,37" strings
+    """
+    columns = {}
+    for field in schema:
+        values = page[field.name] if field.name in page.columns else pd.Series([None] * len(page), dtype=object)
+        if field.name in CODE_LISTS:
+            codes = pa.array(values, from_pandas=True)
+            if pa.types.is_list(codes.type) or pa.types.is_large_list(codes.type):
+                codes = pc.binary_join(codes.cast(pa.list_(pa.string())), ",")
+            columns[field.name] = pc.dictionary_encode(codes.cast(pa.string()))
+        else:
+            columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+    return pa.table(columns, schema=schema)
+
+
+class TickDayWriter:
+    """
+    Streaming writer of one (ticker, day) partition of a `TickStore`.
+
+    Pages are appended as they arrive and buffered until `rows_per_file` rows, then written
+    as one part file and committed to the partition's `_state.json` together with the
+    `next_url` that follows the last buffered page, and whether that page was the day's
+    last. Memory is bounded by one file's rows however large the day is, and a restarted
+    job resumes from the committed `next_url`, re-fetching at most the pages that were
+    still buffered; once the last page is committed there is nothing left to fetch.
+    """
+
+    def __init__(self, store: "TickStore", ticker: str, date: pd.Timestamp):
+        self.store = store
+        self.ticker = ticker
+        self.date = date
+        self.day_dir = store.day_dir(ticker, date)
+        self.state = store.state(ticker, date)
+        self._buffer: List[pa.Table] = []
+        self._buffered_rows = 0
+
+    @property
+    def resume_url(self) -> Optional[str]:
+        """Url to carry on from, None to start the day from its first page (or after the last one)"""
+        return self.state["next_url"]
+
+    @property
+    def last_page(self) -> bool:
+        """Whether the day's last page is committed, leaving only `close` to do"""
+        # state files written before the flag was recorded lack it
+        return self.state.get("last_page", False)
+
+    @property
+    def rows(self) -> int:
+        return self.state["rows"] + self._buffered_rows
+
+    def append(self, page: pd.DataFrame, next_url: Optional[str]):
+        """Buffer a fetched page; `next_url` is the cursor following it (None after the last page)"""
+        if len(page):
+            table = to_tick_table(page, self.store.schema)
+            self._buffer.append(table)
+            self._buffered_rows += table.num_rows
+        if self._buffered_rows >= self.store.rows_per_file:
+            self.flush(next_url)
+
+    def flush(self, next_url: Optional[str], complete: bool = False):
+        """Write the buffered pages as a part file and commit the cursor"""
+        files = list(self.state["files"])
+        if self._buffer:
+            # unify the per-page dictionaries so the file gets a single one per row group
+            table = pa.concat_tables(self._buffer).unify_dictionaries().combine_chunks()
+            name = f"part-{len(files):05d}.parquet"
+            self.store.write_options.write_table(table, self.day_dir / name)
+            files.append(name)
+        # a flush always follows a fetched page, so no next_url means it was the last one
+        self.state = {"files": files, "next_url": next_url, "last_page": next_url is None,
+                      "complete": complete, "rows": self.state["rows"] + self._buffered_rows}
+        self.store._save_state(self.day_dir, self.state)
+        self._buffer, self._buffered_rows = [], 0
+
+    def close(self):
+        """Flush what is left and mark the day complete"""
+        self.flush(None, complete=True)
+        self.store.logger.info(f"Stored {self.state['rows']} {self.store.kind} of {self.ticker} "
+                               f"on {self.date.date()} in {len(self.state['files'])} files")
+
+
+class TickStore:
+    """
+    Trades or quotes partitioned by ticker and day:
+
+        {root_dir}/ticker={ticker}/date={YYYY-MM-DD}/part-{n:05d}.parquet
+        {root_dir}/ticker={ticker}/date={YYYY-MM-DD}/_state.json
+
+    `_state.json` lists the committed part files, the pagination cursor, whether the last
+    page is among them and whether the day is complete; files not listed there are
+    leftovers of an interrupted run. Timestamps
+    are delta-encoded and exchange and condition codes dictionary-encoded, see
+    `tick_write_options`.
+    """
+    state_name = "_state.json"
+
+    def __init__(self,
+                 root_dir: Union[str, Path],
+                 kind: str = "trades",
+                 rows_per_file: int = 2_000_000,
+                 write_options: Optional[WriteOptions] = None):
+        if kind not in TICK_SCHEMAS:
+            raise ValueError(f"Invalid kind {kind}, should be one of {list(TICK_SCHEMAS)}")
+        self.logger = logging.getLogger(__name__)
+        self.root_dir = Path(root_dir)
+        self.kind = kind
+        self.schema = TICK_SCHEMAS[kind]
+        self.rows_per_file = rows_per_file
+        self.write_options = write_options or tick_write_options(self.schema)
+
+    def day_dir(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp]) -> Path:
+        # tickers like X:BTCUSD are url-quoted into valid directory names
+        return self.root_dir / f"ticker={quote(ticker, safe='')}" / f"date={pd.Timestamp(date):%Y-%m-%d}"
+
+    def state(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp]) -> dict:
+        path = self.day_dir(ticker, date) / self.state_name
+        if not path.exists():
+            return self._empty_state()
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _empty_state() -> dict:
+        return {"files": [], "next_url": None, "last_page": False, "complete": False, "rows": 0}
+
+    def _save_state(self, day_dir: Path, state: dict):
+        with atomic_path(day_dir / self.state_name) as tmp_path:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+
+    def is_complete(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp]) -> bool:
+        return self.state(ticker, date)["complete"]
+
+    def open_day(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp],
+                 overwrite: bool = False) -> TickDayWriter:
+        """
+        Writer for a day, resuming an interrupted one; `overwrite` starts over, committing
+        an empty state before the old files are dropped, so an interrupted overwrite never
+        leaves a state listing files that are gone
+        """
+        date = pd.Timestamp(date).normalize()
+        day_dir = self.day_dir(ticker, date)
+        day_dir.mkdir(parents=True, exist_ok=True)
+        if overwrite:
+            self._save_state(day_dir, self._empty_state())
+        # parts written after the last committed cursor are re-fetched
+        committed = set(self.state(ticker, date)["files"])
+        for path in day_dir.glob("part-*.parquet"):
+            if path.name not in committed:
+                path.unlink()
+        return TickDayWriter(self, ticker, date)
+
+    def files(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp]) -> List[Path]:
+        day_dir = self.day_dir(ticker, date)
+        return [day_dir / name for name in self.state(ticker, date)["files"]]
+
+    def scan(self, ticker: str, date: Union[str, dt.datetime, pd.Timestamp]) -> ds.Dataset:
+        """Dataset over a stored day, to stream it batch by batch"""
+        return ds.dataset([str(path) for path in self.files(ticker, date)], schema=self.schema, format="parquet")
+
+    def load(self,
+             ticker: str,
+             date: Union[str, dt.datetime, pd.Timestamp],
+             columns: Optional[List[str]] = None,
+             start: Optional[Union[str, dt.datetime, pd.Timestamp]] = None,
+             end: Optional[Union[str, dt.datetime, pd.Timestamp]] = None) -> pa.Table:
+        """Stored ticks of a day, optionally within [start, end) by SIP timestamp (naive times are UTC)"""
+        expression = None
+        if start is not None:
+            expression = ds.field("sip_timestamp") >= pd.Timestamp(start).value
+        if end is not None:
+            upper = ds.field("sip_timestamp") < pd.Timestamp(end).value
+            expression = upper if expression is None else expression & upper
+        return self.scan(ticker, date).to_table(columns=columns, filter=expression)
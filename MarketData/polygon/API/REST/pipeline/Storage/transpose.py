@@ -0,0 +1,287 @@
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Union, Optional, List
+from .atomic import atomic_path
+from .manifest import DatasetManifest
+from .reader import BARS_SCHEMA, STORED_BARS_SCHEMA
+from .symbols import SymbolDictionary
+from .universe import UniverseStore
+from .minuteBars import session_dates
+
+# runs are keyed by the symbol dictionary id rather than the ticker string
+RUNS_SCHEMA = pa.schema([field for field in STORED_BARS_SCHEMA if field.name != "ticker"])
+
+
+class GroupedDailyTransposer:
+    """
+    Maintains a ticker-major copy of the date-major grouped daily files.
+
+    Ticker ids are spread over a fixed number of buckets. Every `update` reads the sessions
+    not yet ingested in chunks sized to `memory_budget`, sorts each chunk by
+    (ticker_id, timestamp) and writes it as one sorted run per bucket:
+
+        {target_dir}/bucket={k:03d}/{run:06d}.parquet
+
+    Once a bucket holds more than `max_runs` runs they are k-way merged, streaming, into a
+    single sorted file, so one listing's history is a contiguous slice of one file. Ingested
+    sessions are tracked in a `DatasetManifest` in `target_dir`, with the run each was last
+    written to: rows of a session in an older run are dropped when reading and compacting,
+    so a re-fetched session replaces all of its old rows, including those of tickers the new
+    fetch no longer lists.
+    """
+
+    def __init__(self,
+                 source_dir: Union[str, Path],
+                 target_dir: Union[str, Path],
+                 symbols: SymbolDictionary,
+                 memory_budget: int = 512 * 2**20,
+                 num_buckets: int = 64,
+                 max_runs: int = 8,
+                 row_group_size: int = 64 * 1024,
+                 universe: Optional[UniverseStore] = None):
+        self.logger = logging.getLogger(__name__)
+        self.source_dir = Path(source_dir)
+        self.target_dir = Path(target_dir)
+        self.symbols = symbols
+        # resolves the tickers of sessions stored before ids to that session's listings
+        self.universe = universe
+        self.memory_budget = memory_budget
+        self.num_buckets = num_buckets
+        self.max_runs = max_runs
+        self.row_group_size = row_group_size
+        self.source_manifest = DatasetManifest(self.source_dir)
+        self.target_manifest = DatasetManifest(self.target_dir)
+
+    def bucket_of(self, ticker_id: int) -> int:
+        return int(ticker_id) % self.num_buckets
+
+    def _bucket_dir(self, bucket: int) -> Path:
+        return self.target_dir / f"bucket={bucket:03d}"
+
+    def _runs(self, bucket: int) -> List[Path]:
+        return sorted(self._bucket_dir(bucket).glob("*.parquet"))
+
+    def _next_run_id(self) -> int:
+        # runs that left no file in any bucket still own their sessions
+        run_ids = [int(run.stem) for run in self.target_dir.glob("bucket=*/*.parquet")]
+        run_ids += [entry["run"] for entry in self.target_manifest.entries.values() if "run" in entry]
+        return max(run_ids, default=-1) + 1
+
+    def _session_runs(self) -> pd.Series:
+        """Run each ingested session was last written to, indexed by session date"""
+        # sessions ingested before runs were recorded have none and keep every row
+        return pd.Series({pd.Timestamp(key): entry["run"] for key, entry in self.target_manifest.entries.items()
+                          if "run" in entry}, dtype="int64").sort_index()
+
+    @staticmethod
+    def _is_current(timestamps: np.ndarray, run_id: int, session_runs: pd.Series) -> np.ndarray:
+        """Mask of the rows of run `run_id` whose session was not written again by a later run"""
+        replaced = session_runs.index[session_runs.to_numpy() > run_id]
+        if not len(replaced):
+            return np.ones(len(timestamps), dtype=bool)
+        # sessions as [start, end) millisecond bounds in the exchange's time zone, as the readers
+        # take them: a row falls in a replaced session when it lands after an odd number of bounds
+        bounds = np.column_stack([replaced.tz_localize("US/Eastern").as_unit("ms").asi8,
+                                  (replaced + pd.Timedelta(days=1)).tz_localize("US/Eastern").as_unit("ms").asi8])
+        return np.searchsorted(bounds.ravel(), timestamps, side="right") % 2 == 0
+
+    def _current_batches(self, run: Path, session_runs: pd.Series):
+        """Batches of a run without the rows of sessions a later run replaced"""
+        for batch in pq.ParquetFile(run).iter_batches(batch_size=self.row_group_size):
+            batch = batch.filter(pa.array(self._is_current(batch.column("timestamp").to_numpy(),
+                                                           int(run.stem), session_runs)))
+            if batch.num_rows:
+                yield batch
+
+    def pending_sessions(self) -> List[pd.Timestamp]:
+        """Source sessions that are not in the ticker-major copy yet, or were re-fetched since"""
+        # the target holds no per-session files, so its manifest entries are read directly
+        ingested = {pd.Timestamp(key): pd.Timestamp(entry["fetched_at"])
+                    for key, entry in self.target_manifest.entries.items()}
+        pending = []
+        for session, entry in sorted(self.source_manifest.stored_sessions().items()):
+            done = ingested.get(session)
+            if done is None or done < entry["fetched_at"]:
+                pending.append(session)
+        return pending
+
+    def _check_layout(self):
+        runs = next(self.target_dir.glob("bucket=*/*.parquet"), None)
+        if runs is not None and "ticker_id" not in pq.read_schema(runs).names:
+            raise ValueError(f"{self.target_dir} holds runs keyed by ticker strings, "
+                             f"delete it to rebuild it keyed by ticker ids")
+
+    def update(self) -> int:
+        """Ingest pending sessions as sorted runs and compact the buckets that need it. Returns the sessions ingested."""
+        self._check_layout()
+        pending = self.pending_sessions()
+        if pending:
+            sample = pq.read_table(self.source_manifest.file_for(pending[-1]))
+            # sorting and splitting into buckets needs a few copies of the chunk in memory
+            chunk_size = max(1, self.memory_budget // max(3 * sample.nbytes, 1))
+            for i in range(0, len(pending), chunk_size):
+                self._write_runs(pending[i:i + chunk_size])
+        for bucket in range(self.num_buckets):
+            if len(self._runs(bucket)) > self.max_runs:
+                self.compact(bucket)
+        self.logger.info(f"Transposed {len(pending)} sessions from {self.source_dir} into {self.target_dir}")
+        return len(pending)
+
+    def _write_runs(self, sessions: List[pd.Timestamp]):
+        stored = self.source_manifest.stored_sessions()
+        files = [str(self.source_manifest.file_for(session)) for session in sessions]
+        table = ds.dataset(files, format="parquet", schema=STORED_BARS_SCHEMA).to_table()
+        if table.column("ticker_id").null_count:
+            # sessions written before ticker ids were introduced
+            ids = table.column("ticker_id").fill_null(-1).to_numpy().copy()
+            missing = np.flatnonzero(ids < 0)
+            tickers = table.column("ticker").to_numpy(zero_copy_only=False)[missing]
+            if self.universe is None:
+                ids[missing] = self.symbols.ids(tickers)
+            else:
+                sessions = session_dates(table.column("timestamp").to_numpy()[missing])
+                for session in sessions.unique():
+                    in_session = np.asarray(sessions == session)
+                    ids[missing[in_session]] = self.symbols.ids(tickers[in_session],
+                                                                listings=self.universe.get(session))
+            table = table.set_column(0, "ticker_id", pa.array(ids, type=pa.int32()))
+        table = (table.drop_columns(["ticker"])
+                 .sort_by([("ticker_id", "ascending"), ("timestamp", "ascending")]))
+
+        buckets = table.column("ticker_id").to_numpy() % self.num_buckets
+        run_id = self._next_run_id()
+        for bucket in np.unique(buckets):
+            with atomic_path(self._bucket_dir(bucket) / f"{run_id:06d}.parquet") as tmp_path:
+                pq.write_table(table.take(np.flatnonzero(buckets == bucket)), tmp_path,
+                               row_group_size=self.row_group_size)
+
+        self.target_manifest.record_many([
+            (session, pq.ParquetFile(file).metadata.num_rows, stored[session]["fetched_at"])
+            for session, file in zip(sessions, files)
+        ], run=run_id)
+
+    def compact(self, bucket: int):
+        """
+        Stream-merge all runs of a bucket into a single sorted file.
+
+        One batch per run is held in memory. Every ticker below the smallest last ticker
+        among the runs' current batches is complete in all of them, so those rows are
+        merged, de-duplicated and written out before the next batches are read. Rows of
+        sessions that a later run replaced are dropped as the batches are read.
+        """
+        runs = self._runs(bucket)
+        if len(runs) < 2:
+            return
+        session_runs = self._session_runs()
+        readers = [self._current_batches(run, session_runs) for run in runs]
+        buffers = [None] * len(runs)
+
+        with atomic_path(runs[-1]) as tmp_path:
+            with pq.ParquetWriter(tmp_path, RUNS_SCHEMA) as writer:
+                stalled = set()
+                while True:
+                    for order, reader in enumerate(readers):
+                        if reader is None or (buffers[order] is not None and buffers[order].num_rows
+                                              and order not in stalled):
+                            continue
+                        batch = next(reader, None)
+                        if batch is None:
+                            readers[order] = None
+                            continue
+                        batch = pa.Table.from_batches([batch]).append_column(
+                            "run", pa.array(np.full(batch.num_rows, order, dtype=np.int32)))
+                        buffers[order] = batch if buffers[order] is None else pa.concat_tables([buffers[order], batch])
+
+                    active = [order for order, buffer in enumerate(buffers) if buffer is not None and buffer.num_rows]
+                    if not active:
+                        break
+                    last = {order: buffers[order].column("ticker_id")[-1].as_py()
+                            for order in active if readers[order] is not None}
+                    watermark = min(last.values()) if last else None
+
+                    ready = []
+                    for order in active:
+                        buffer = buffers[order]
+                        n = buffer.num_rows if watermark is None else int(np.searchsorted(
+                            buffer.column("ticker_id").to_numpy(), watermark, side="left"))
+                        ready.append(buffer.slice(0, n))
+                        buffers[order] = buffer.slice(n)
+
+                    # a batch holding nothing but the watermark ticker needs the next batch of its run
+                    stalled = {order for order, ticker in last.items() if ticker == watermark}
+                    if sum(chunk.num_rows for chunk in ready):
+                        writer.write_table(self._merge(ready), row_group_size=self.row_group_size)
+
+        # the merged file replaced the newest run; the older ones are now redundant
+        for run in runs[:-1]:
+            run.unlink()
+        self.logger.info(f"Compacted {len(runs)} runs of bucket {bucket}")
+
+    @staticmethod
+    def _merge(chunks: List[pa.Table]) -> pa.Table:
+        """Sort chunks by (ticker_id, timestamp) and keep the row from the newest run for each key"""
+        merged = pa.concat_tables(chunks).sort_by(
+            [("ticker_id", "ascending"), ("timestamp", "ascending"), ("run", "ascending")])
+        tickers = merged.column("ticker_id").to_numpy()
+        timestamps = merged.column("timestamp").to_numpy()
+        keep = np.ones(merged.num_rows, dtype=bool)
+        keep[:-1] = (tickers[1:] != tickers[:-1]) | (timestamps[1:] != timestamps[:-1])
+        return merged.filter(pa.array(keep)).drop_columns(["run"])
+
+    @staticmethod
+    def _dedupe(history: pd.DataFrame) -> pd.DataFrame:
+        # runs are read oldest first, so keeping the last row keeps the newest fetch
+        return (history.drop_duplicates(subset=["ticker_id", "timestamp"], keep="last")
+                .sort_values(["ticker_id", "timestamp"], kind="stable"))
+
+    def covers(self,
+               start: Union[str, pd.Timestamp],
+               end: Union[str, pd.Timestamp]) -> bool:
+        """Whether every source session in [start, end] is in the ticker-major copy, as last fetched"""
+        # re-read: the copy is updated by the transpose job, not by the readers holding this instance
+        self.source_manifest = DatasetManifest(self.source_dir)
+        self.target_manifest = DatasetManifest(self.target_dir)
+        start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+        return not any(start <= session <= end for session in self.pending_sessions())
+
+    def load_ticker(self, ticker: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Full history of one ticker, read from the runs of its listings' buckets only"""
+        return self.load_tickers([ticker], columns=columns)
+
+    def load_tickers(self,
+                     tickers: List[str],
+                     start: Optional[Union[str, pd.Timestamp]] = None,
+                     end: Optional[Union[str, pd.Timestamp]] = None,
+                     columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        History of `tickers` over the sessions in [start, end] (default: all), ordered by
+        listing and time. Only the runs of their listings' buckets are read, and the
+        ticker ids and session range are pushed down to the row-group statistics.
+        """
+        columns = ["ticker", "timestamp"] + [c for c in (columns or BARS_SCHEMA.names) if c not in ["ticker", "timestamp"]]
+        ids = self.symbols.all_ids(tickers)
+        run_columns = ["ticker_id"] + columns[1:]
+        filters = [("ticker_id", "in", ids.tolist())]
+        # session dates are taken in the exchange's time zone, as the readers do
+        if start is not None:
+            start = pd.Timestamp(start).normalize().tz_localize("US/Eastern")
+            filters.append(("timestamp", ">=", int(start.timestamp() * 1000)))
+        if end is not None:
+            end = (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).tz_localize("US/Eastern")
+            filters.append(("timestamp", "<", int(end.timestamp() * 1000)))
+        session_runs = self._session_runs()
+        frames = []
+        for bucket in sorted({self.bucket_of(ticker_id) for ticker_id in ids}):
+            for run in self._runs(bucket):
+                frame = pq.read_table(run, columns=run_columns, filters=filters, schema=RUNS_SCHEMA).to_pandas()
+                frames.append(frame[self._is_current(frame["timestamp"].to_numpy(), int(run.stem), session_runs)])
+        if not frames:
+            return BARS_SCHEMA.empty_table().select(columns).to_pandas()
+        history = self._dedupe(pd.concat(frames, ignore_index=True)).reset_index(drop=True)
+        history.insert(0, "ticker", self.symbols.decode(history.pop("ticker_id").to_numpy()))
+        return history
@@ -0,0 +1,177 @@
+import logging
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import datetime as dt
+from pathlib import Path
+from typing import Union, Optional, List, Tuple
+from .atomic import atomic_to_parquet
+from .manifest import DatasetManifest
+
+
+class UniverseStore:
+    """
+    Point-in-time ticker universes stored as full base snapshots plus daily deltas:
+
+        {root_dir}/base/{YYYY-MM-DD}.parquet     every ticker listed on that day
+        {root_dir}/delta/{YYYY-MM-DD}.parquet    rows added, removed or changed since the
+                                                 previous stored day, with a `change` column
+
+    The universe of a stored day is its latest base with the deltas up to that day applied
+    in one vectorized step, so it costs a base read plus a few small delta reads; walking
+    forward through consecutive days reuses the previous universe. A new base is written
+    every `base_every` deltas to bound that cost. Days can be added in any order: a day
+    inserted between two stored ones re-diffs the delta that follows it.
+
+    A day that was never fetched is answered without a request when it sits between two
+    stored days with the same universe. Values are stored as strings; changes confined
+    to `ignore_columns` are not recorded, so those columns keep the value first seen.
+    """
+
+    def __init__(self,
+                 root_dir: Union[str, Path],
+                 key: str = "ticker",
+                 base_every: int = 250,
+                 ignore_columns: Tuple[str, ...] = ("last_updated_utc",)):
+        self.logger = logging.getLogger(__name__)
+        self.root_dir = Path(root_dir)
+        self.key = key
+        self.base_every = base_every
+        self.ignore_columns = list(ignore_columns)
+        self.bases = DatasetManifest(self.root_dir / "base")
+        self.deltas = DatasetManifest(self.root_dir / "delta")
+        self._lock = threading.Lock()
+        self._cache: Optional[Tuple[pd.Timestamp, pd.DataFrame]] = None
+
+    def to_frame(self, universe) -> pd.DataFrame:
+        """
+        Universe as a frame of strings indexed by ticker, from the REST handler's frame or
+        the API client's ticker records
+        """
+        if not isinstance(universe, pd.DataFrame):
+            universe = pd.DataFrame([item if isinstance(item, dict) else vars(item) for item in universe])
+        if self.key not in universe.columns:
+            raise ValueError(f"Invalid universe, no {self.key} column")
+        universe = universe.astype("string").drop_duplicates(subset=[self.key], keep="last")
+        return universe.set_index(self.key).sort_index()
+
+    def stored_dates(self) -> List[pd.Timestamp]:
+        return [pd.Timestamp(key) for key in sorted(set(self.bases.entries) | set(self.deltas.entries))]
+
+    def _is_base(self, date: pd.Timestamp) -> bool:
+        return self.bases.get(date) is not None
+
+    def _read(self, manifest: DatasetManifest, date: pd.Timestamp) -> pd.DataFrame:
+        if not manifest.get(date)["rows"]:
+            return pd.DataFrame(columns=[self.key, "change"], dtype="string").set_index(self.key)
+        return pd.read_parquet(manifest.file_for(date)).astype("string").set_index(self.key)
+
+    def _read_deltas(self, dates: List[pd.Timestamp]) -> Optional[pd.DataFrame]:
+        files = [str(self.deltas.file_for(date)) for date in dates if self.deltas.get(date)["rows"]]
+        if not files:
+            return None
+        # columns added along the way (a delta only holds those of its day) would be dropped
+        # by a schema taken from the first file
+        schema = pa.unify_schemas([pq.read_schema(file) for file in files], promote_options="permissive")
+        # one threaded scan over all the files; fragments come back in file order
+        return (ds.dataset(files, format="parquet", schema=schema).to_table().to_pandas()
+                .astype("string").set_index(self.key))
+
+    def _apply(self, universe: pd.DataFrame, deltas: Optional[pd.DataFrame]) -> pd.DataFrame:
+        if deltas is None or not len(deltas):
+            return universe
+        # only the last change of each ticker matters
+        last = deltas[~deltas.index.duplicated(keep="last")]
+        kept = last[last["change"] != "remove"].drop(columns=["change"])
+        return pd.concat([universe.drop(index=last.index, errors="ignore"), kept]).sort_index()
+
+    def get(self, date: Union[str, dt.datetime, pd.Timestamp]) -> Optional[pd.DataFrame]:
+        """Universe as of a stored day (or a day inferred from its neighbours), None if unknown"""
+        date = pd.Timestamp(date).normalize()
+        dates = self.stored_dates()
+        if date not in dates:
+            return self._infer(date, dates)
+        with self._lock:
+            base = max(stored for stored in dates if stored <= date and self._is_base(stored))
+            if self._cache is not None and base <= self._cache[0] <= date:
+                start, universe = self._cache
+            else:
+                start, universe = base, self._read(self.bases, base)
+            deltas = [stored for stored in dates if start < stored <= date and not self._is_base(stored)]
+            universe = self._apply(universe, self._read_deltas(deltas))
+            self._cache = (date, universe)
+        return universe.copy()
+
+    def _infer(self, date: pd.Timestamp, dates: List[pd.Timestamp]) -> Optional[pd.DataFrame]:
+        before = [stored for stored in dates if stored < date]
+        after = [stored for stored in dates if stored > date]
+        if not before or not after:
+            return None
+        previous, following = before[-1], after[0]
+        if self._is_base(following):
+            universe = self.get(previous)
+            return universe if universe.equals(self.get(following)) else None
+        if self.deltas.get(following)["rows"]:
+            return None
+        return self.get(previous)
+
+    def diff(self, old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+        """Delta turning universe `old` into `new`"""
+        columns = [column for column in new.columns.union(old.columns) if column not in self.ignore_columns]
+        common = new.index.intersection(old.index)
+        old_values = old.reindex(index=common, columns=columns).fillna("")
+        new_values = new.reindex(index=common, columns=columns).fillna("")
+        changed = common[(old_values != new_values).any(axis=1).to_numpy()]
+        removed = old.index.difference(new.index)
+        delta = pd.concat([
+            new.loc[new.index.difference(old.index)].assign(change="add"),
+            new.loc[changed].assign(change="change"),
+            pd.DataFrame({"change": "remove"}, index=removed),
+        ])
+        delta.index.name = self.key
+        return delta.astype("string")
+
+    def _write(self, manifest: DatasetManifest, date: pd.Timestamp, frame: pd.DataFrame,
+               fetched_at: Optional[pd.Timestamp]):
+        if len(frame):
+            atomic_to_parquet(frame.reset_index(), manifest.file_for(date), index=False)
+        manifest.record(date, len(frame), fetched_at)
+
+    @staticmethod
+    def _discard(manifest: DatasetManifest, date: pd.Timestamp):
+        manifest.remove(date)
+        manifest.file_for(date).unlink(missing_ok=True)
+
+    def write_snapshot(self, date: Union[str, dt.datetime, pd.Timestamp], universe,
+                       fetched_at: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """Store the universe of `date`, as a base or as a delta against the previous stored day"""
+        date = pd.Timestamp(date).normalize()
+        universe = self.to_frame(universe)
+        dates = [stored for stored in self.stored_dates() if stored != date]
+        previous = max((stored for stored in dates if stored < date), default=None)
+        following = min((stored for stored in dates if stored > date), default=None)
+        # the delta after the new day has to be re-diffed against it
+        following_universe = self.get(following) if following is not None and not self._is_base(following) else None
+
+        since_base = 0
+        if previous is not None:
+            last_base = max(stored for stored in dates if stored <= previous and self._is_base(stored))
+            since_base = len([stored for stored in dates if last_base < stored <= previous])
+        if previous is None or since_base + 1 >= self.base_every:
+            self._discard(self.deltas, date)
+            self._write(self.bases, date, universe, fetched_at)
+            kind = "base"
+        else:
+            delta = self.diff(self.get(previous), universe)
+            self._discard(self.bases, date)
+            self._write(self.deltas, date, delta, fetched_at)
+            kind = f"delta of {len(delta)} rows"
+        if following_universe is not None:
+            self._write(self.deltas, following, self.diff(universe, following_universe),
+                        pd.Timestamp(self.deltas.get(following)["fetched_at"]))
+        with self._lock:
+            self._cache = None
+        self.logger.info(f"Stored universe of {date.date()} ({len(universe)} tickers) as {kind}")
+        return universe
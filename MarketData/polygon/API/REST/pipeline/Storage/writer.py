@@ -0,0 +1,85 @@
+import queue
+import logging
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Union, Optional, Callable, List, Tuple
+from .atomic import atomic_to_parquet
+
+
+class BackgroundWriter:
+    """
+    Pool of writer threads that take parsed frames off the fetch thread.
+
+    Fetchers `submit` frames into a bounded queue and go straight back to the network;
+    the writers encode and write them (pyarrow releases the GIL while encoding and
+    compressing, so threads run in parallel). When the writers fall behind the queue
+    fills up and `submit` blocks, which keeps memory bounded.
+    """
+
+    def __init__(self, num_workers: int = 2, max_pending: int = 8, write_func: Callable = atomic_to_parquet):
+        self.logger = logging.getLogger(__name__)
+        self.write_func = write_func
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.errors: List[Tuple[Union[Path, str], Exception]] = []
+        self.written = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.workers = [
+            threading.Thread(target=self._work, name=f"BackgroundWriter-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self,
+               data: pd.DataFrame,
+               output_file: Union[str, Path],
+               on_written: Optional[Callable[[], None]] = None,
+               **write_kwargs):
+        """Queue `data` to be written to `output_file`; blocks while the queue is full"""
+        self.submit_call(self.write_func, data, Path(output_file),
+                         on_written=on_written, label=output_file, **write_kwargs)
+
+    def submit_call(self, func: Callable, *args, on_written: Optional[Callable[[], None]] = None,
+                    label=None, **kwargs):
+        """Queue an arbitrary write `func(*args, **kwargs)`, e.g. into a partitioned store"""
+        if self._closed:
+            raise ValueError("Cannot submit to a closed BackgroundWriter")
+        self.pending.put((func, args, kwargs, on_written, label if label is not None else func.__name__))
+
+    def _work(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                func, args, kwargs, on_written, label = item
+                try:
+                    func(*args, **kwargs)
+                    if on_written is not None:
+                        on_written()
+                    with self._lock:
+                        self.written += 1
+                except Exception as e:
+                    self.logger.error(f"Failed to write {label}: {e}")
+                    with self._lock:
+                        self.errors.append((label, e))
+            finally:
+                self.pending.task_done()
+
+    def close(self) -> List[Tuple[Union[Path, str], Exception]]:
+        """Wait for every queued frame to be written and stop the workers. Returns the failed writes."""
+        if not self._closed:
+            self._closed = True
+            for _ in self.workers:
+                self.pending.put(None)
+            for worker in self.workers:
+                worker.join()
+        return self.errors
@@ -1,2 +1,3 @@
 from .MarketData import *
+from .Storage import *
 from .Getters import *
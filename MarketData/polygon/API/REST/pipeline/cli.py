@@ -0,0 +1,121 @@
+"""
+Command line entry point of the pipeline, `polygon-md`:
+
+    python -m API.REST.pipeline.cli [--config main_config.yaml] backfill aggregates --tickers AAPL MSFT
+    python -m API.REST.pipeline.cli latest grouped_daily
+    python -m API.REST.pipeline.cli plan universe_aggregates --mode historical
+
+`backfill` runs a job in historical mode over the range of its run config, `latest`
+brings it up to today; with `--dry-run` either prints the request plan instead (as
+`plan` does): requests, expected pages and bytes, and the wall time at the configured
+rate limit and concurrency, without calling the API.
+"""
+import os
+import sys
+import logging
+import argparse
+from pathlib import Path
+from typing import Optional, List
+from .Getters.main import EnhancedTaskRabbit
+
+# jobs run by backfill/latest, with the ones taking the bar timespan as first argument
+MODE_JOBS = ["grouped_daily", "aggregates", "aggregates_queue", "universe_aggregates", "trades", "quotes"]
+TIMESPAN_JOBS = ["aggregates", "aggregates_queue"]
+PLAN_JOBS = ["grouped_daily", "aggregates", "universe_aggregates"]
+
+
+def _read_tickers(args) -> Optional[List[str]]:
+    tickers = list(args.tickers or [])
+    if args.tickers_file:
+        tickers += [line.strip() for line in Path(args.tickers_file).read_text().splitlines() if line.strip()]
+    return tickers or None
+
+
+def _get_rabbit(args, dry_run: bool) -> EnhancedTaskRabbit:
+    api_key = args.api_key or os.environ.get("POLYGON_API_KEY")
+    # a plan never calls the API, so it runs without a key; otherwise the keyring is the fallback
+    client_params = {"client_params": {"api_key": api_key or ("dry-run" if dry_run else None)}}
+    rabbit = EnhancedTaskRabbit(args.config, client_params=client_params)
+    if args.run_config:
+        config_job = "aggregates" if args.job in ["aggregates_queue", "universe_aggregates"] else args.job
+        rabbit.params_config.setdefault(config_job, {})["run_config_file"] = args.run_config
+    return rabbit
+
+
+def _plan(args, mode: str) -> int:
+    if args.job not in PLAN_JOBS:
+        raise ValueError(f"Invalid job {args.job} to plan, should be one of {PLAN_JOBS}")
+    rabbit = _get_rabbit(args, dry_run=True)
+    plan = rabbit.get_job_plan(args.job, mode=mode, overwrite_existing=args.overwrite,
+                               tickers=_read_tickers(args), timespan=args.timespan)
+    print(plan.to_string(max_rows=args.max_rows))
+    return 0
+
+
+def _run(args, mode: str) -> int:
+    if args.dry_run:
+        return _plan(args, mode)
+    if args.job not in MODE_JOBS:
+        raise ValueError(f"Invalid job {args.job}, should be one of {MODE_JOBS}")
+    rabbit = _get_rabbit(args, dry_run=False)
+    job_args = [args.timespan] if args.job in TIMESPAN_JOBS else []
+    kwargs = {"mode": mode, "overwrite_existing": args.overwrite}
+    tickers = _read_tickers(args)
+    if tickers is not None:
+        if args.job == "grouped_daily":
+            raise ValueError("Invalid --tickers, grouped daily covers the whole market")
+        kwargs["tickers"] = tickers
+    if args.job == "aggregates_queue":
+        kwargs.update(role=args.role, worker_id=args.worker_id)
+    result = rabbit.get_data(args.job, *job_args, **kwargs)
+    if result is not None:
+        print(result)
+    return 0
+
+
+def _add_job_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("job", help=f"job name, one of {MODE_JOBS}")
+    parser.add_argument("--tickers", nargs="+", help="tickers to fetch instead of the run config's")
+    parser.add_argument("--tickers-file", help="file with one ticker per line")
+    parser.add_argument("--timespan", default="minute", help="bar timespan of the aggregates jobs")
+    parser.add_argument("--overwrite", action="store_true", help="fetch sessions that are already stored")
+    parser.add_argument("--run-config", help="run config file, instead of the one in the main config")
+    parser.add_argument("--max-rows", type=int, default=20, help="requests listed by a plan")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="polygon-md", description="Polygon market data pipeline")
+    parser.add_argument("--config", default=str(Path(__file__).parent / "Getters" / "main_config.yaml"),
+                        help="main config file")
+    parser.add_argument("--api-key", help="Polygon API key (default: $POLYGON_API_KEY, then the keyring)")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for command, mode in [("backfill", "historical"), ("latest", "latest")]:
+        subparser = commands.add_parser(command, help=f"run a job in {mode} mode")
+        _add_job_arguments(subparser)
+        subparser.add_argument("--dry-run", action="store_true", help="print the request plan and exit")
+        subparser.add_argument("--role", default="coordinator", choices=["coordinator", "worker"],
+                               help="role in an aggregates_queue job")
+        subparser.add_argument("--worker-id", help="worker id in an aggregates_queue job")
+        subparser.set_defaults(func=lambda args, mode=mode: _run(args, mode))
+
+    subparser = commands.add_parser("plan", help="print the request plan of a job without running it")
+    _add_job_arguments(subparser)
+    subparser.add_argument("--mode", default="historical", choices=["historical", "latest"])
+    subparser.set_defaults(func=lambda args: _plan(args, args.mode))
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        return args.func(args)
+    except ValueError as e:
+        logging.getLogger(__name__).error(e)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
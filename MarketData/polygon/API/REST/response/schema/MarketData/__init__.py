@@ -4,3 +4,4 @@ from .dailyOpenClose import *
 from .groupedDaily import *
 from .previousClose import *
 from .snapshots import *
+from .ticks import *
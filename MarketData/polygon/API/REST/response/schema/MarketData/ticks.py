@@ -0,0 +1,31 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+import pandas as pd
+import pyarrow as pa
+
+@dataclass
+class TicksResponse:
+    """A page of /v3/trades or /v3/quotes results, kept as the raw records"""
+    status: str
+    request_id: str
+    next_url: Optional[str] = None
+    results: List[dict] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional['TicksResponse']:
+        if data.get('status') != 'OK':
+            print(f"Error: Response status is {data.get('status')}")
+            return None
+
+        return cls(
+            status=data.get('status', ''),
+            request_id=data.get('request_id', ''),
+            next_url=data.get('next_url'),
+            results=data.get('results', [])
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        # nanosecond timestamps do not fit a float64: fields missing from some records must
+        # not turn their column into floats, so integers become nullable Int64
+        table = pa.Table.from_pylist(self.results)
+        return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
@@ -1,39 +1,195 @@
+import threading
+import numpy as np
 import pandas as pd
 import datetime as dt
-from typing import Union
+from typing import Union, Dict, Tuple
 import pandas_market_calendars as mcal
 
 # def get_market_calendar(market_name: str = "NYSE"):
 #     return mcal.get_calendar(market_name)
 
 
-# def get_market_days(market_name: str, 
-#                     start_date: Union[str, dt.datetime, pd.Timestamp], 
+# def get_market_days(market_name: str,
+#                     start_date: Union[str, dt.datetime, pd.Timestamp],
 #                     end_date: Union[str, dt.datetime, pd.Timestamp]):
 #     market_calendar = get_market_calendar(market_name)
 #     return market_calendar.schedule(start_date, end_date).index
 
+DateLike = Union[str, dt.datetime, pd.Timestamp]
+HOURS_TZ = "US/Eastern"
+HOURS_COLUMNS = ["pre", "market_open", "market_close", "post"]
+NS_PER_DAY = 86_400 * 10**9
+
+# session tables are shared by every MarketTime of a process: (market, start, end) -> table
+_tables: Dict[Tuple[str, pd.Timestamp, pd.Timestamp], Tuple[np.ndarray, Dict[str, np.ndarray]]] = {}
+_tables_lock = threading.Lock()
+
 
 class MarketTime:
-    def __init__(self, market_name: str = "NYSE"):
-        self.market_name = market_name
+    """
+    Trading calendar of `market_name`, precomputed once as a session table.
+
+    The table covers [start_date, end_date] (by default 1990 to the end of the year ten
+    years ahead) and holds, per session in order, its date as int64 nanoseconds (naive
+    midnight) and the int64 UTC nanoseconds of its pre-market start, open, close and
+    after-hours end; a session's ordinal is its position. Queries are `searchsorted`
+    over these arrays and take a single date or a whole array of them: `is_session`,
+    `session_index`, `next_session`, `previous_session` and `trading_days_between`
+    raise for dates outside the table, `get_market_days` and `get_detail_hours` fall
+    back to building the schedule with `pandas_market_calendars`.
+    """
+
+    def __init__(self,
+                 market_name: str = "NYSE",
+                 start_date: DateLike = "1990-01-01",
+                 end_date: DateLike = None):
+        self.market_name = market_name or "NYSE"
         self.market_calendar = self.get_market_calendar()
+        self.start_date = pd.Timestamp(start_date).normalize().as_unit("ns")
+        self.end_date = (pd.Timestamp(end_date).normalize() if end_date is not None
+                         else pd.Timestamp(dt.date.today().year + 10, 12, 31)).as_unit("ns")
+        self._table = None
 
     def get_market_calendar(self):
         return mcal.get_calendar(self.market_name)
 
-    def get_market_days(self, 
-                        start_date: Union[str, dt.datetime, pd.Timestamp], 
+    @property
+    def table(self) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """`(sessions, hours)`: session dates and pre/open/close/post times, as int64 nanoseconds"""
+        if self._table is None:
+            key = (self.market_name, self.start_date, self.end_date)
+            with _tables_lock:
+                if key not in _tables:
+                    _tables[key] = self._build_table()
+            self._table = _tables[key]
+        return self._table
+
+    def _build_table(self) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        schedule = self.market_calendar.schedule(self.start_date, self.end_date, start="pre", end="post")
+        sessions = schedule.index.as_unit("ns").asi8
+        hours = {column: schedule[column].dt.tz_convert("UTC").dt.as_unit("ns").array.asi8
+                 for column in HOURS_COLUMNS}
+        return sessions, hours
+
+    @property
+    def sessions(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.table[0].view("M8[ns]"))
+
+    def _to_ns(self, dates) -> Union[int, np.ndarray]:
+        """Session date(s) of `dates` as naive midnight nanoseconds; aware times are taken in the exchange's zone"""
+        if np.ndim(dates) == 0:
+            date = pd.Timestamp(dates)
+            if date.tzinfo is not None:
+                date = date.tz_convert(self.market_calendar.tz).tz_localize(None)
+            value = date.as_unit("ns").value
+            # naive nanoseconds: flooring to the day is `normalize` without its overhead
+            return value - value % NS_PER_DAY
+        dates = pd.DatetimeIndex(dates)
+        if dates.tz is not None:
+            dates = dates.tz_convert(self.market_calendar.tz).tz_localize(None)
+        return dates.normalize().as_unit("ns").asi8
+
+    def _check_range(self, values):
+        if np.ndim(values) == 0:
+            low = high = values
+        elif len(values):
+            low, high = values.min(), values.max()
+        else:
+            return
+        if low < self.start_date.value or high > self.end_date.value:
+            raise ValueError(f"Invalid date, outside the precomputed {self.market_name} calendar "
+                             f"{self.start_date.date()} to {self.end_date.date()}")
+
+    def _in_table(self, start_date: DateLike, end_date: DateLike) -> bool:
+        return self._to_ns(start_date) >= self.start_date.value and self._to_ns(end_date) <= self.end_date.value
+
+    def _window(self, start_date: DateLike, end_date: DateLike) -> slice:
+        sessions = self.table[0]
+        return slice(int(np.searchsorted(sessions, self._to_ns(start_date), side="left")),
+                     int(np.searchsorted(sessions, self._to_ns(end_date), side="right")))
+
+    def get_market_days(self,
+                        start_date: Union[str, dt.datetime, pd.Timestamp],
                         end_date: Union[str, dt.datetime, pd.Timestamp]):
-        return self.market_calendar.schedule(start_date, end_date).index
-    
-    def get_detail_hours(self, 
-                         start_date: Union[str, dt.datetime, pd.Timestamp], 
-                         end_date: Union[str, dt.datetime, pd.Timestamp]):
-        return (self.market_calendar
-                    .schedule(start_date, end_date)
-                    .apply(lambda x: x.dt.tz_convert('US/Eastern')))
-
-    def is_market_open(self, 
+        if not self._in_table(start_date, end_date):
+            # nanoseconds like the table, whatever unit the schedule comes in
+            return self.market_calendar.schedule(start_date, end_date).index.as_unit("ns")
+        return pd.DatetimeIndex(self.table[0][self._window(start_date, end_date)].view("M8[ns]"))
+
+    def get_detail_hours(self,
+                         start_date: Union[str, dt.datetime, pd.Timestamp],
+                         end_date: Union[str, dt.datetime, pd.Timestamp],
+                         extended: bool = False):
+        """
+        Open and close of every session; with `extended`, also the start of pre-market
+        (`pre`) and the end of after-hours trading (`post`), which follow early closes
+        """
+        columns = HOURS_COLUMNS if extended else ["market_open", "market_close"]
+        if not self._in_table(start_date, end_date):
+            schedule = (self.market_calendar.schedule(start_date, end_date, start="pre", end="post")
+                        if extended else self.market_calendar.schedule(start_date, end_date))
+            hours = schedule[columns].apply(lambda x: x.dt.tz_convert(HOURS_TZ).dt.as_unit("ns"))
+            hours.index = hours.index.as_unit("ns")
+            return hours
+        sessions, hours = self.table
+        window = self._window(start_date, end_date)
+        # converting each column as a whole, from int64 UTC, instead of per value
+        return pd.DataFrame({column: pd.DatetimeIndex(hours[column][window].view("M8[ns]"))
+                                       .tz_localize("UTC").tz_convert(HOURS_TZ)
+                             for column in columns},
+                            index=pd.DatetimeIndex(sessions[window].view("M8[ns]")))
+
+    def is_session(self, dates):
+        """Whether each of `dates` (a date, timestamp or array of them) is a trading session"""
+        return self.session_index(dates) >= 0
+
+    def is_market_open(self,
                        date: Union[str, dt.datetime, pd.Timestamp]):
-        return self.market_calendar.is_session(date)
+        return self.is_session(date)
+
+    def session_index(self, dates):
+        """Ordinal of the session of each of `dates` in the table, -1 where it is not a session"""
+        values = self._to_ns(dates)
+        self._check_range(values)
+        sessions = self.table[0]
+        if np.ndim(values) == 0:
+            position = int(sessions.searchsorted(values))
+            return position if position < len(sessions) and sessions[position] == values else -1
+        position = np.searchsorted(sessions, values)
+        found = sessions[np.minimum(position, len(sessions) - 1)] == values
+        return np.where(found, position, -1)
+
+    def _session_at(self, position):
+        sessions = self.table[0]
+        if np.ndim(position) == 0:
+            if not 0 <= position < len(sessions):
+                raise ValueError(f"Invalid date, no session within the precomputed {self.market_name} calendar "
+                                 f"{self.start_date.date()} to {self.end_date.date()}")
+            return pd.Timestamp(int(sessions[position]))
+        if np.any(position < 0) or np.any(position >= len(sessions)):
+            raise ValueError(f"Invalid date, no session within the precomputed {self.market_name} calendar "
+                             f"{self.start_date.date()} to {self.end_date.date()}")
+        return pd.DatetimeIndex(sessions[position].view("M8[ns]"))
+
+    def next_session(self, dates, inclusive: bool = False):
+        """First session after each of `dates` (or on it, if `inclusive`)"""
+        values = self._to_ns(dates)
+        self._check_range(values)
+        position = self.table[0].searchsorted(values, side="left" if inclusive else "right")
+        return self._session_at(position)
+
+    def previous_session(self, dates, inclusive: bool = False):
+        """Last session before each of `dates` (or on it, if `inclusive`)"""
+        values = self._to_ns(dates)
+        self._check_range(values)
+        position = self.table[0].searchsorted(values, side="right" if inclusive else "left") - 1
+        return self._session_at(position)
+
+    def trading_days_between(self, start_dates, end_dates):
+        """Number of sessions in [start, end], for single dates or element-wise for arrays of them"""
+        starts, ends = self._to_ns(start_dates), self._to_ns(end_dates)
+        self._check_range(starts)
+        self._check_range(ends)
+        sessions = self.table[0]
+        count = sessions.searchsorted(ends, side="right") - sessions.searchsorted(starts, side="left")
+        return max(int(count), 0) if np.ndim(count) == 0 else np.maximum(count, 0)